@@ -0,0 +1,61 @@
+# On-disk cache of artifacts derived from a source file (compiled policies, parsed
+# schemas). Artifacts are pickled next to the source in __pycache__, the way Python
+# caches bytecode, and are keyed by a hash of everything they were derived from:
+# a stale artifact is simply recompiled and overwritten.
+import hashlib
+import os
+import pickle
+
+# bump whenever the pickled classes change shape
+ARTIFACT_VERSION = 2
+
+
+def content_hash(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(hashlib.sha256(part).digest())
+    return digest.hexdigest()
+
+
+def artifact_path(source_path, kind, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(source_path)), '__pycache__')
+    name = os.path.basename(source_path).strip().replace(' ', '_')
+    return os.path.join(cache_dir, '%s.%s.pickle' % (name, kind))
+
+
+def load_artifact(path, key):
+    # the cached value, or None if there is none or it was derived from other inputs
+    try:
+        with open(path, 'rb') as f:
+            header = pickle.load(f)
+            if header != (ARTIFACT_VERSION, key):
+                return None
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+
+
+def store_artifact(path, key, value):
+    # written to a temporary file first, so a concurrent reader never sees half of it
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        pickle.dump((ARTIFACT_VERSION, key), f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def cached(source_path, kind, key, build, cache_dir=None):
+    # load the artifact for key, or build it and store it
+    path = artifact_path(source_path, kind, cache_dir)
+    value = load_artifact(path, key)
+    if value is None:
+        value = build()
+        try:
+            store_artifact(path, key, value)
+        except OSError:
+            pass
+    return value
@@ -0,0 +1,324 @@
+# Batch evaluation of a planned graph over columnar tables, used to populate every
+# view before incremental maintenance starts. A table is a dict of column name to
+# NumPy array, all of the same length; each operator is evaluated for the whole
+# table at once instead of row by row.
+import numpy as np
+import universes
+from executor import TRANSFORM_FLAG, column_name, get_column, literal_value, probe_column, probed_view
+from predicate import IN, NOT_IN, REWRITE, parse_operand
+
+# views computed for a batch of universes carry the user they belong to in this column
+UID_COLUMN = '__uid'
+
+
+def table_length(table):
+    for values in table.values():
+        return len(values)
+    return 0
+
+
+def columnar(rows):
+    columns = {}
+    for row in rows:
+        for name in row:
+            columns.setdefault(name, [])
+    for name, values in columns.items():
+        values.extend(row.get(name) for row in rows)
+    return {name: np.array(values) for name, values in columns.items()}
+
+
+def to_rows(table):
+    names = list(table.keys())
+    return [dict(zip(names, values)) for values in zip(*(table[name].tolist() for name in names))]
+
+
+def select(table, mask):
+    return {name: values[mask] for name, values in table.items()}
+
+
+def column_values(table, column):
+    values = get_column(table, column)
+    if values is None:
+        return np.full(table_length(table), None, dtype=object)
+    return values
+
+
+def operand_values(operand, table, uid):
+    if operand.is_param:
+        return np.full(table_length(table), uid)
+    if operand.is_literal:
+        return np.full(table_length(table), literal_value(operand.text))
+    return column_values(table, operand.column)
+
+
+def union(tables):
+    # concatenates the inputs' rows, as the executor passes whole rows on. a column
+    # an input lacks is None on its rows, which is what get_column reads for it there
+    if len(tables) == 1:
+        return tables[0]
+    names = []
+    for table in tables:
+        names.extend(name for name in table if name not in names)
+    return {name: np.concatenate([table[name] if name in table else np.full(table_length(table), None, dtype=object)
+                                  for table in tables]) for name in names}
+
+
+def factorize(*arrays):
+    # integer codes for the values of several arrays, shared between them. object
+    # arrays can hold None or mix types, which do not sort; their values are coded
+    # by equality, as the executor compares them
+    if all(np.issubdtype(array.dtype, np.integer) for array in arrays):
+        low = min((array.min() for array in arrays if len(array) > 0), default=0)
+        return [array.astype(np.int64) - low for array in arrays]
+    values = np.concatenate(arrays)
+    if values.dtype == object:
+        codes = {}
+        inverse = np.fromiter((codes.setdefault(value, len(codes)) for value in values.tolist()),
+                              dtype=np.int64, count=len(values))
+    else:
+        _, inverse = np.unique(values, return_inverse=True)
+    split = np.cumsum([len(array) for array in arrays])[:-1]
+    return np.split(inverse.astype(np.int64), split)
+
+
+def isin(values, test):
+    a, b = factorize(values, test)
+    return np.isin(a, b)
+
+
+def groups(values):
+    # the distinct values and how often each occurs
+    codes, = factorize(values)
+    _, first, counts = np.unique(codes, return_index=True, return_counts=True)
+    return values[first], counts
+
+
+def membership(graph, node, inputs, uid, condition=False, catalog=None):
+    predicate = node.parsed
+    probe = probed_view(graph, node)
+    data = union([inputs[parent.name] for parent in graph.predecessors(node) if parent.name != probe])
+    left = operand_values(predicate.left, data, uid)
+    if probe is None:
+        mask = left == operand_values(predicate.right, data, uid)
+    else:
+        mask = isin(left, column_values(inputs[probe], probe_column(node, graph, catalog)))
+    mask = np.asarray(mask, dtype=bool)
+    if predicate.kind == NOT_IN:
+        mask = ~mask
+
+    if not condition:
+        return select(data, mask)
+    out = dict(data)
+    out[TRANSFORM_FLAG] = data.get(TRANSFORM_FLAG, np.ones(len(mask), dtype=bool)) & mask
+    return out
+
+
+def rewrite(node, table):
+    out = dict(table)
+    flag = out.pop(TRANSFORM_FLAG, np.ones(table_length(table), dtype=bool))
+    name = column_name(table, node.parsed.left.column)
+    values = column_values(table, name).astype(object)
+    values[flag] = literal_value(node.parsed.right.text)
+    out[name] = values
+    return out
+
+
+def count(node, table):
+    if node.operation_type != 'count(*)':
+        raise NotImplementedError(node.operation_type)
+    if node.groupby is None:
+        return {'count': np.array([table_length(table)])}
+    groupby = parse_operand(node.groupby).column
+    values, counts = groups(column_values(table, groupby))
+    return {groupby: values, 'count': counts}
+
+
+def evaluate(graph, node, views, uid=None, catalog=None):
+    parents = [views[parent.name] for parent in graph.predecessors(node)]
+    if node.operation_type == 'filter' and node.parsed is None:
+        return union(parents)
+    elif node.operation_type == 'filter':
+        return membership(graph, node, views, uid, catalog=catalog)
+    elif node.operation_type == 'transform' and node.parsed.kind == REWRITE:
+        return rewrite(node, union(parents))
+    elif node.operation_type == 'transform':
+        return membership(graph, node, views, uid, condition=True, catalog=catalog)
+    else:
+        return count(node, union(parents))
+
+
+def backfill(graph, tables, uid=None, catalog=None):
+    # tables maps base table names to columnar tables; returns every view
+    views = {}
+    for node in graph.topological_order():
+        if node.operation_type is None:
+            views[node.name] = tables[node.name]
+        else:
+            views[node.name] = evaluate(graph, node, views, uid, catalog)
+    return views
+
+
+# Universe batched evaluation: instead of evaluating the graph once per user, $UID is
+# treated as a column. Global nodes are computed once as above; per-universe nodes
+# hold the rows of every user in the batch, tagged with UID_COLUMN, and predicates
+# on $UID become joins against the batch of user ids.
+
+def is_batched(table):
+    return UID_COLUMN in table
+
+
+def expand(table, uids):
+    # a global view seen from every universe in the batch
+    if is_batched(table):
+        return table
+    n = table_length(table)
+    out = {name: np.tile(values, len(uids)) for name, values in table.items()}
+    out[UID_COLUMN] = np.repeat(uids, n)
+    return out
+
+
+def pair_codes(uids, uids_a, keys_a, uids_b, keys_b):
+    # one integer per (uid, key) pair, comparable between a and b. uids is the
+    # sorted batch, so a user's position in it is found without sorting the rows.
+    ka, kb = factorize(keys_a, keys_b)
+    width = max(ka.max(initial=-1), kb.max(initial=-1)) + 1
+    return np.searchsorted(uids, uids_a) * width + ka, np.searchsorted(uids, uids_b) * width + kb
+
+
+def batched_values(operand, table):
+    if operand.is_param:
+        return table[UID_COLUMN]
+    return operand_values(operand, table, None)
+
+
+def join(keys, probe_keys):
+    # positions of every (key, probe key) match: for each probe key in turn, the
+    # indices of the equal keys. returns (key positions, probe positions)
+    key_codes, probe_codes = factorize(keys, probe_keys)
+    order = np.argsort(key_codes, kind='stable')
+    sorted_codes = key_codes[order]
+    lo = np.searchsorted(sorted_codes, probe_codes, side='left')
+    hi = np.searchsorted(sorted_codes, probe_codes, side='right')
+    counts = hi - lo
+    starts = np.repeat(lo, counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return order[starts + offsets], np.repeat(np.arange(len(probe_keys)), counts)
+
+
+def global_matches(predicate, data, probe_table, probe_keys, uids):
+    # for a global input, the (row, universe) pairs a $UID predicate or a probe of a
+    # per-universe view matches, found by joining against the batch instead of
+    # evaluating the predicate on a copy of the input per universe. returns
+    # (row positions, uid positions) or None if the predicate is not such a join.
+    left, right = predicate.left, predicate.right
+    if probe_table is None:
+        if left.is_param and right.column is not None:
+            values = column_values(data, right.column)
+        elif right.is_param and left.column is not None:
+            values = column_values(data, left.column)
+        else:
+            return None
+        rows = np.nonzero(isin(values, uids))[0]
+        return rows, np.searchsorted(uids, values[rows])
+
+    if left.is_param or not is_batched(probe_table):
+        return None
+    # each universe's probed view is a set: drop repeated (uid, key) pairs
+    probe_uids = probe_table[UID_COLUMN]
+    pair, _ = pair_codes(uids, probe_uids, probe_keys, probe_uids[:0], probe_keys[:0])
+    _, first = np.unique(pair, return_index=True)
+    rows, matched = join(batched_values(left, data), probe_keys[first])
+    return rows, np.searchsorted(uids, probe_uids[first][matched])
+
+
+def membership_universes(graph, node, views, uids, condition=False, catalog=None):
+    predicate = node.parsed
+    left, right = predicate.left, predicate.right
+    probe = probed_view(graph, node)
+    parents = [views[parent.name] for parent in graph.predecessors(node) if parent.name != probe]
+    if any(is_batched(parent) for parent in parents):
+        parents = [expand(parent, uids) for parent in parents]
+    data = union(parents)
+    probe_table = None if probe is None else views[probe]
+    probe_keys = None if probe is None else column_values(probe_table, probe_column(node, graph, catalog))
+
+    matches = None if is_batched(data) else global_matches(predicate, data, probe_table, probe_keys, uids)
+    if matches is not None:
+        rows, positions = matches
+        if predicate.kind == IN and not condition:
+            out = select(data, rows)
+            out[UID_COLUMN] = uids[positions]
+            return out
+        # expand lays the universes out one after the other
+        mask = np.zeros(table_length(data) * len(uids), dtype=bool)
+        mask[positions * table_length(data) + rows] = True
+        data = expand(data, uids)
+    elif probe is None:
+        data = expand(data, uids)
+        mask = batched_values(left, data) == batched_values(right, data)
+    elif is_batched(probe_table):
+        data = expand(data, uids)
+        a, b = pair_codes(uids, data[UID_COLUMN], batched_values(left, data), probe_table[UID_COLUMN], probe_keys)
+        mask = np.isin(a, b)
+    else:
+        data = expand(data, uids)
+        mask = isin(batched_values(left, data), probe_keys)
+    mask = np.asarray(mask, dtype=bool)
+    if predicate.kind == NOT_IN:
+        mask = ~mask
+
+    if not condition:
+        return select(data, mask)
+    out = dict(data)
+    out[TRANSFORM_FLAG] = data.get(TRANSFORM_FLAG, np.ones(len(mask), dtype=bool)) & mask
+    return out
+
+
+def count_universes(node, table):
+    if node.operation_type != 'count(*)':
+        raise NotImplementedError(node.operation_type)
+    uid_values = table[UID_COLUMN]
+    if node.groupby is None:
+        values, counts = groups(uid_values)
+        return {UID_COLUMN: values, 'count': counts}
+    groupby = parse_operand(node.groupby).column
+    values = column_values(table, groupby)
+    pair, _ = pair_codes(np.unique(uid_values), uid_values, values, uid_values[:0], values[:0])
+    _, first, counts = np.unique(pair, return_index=True, return_counts=True)
+    return {UID_COLUMN: uid_values[first], groupby: values[first], 'count': counts}
+
+
+def backfill_universes(graph, tables, uids, catalog=None):
+    # evaluates the graph for every user in uids at once. global views are returned
+    # as they are; per-universe views have a UID_COLUMN saying whose row it is.
+    uids = np.unique(np.asarray(uids))
+    classes = universes.classify_universes(graph)
+    views = {}
+    for node in graph.topological_order():
+        if node.operation_type is None:
+            views[node.name] = tables[node.name]
+            continue
+        if classes[node.name] == universes.GLOBAL:
+            views[node.name] = evaluate(graph, node, views, catalog=catalog)
+            continue
+
+        parents = [views[parent.name] for parent in graph.predecessors(node)]
+        if node.operation_type == 'filter' and node.parsed is None:
+            views[node.name] = union([expand(parent, uids) for parent in parents])
+        elif node.operation_type == 'filter':
+            views[node.name] = membership_universes(graph, node, views, uids, catalog=catalog)
+        elif node.operation_type == 'transform' and node.parsed.kind == REWRITE:
+            views[node.name] = rewrite(node, union([expand(parent, uids) for parent in parents]))
+        elif node.operation_type == 'transform':
+            views[node.name] = membership_universes(graph, node, views, uids, condition=True, catalog=catalog)
+        else:
+            views[node.name] = count_universes(node, union([expand(parent, uids) for parent in parents]))
+    return views
+
+
+def universe_view(view, uid):
+    # the rows of one universe in a batched view
+    if not is_batched(view):
+        return view
+    mask = view[UID_COLUMN] == uid
+    return {name: values[mask] for name, values in view.items() if name != UID_COLUMN}
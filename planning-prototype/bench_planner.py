@@ -0,0 +1,132 @@
+# Planner benchmark: plans synthetic workloads (workload.py) of growing size and
+# records, per size point, the planning wall time, the peak memory allocated while
+# planning, the number of plans the search explored and the cost of the best plan.
+#
+#   python bench_planner.py --save-baseline baseline.json
+#   python bench_planner.py --baseline baseline.json
+#
+# Compared against a stored baseline, a size point regresses if it got slower or
+# used more memory by more than the tolerance, or if its best plan got more
+# expensive. The process exits with status 1 when anything regressed.
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+import planning
+import tracing
+import workload
+from cost import CostModel
+
+# (policies, queries, depth)
+SIZES = [(2, 1, 3), (4, 2, 3), (8, 4, 3), (16, 8, 4), (32, 16, 4)]
+
+# differences below these are noise whatever the tolerance
+MIN_TIME_DELTA = 0.005
+MIN_MEMORY_DELTA = 64 * 1024
+
+
+def run_point(policies, queries, depth, seed=0, search='best-first', max_expansions=None, time_budget=None,
+              repeat=3):
+    cost_function = CostModel()
+    times = []
+    w = workload.generate_workload(policies, queries, depth, seed=seed)
+    for _ in range(repeat):
+        start = time.perf_counter()
+        plans = planning.planning(w.queries, w.policies, search=search, cost_function=cost_function,
+                                  max_expansions=max_expansions, time_budget=time_budget)
+        times.append(time.perf_counter() - start)
+    counters = tracing.stats()['counters']
+
+    # memory is measured on a separate run: tracing allocations slows planning down
+    tracemalloc.start()
+    planning.planning(w.queries, w.policies, search=search, cost_function=cost_function,
+                      max_expansions=max_expansions, time_budget=time_budget)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    best = min(plans, key=cost_function)
+    return {
+        'size': '%dp-%dq-d%d' % (policies, queries, depth),
+        'policies': policies,
+        'queries': queries,
+        'depth': depth,
+        'nodes': len(best),
+        'time': min(times),
+        'peak_memory': peak,
+        'explored': counters.get('plans_explored', 0),
+        'expansions': counters.get('expansions', 0),
+        'commutativity_checks': counters.get('commutativity_checks', 0),
+        'swaps_accepted': counters.get('swaps_accepted', 0),
+        'plans': len(plans),
+        'cost': cost_function(best),
+    }
+
+
+def run(sizes=SIZES, **options):
+    # results are yielded as each size point finishes
+    for policies, queries, depth in sizes:
+        yield run_point(policies, queries, depth, **options)
+
+
+def regressions(result, baseline, tolerance):
+    # reasons result is worse than the baseline entry for the same size
+    reasons = []
+    if result['time'] > baseline['time'] * (1 + tolerance) and result['time'] - baseline['time'] > MIN_TIME_DELTA:
+        reasons.append('time %.4fs -> %.4fs' % (baseline['time'], result['time']))
+    if (result['peak_memory'] > baseline['peak_memory'] * (1 + tolerance)
+            and result['peak_memory'] - baseline['peak_memory'] > MIN_MEMORY_DELTA):
+        reasons.append('memory %d -> %d' % (baseline['peak_memory'], result['peak_memory']))
+    if result['cost'] > baseline['cost'] * (1 + 1e-9):
+        reasons.append('cost %s -> %s' % (baseline['cost'], result['cost']))
+    return reasons
+
+
+def parse_size(text):
+    policies, queries, depth = (int(part) for part in text.split(','))
+    return policies, queries, depth
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the planner on synthetic workloads.')
+    parser.add_argument('--size', type=parse_size, action='append', default=None,
+                        help='policies,queries,depth; may be repeated')
+    parser.add_argument('--search', type=str, default='best-first', choices=['exhaustive', 'best-first'])
+    parser.add_argument('--max-expansions', type=int, default=500)
+    parser.add_argument('--time-budget', type=float, default=None, help='seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', type=str, default=None, help='compare against this baseline')
+    parser.add_argument('--save-baseline', type=str, default=None, help='write the results as a baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative slowdown')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = {entry['size']: entry for entry in json.load(f)['results']}
+
+    options = {'seed': args.seed, 'search': args.search, 'max_expansions': args.max_expansions,
+               'time_budget': args.time_budget, 'repeat': args.repeat}
+    results = []
+    regressed = False
+    print('%-14s %6s %10s %12s %9s %12s  %s' % ('size', 'nodes', 'time', 'peak memory', 'explored', 'cost', ''))
+    for result in run(args.size or SIZES, **options):
+        results.append(result)
+        reasons = []
+        if result['size'] in baseline:
+            reasons = regressions(result, baseline[result['size']], args.tolerance)
+            regressed = regressed or len(reasons) > 0
+        print('%-14s %6d %9.4fs %12d %9d %12.1f  %s' % (
+            result['size'], result['nodes'], result['time'], result['peak_memory'], result['explored'],
+            result['cost'], 'REGRESSION: ' + ', '.join(reasons) if len(reasons) > 0 else ''))
+        sys.stdout.flush()
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'options': options, 'results': results}, f, indent=2)
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -60,6 +60,8 @@ final_join = Filter("Final",
 
 hotcrp_query_nodes = [paper_paperreview, r_submitted, final_join]
 
+hotcrp_queries = [hotcrp_query_nodes]
+
 
 # Twitter policies: --------------------------------------------
 
@@ -120,4 +122,6 @@ tweets_with_user_info = Filter("TweetsWithUserInfo", ["Tweets", "Users"], ["Twee
 retweets = Filter("Retweets", ["TweetsWithUserInfo"], ["TweetsWithUserInfo.retweet_id IN TweetsWithUserInfo.rt_id"], policy=False) # WRONG: no edge from tweets with user info to retweets
 all_tweets = Filter("AllTweets", ["TweetsWithUserInfo", "Retweets"], [], policy=False)
 
-twitter_full_query = [tweets_with_user_info, retweets, all_tweets]
\ No newline at end of file
+twitter_full_query = [tweets_with_user_info, retweets, all_tweets]
+
+twitter_queries = [twitter_full_query]
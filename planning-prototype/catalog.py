@@ -0,0 +1,270 @@
+# Schema catalog: the tables of a schema.sql file with their column types, keys and
+# indexes. The DDL is parsed once and the catalog is cached on disk keyed by the
+# file's hash (see artifacts.py). Lookups by table and column name are dict lookups
+# and are case insensitive, since queries and policies do not agree with the DDL
+# on the case of names (paperID, paperId).
+#
+# A Catalog can be used wherever the planner used the schema dict returned by the
+# old load_schema: "table in catalog", catalog[table] (the column names) and
+# catalog.items() behave the same.
+import re
+import artifacts
+
+# bump when a change to the parser changes the catalog it builds
+CATALOG_VERSION = 2
+
+# estimated bytes per value; variable length columns are assumed half full
+TYPE_WIDTHS = {
+    'bit': 1, 'bool': 1, 'boolean': 1, 'tinyint': 1, 'smallint': 2, 'mediumint': 3,
+    'int': 4, 'integer': 4, 'bigint': 8, 'float': 4, 'double': 8, 'real': 8,
+    'date': 3, 'time': 3, 'year': 1, 'datetime': 8, 'timestamp': 4,
+}
+VARIABLE_TYPES = {'char', 'varchar', 'binary', 'varbinary'}
+LONG_TYPES = {'text', 'tinytext', 'mediumtext', 'longtext', 'blob', 'tinyblob', 'mediumblob', 'longblob', 'json'}
+LONG_WIDTH = 256
+DEFAULT_WIDTH = 8
+DEFAULT_ROW_WIDTH = 64
+
+CREATE_PATTERN = re.compile(r'CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?[`"]?(\w+)[`"]?\s*\(', re.IGNORECASE)
+COLUMN_PATTERN = re.compile(r'^[`"]?(\w+)[`"]?\s+(\w+)\s*(?:\(([^)]*)\))?(.*)$', re.IGNORECASE | re.DOTALL)
+KEY_PATTERN = re.compile(r'^(PRIMARY[\s_]+KEY|UNIQUE(?:\s+(?:KEY|INDEX))?|KEY|INDEX|FULLTEXT(?:\s+(?:KEY|INDEX))?)\b'
+                         r'\s*(?:[`"]?\w+[`"]?\s*)?\(([^)]*)\)', re.IGNORECASE)
+FOREIGN_PATTERN = re.compile(r'^FOREIGN\s+KEY\s*\(?([^)]*?)\)?\s+REFERENCES\s+[`"]?(\w+)[`"]?\s*\(([^)]*)\)', re.IGNORECASE)
+# quoted strings are matched so that the comment markers in them are kept
+COMMENT_PATTERN = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`|--[^\n]*|#[^\n]*|/\*.*?\*/", re.DOTALL)
+CONSTRAINT_WORDS = ('CONSTRAINT', 'CHECK')
+
+
+class Column:
+    __slots__ = ('name', 'type', 'length', 'nullable', 'auto_increment', 'width')
+
+    def __init__(self, name, type, length=None, nullable=True, auto_increment=False):
+        self.name = name
+        self.type = type
+        self.length = length
+        self.nullable = nullable
+        self.auto_increment = auto_increment
+        self.width = column_width(type, length)
+
+    def __repr__(self):
+        return "<Column: %s %s>" % (self.name, self.type if self.length is None else "%s(%s)" % (self.type, self.length))
+
+
+class Table:
+    # keys are tuples of column names; indexes include the primary and unique keys
+    __slots__ = ('name', 'columns', 'column_index', 'primary_key', 'unique_keys', 'indexes', 'foreign_keys',
+                 'row_width', 'leading')
+
+    def __init__(self, name):
+        self.name = name
+        self.columns = []
+        self.column_index = {}
+        self.primary_key = ()
+        self.unique_keys = []
+        self.indexes = []
+        self.foreign_keys = []
+        self.row_width = 0
+        self.leading = {}
+
+    def __repr__(self):
+        return "<Table: %s, columns: %s, primary key: %s>" % (self.name, [c.name for c in self.columns], self.primary_key)
+
+    def add_column(self, column):
+        self.columns.append(column)
+        self.column_index[column.name.lower()] = column
+        self.row_width += column.width
+
+    def column(self, name):
+        return self.column_index.get(name.lower())
+
+    def add_index(self, columns, unique=False, primary=False):
+        columns = tuple(self.column_name(c) for c in columns)
+        if primary:
+            self.primary_key = columns
+        if (unique or primary) and columns not in self.unique_keys:
+            self.unique_keys.append(columns)
+        if columns not in self.indexes:
+            self.indexes.append(columns)
+        # an index can look up any prefix of its columns; the leading column is the
+        # one lookups by a single column use. unique keys win over plain indexes.
+        lead = columns[0].lower()
+        if lead not in self.leading or ((unique or primary) and len(columns) == 1):
+            self.leading[lead] = columns
+
+    def column_name(self, name):
+        column = self.column(name)
+        return column.name if column is not None else name
+
+    def is_indexed(self, column):
+        return column.lower() in self.leading
+
+    def is_unique(self, columns):
+        # whether rows are identified by these columns
+        wanted = {c.lower() for c in columns}
+        return any({c.lower() for c in key} <= wanted for key in self.unique_keys)
+
+    def lookup_key(self):
+        # the columns a row is looked up by: the primary key, else the narrowest unique key
+        if len(self.primary_key) > 0:
+            return self.primary_key
+        if len(self.unique_keys) > 0:
+            return min(self.unique_keys, key=len)
+        return ()
+
+
+class Catalog:
+    __slots__ = ('tables', 'index', 'key')
+
+    def __init__(self, key=None):
+        self.tables = {}
+        self.index = {}
+        self.key = key
+
+    def __repr__(self):
+        return "<Catalog: %s>" % list(self.tables.keys())
+
+    # the schema dict interface: table name -> column names
+    def __contains__(self, name):
+        return name in self.tables
+
+    def __getitem__(self, name):
+        return [column.name for column in self.tables[name].columns]
+
+    def __iter__(self):
+        return iter(self.tables)
+
+    def __len__(self):
+        return len(self.tables)
+
+    def keys(self):
+        return self.tables.keys()
+
+    def items(self):
+        return [(name, self[name]) for name in self.tables]
+
+    def add_table(self, table):
+        self.tables[table.name] = table
+        self.index[table.name.lower()] = table
+
+    def table(self, name):
+        return self.index.get(name.lower())
+
+    def column(self, table, column):
+        table = self.table(table)
+        return None if table is None else table.column(column)
+
+    def row_width(self, table):
+        table = self.table(table)
+        return DEFAULT_ROW_WIDTH if table is None or table.row_width == 0 else table.row_width
+
+    def lookup_key(self, table):
+        table = self.table(table)
+        return () if table is None else table.lookup_key()
+
+    def is_indexed(self, table, column):
+        table = self.table(table)
+        return table is not None and table.is_indexed(column)
+
+
+def column_width(type, length):
+    if type in TYPE_WIDTHS:
+        return TYPE_WIDTHS[type]
+    if type in VARIABLE_TYPES:
+        try:
+            size = int(length)
+        except (TypeError, ValueError):
+            return DEFAULT_WIDTH
+        return size if type in ('char', 'binary') else max(size // 2, 1)
+    if type in LONG_TYPES:
+        return LONG_WIDTH
+    if type in ('decimal', 'numeric'):
+        return 8
+    return DEFAULT_WIDTH
+
+
+def split_definitions(body):
+    # the comma separated items of a CREATE TABLE, ignoring commas inside brackets
+    items = []
+    depth = 0
+    start = 0
+    for i, char in enumerate(body):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            items.append(body[start:i])
+            start = i + 1
+    items.append(body[start:])
+    return [' '.join(item.split()) for item in items if len(item.strip()) > 0]
+
+
+def table_body(text, start):
+    # the text between the opening bracket at start and the bracket closing it
+    depth = 1
+    for i in range(start, len(text)):
+        if text[i] == '(':
+            depth += 1
+        elif text[i] == ')':
+            depth -= 1
+            if depth == 0:
+                return text[start:i]
+    return text[start:]
+
+
+def column_list(text):
+    return [name.strip().strip('`"') for name in text.split(',') if len(name.strip()) > 0]
+
+
+def parse_definition(table, item):
+    upper = item.upper()
+    if upper.startswith(CONSTRAINT_WORDS):
+        return
+    foreign = FOREIGN_PATTERN.match(item)
+    if foreign is not None:
+        table.foreign_keys.append((tuple(column_list(foreign.group(1))), foreign.group(2),
+                                   tuple(column_list(foreign.group(3)))))
+        return
+    if upper.startswith('FOREIGN'):
+        return
+    key = KEY_PATTERN.match(item)
+    if key is not None:
+        kind = key.group(1).upper()
+        table.add_index(column_list(key.group(2)), unique=kind.startswith('UNIQUE'), primary=kind.startswith('PRIMARY'))
+        return
+
+    column = COLUMN_PATTERN.match(item)
+    if column is None:
+        return
+    name, type, length, rest = column.groups()
+    rest = rest.upper()
+    table.add_column(Column(name, type.lower(), length, nullable='NOT NULL' not in rest,
+                            auto_increment='AUTO_INCREMENT' in rest))
+    if 'PRIMARY KEY' in rest:
+        table.add_index([name], primary=True)
+    elif re.search(r'\bUNIQUE\b', rest):
+        table.add_index([name], unique=True)
+
+
+def parse_ddl(text, key=None):
+    text = COMMENT_PATTERN.sub(lambda match: match.group(0) if match.group(0)[0] in '\'"`' else '', text)
+    catalog = Catalog(key)
+    for match in CREATE_PATTERN.finditer(text):
+        table = Table(match.group(1))
+        for item in split_definitions(table_body(text, match.end())):
+            parse_definition(table, item)
+        catalog.add_table(table)
+    return catalog
+
+
+def load_catalog(path, cache_dir=None, use_cache=True):
+    with open(path, 'rb') as f:
+        source = f.read()
+    key = artifacts.content_hash(source, str(CATALOG_VERSION))
+
+    def build():
+        return parse_ddl(source.decode('utf-8'), key)
+
+    if not use_cache:
+        return build()
+    return artifacts.cached(path, 'catalog', key, build, cache_dir)
@@ -0,0 +1,89 @@
+# Cost model for candidate dataflow plans. 
+# A cost function is any callable that maps a graph to a number; the planner 
+# prefers graphs with a lower cost. CostModel is the default estimate. 
+from catalog import DEFAULT_ROW_WIDTH 
+from dataflow import * 
+
+FILTER_SELECTIVITY = 0.5 
+USER_FILTER_SELECTIVITY = 0.01 
+AGGREGATE_SELECTIVITY = 0.1 
+
+
+def is_user_dependent(node): 
+    return node.parsed is not None and node.parsed.user_dependent 
+
+
+class NodeEstimate: 
+    __slots__ = ('rows', 'universes', 'state', 'update_work', 'fanout_penalty', 'width')
+
+    def __init__(self, rows, universes, state, update_work, fanout_penalty, width=DEFAULT_ROW_WIDTH): 
+        self.rows = rows 
+        self.universes = universes 
+        self.state = state 
+        self.update_work = update_work 
+        self.fanout_penalty = fanout_penalty 
+        self.width = width 
+
+    def __repr__(self): 
+        return "<NodeEstimate: rows: %s, universes: %s, state: %s, update work: %s, fanout penalty: %s, width: %s>" % (
+            self.rows, self.universes, self.state, self.update_work, self.fanout_penalty, self.width)
+
+    def total(self, state_weight, update_weight): 
+        return state_weight * self.state + update_weight * self.update_work + self.fanout_penalty 
+
+
+class CostModel: 
+    # every node downstream of a $UID-dependent node exists once per universe, so its 
+    # state and the work to maintain it are multiplied by the number of users. 
+    # user-dependent nodes that fan out to several children additionally pay a 
+    # penalty per extra child, since each of them is a per-universe copy as well. 
+    # given a schema catalog, state is counted in rows of DEFAULT_ROW_WIDTH bytes, so 
+    # wide tables cost more to materialize than narrow ones. 
+    def __init__(self, table_rows=None, default_rows=1000, universes=100, 
+                 state_weight=1.0, update_weight=1.0, fanout_penalty=1.0, catalog=None): 
+        self.table_rows = table_rows or {}
+        self.catalog = catalog 
+        self.default_rows = default_rows 
+        self.universes = universes 
+        self.state_weight = state_weight 
+        self.update_weight = update_weight 
+        self.fanout_penalty = fanout_penalty 
+
+    def __call__(self, graph): 
+        return sum(estimate.total(self.state_weight, self.update_weight) for estimate in self.estimate(graph).values())
+
+    def selectivity(self, node): 
+        if node.operation_type == "filter": 
+            if is_user_dependent(node): 
+                return USER_FILTER_SELECTIVITY 
+            return FILTER_SELECTIVITY 
+        elif node.operation_type == "transform": 
+            return 1.0 
+        return AGGREGATE_SELECTIVITY 
+
+    def estimate(self, graph): 
+        estimates = {}
+        for node in graph.topological_order(): 
+            parents = [estimates[parent.name] for parent in graph.predecessors(node)]
+            if node.operation_type is None: # base table 
+                rows = self.table_rows.get(node.name, self.default_rows)
+                width = DEFAULT_ROW_WIDTH if self.catalog is None else self.catalog.row_width(node.name)
+                estimates[node.name] = NodeEstimate(rows, 1, rows * width / DEFAULT_ROW_WIDTH, 0, 0, width)
+                continue 
+
+            rows_in = sum(parent.rows for parent in parents)
+            universes = max([parent.universes for parent in parents] + [1])
+            if is_user_dependent(node): 
+                universes = self.universes 
+
+            # the largest input is the one being filtered, the others are probed 
+            rows = max([parent.rows for parent in parents] + [0]) * self.selectivity(node)
+            fanout = len(graph.successors(node))
+            penalty = 0 
+            if universes > 1 and fanout > 1: 
+                penalty = self.fanout_penalty * (fanout - 1) * rows * universes 
+
+            width = max([parent.width for parent in parents] + [DEFAULT_ROW_WIDTH if len(parents) == 0 else 0])
+            state = rows * universes * width / DEFAULT_ROW_WIDTH 
+            estimates[node.name] = NodeEstimate(rows, universes, state, rows_in * universes, penalty, width)
+        return estimates 
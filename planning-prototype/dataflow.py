@@ -1,11 +1,19 @@
 # Intermediate representation of dataflow graph 
+import hashlib
+import sys
+import tracing
+from persistent import PersistentVector
+from predicate import REWRITE, parse_operand, parse_predicate, renamed_operand
 
 
 class Node: 
+    __slots__ = ('name', 'operation_type', 'policy', 'predicate', 'parsed', 'operation_on', 'groupby', 'exported_as')
+
     def __init__(self, name, operation_type, policy, predicate=None, operation_on=None, groupby=None, exported_as=None): 
-        self.name = name
+        self.name = sys.intern(name)
         self.operation_type = operation_type
-        self.predicate = predicate 
+        self.predicate = sys.intern(predicate) if isinstance(predicate, str) else predicate 
+        self.parsed = parse_predicate(self.predicate) if isinstance(predicate, str) else None 
         self.operation_on = operation_on 
         self.groupby = groupby
         self.policy = policy
@@ -13,11 +21,213 @@ class Node:
     
     def __repr__(self):
         return "< NODE: name: %s, optype: %s, predicate: %s>\n" % (self.name, self.operation_type, self.predicate)
-    
-    def check_commutativity(operations): 
-        left, right = self.predicate.split('IN')
-        left_table, left_col = left.split('.')
-        right_table, right_col = right.split('.')
+
+    def signature(self): 
+        return (self.name, self.operation_type, self.predicate, self.operation_on, self.groupby, self.policy, self.exported_as)
+
+    def __reduce__(self):
+        # unpickled nodes are rebuilt through __init__ so names stay interned and
+        # predicates share their parsed form
+        return (Node, (self.name, self.operation_type, self.policy, self.predicate, self.operation_on,
+                       self.groupby, self.exported_as))
+
+    def renamed(self, name):
+        return Node(name, self.operation_type, self.policy, predicate=self.predicate, operation_on=self.operation_on, 
+                    groupby=self.groupby, exported_as=self.exported_as)
+
+    def with_tables_renamed(self, names): 
+        # the same operation reading the views in names under their new names 
+        predicate = self.predicate if self.parsed is None else self.parsed.renamed(names)
+        operation_on = self.operation_on if self.operation_on is None else renamed_operand(self.operation_on, names)
+        groupby = self.groupby if self.groupby is None else renamed_operand(self.groupby, names)
+        return Node(self.name, self.operation_type, self.policy, predicate=predicate, operation_on=operation_on, 
+                    groupby=groupby, exported_as=self.exported_as)
+
+
+class Graph: 
+    # nodes live in a vector indexed by node id; names are unique and map to ids 
+    # through the index. forward and reverse adjacency are vectors of tuples of node 
+    # ids. removed nodes leave a None slot behind rather than renumbering. 
+    # 
+    # the vectors are persistent (see persistent.py): an update builds a new version 
+    # that shares every untouched slot with the old one, so copy() is O(1) and every 
+    # edge insert, edge removal or swap on the copy is O(log N) time and memory. the 
+    # plan search keeps thousands of candidate plans that differ by a few swaps. 
+    # the index is only shared until one of the graphs adds or removes a node; the 
+    # search never does. 
+    __slots__ = ('nodes', 'index', 'out_edges', 'in_edges', 'index_shared')
+
+    def __init__(self): 
+        self.nodes = PersistentVector()
+        self.index = {}
+        self.out_edges = PersistentVector()
+        self.in_edges = PersistentVector()
+        self.index_shared = False 
+
+    def __repr__(self): 
+        return repr(dict(self.items()))
+
+    def __len__(self): 
+        return len(self.index)
+
+    def __iter__(self): 
+        return iter(self.keys())
+
+    def __contains__(self, node): 
+        name = node.name if isinstance(node, Node) else node 
+        return name in self.index
+
+    def __getitem__(self, node): 
+        return self.successors(node)
+
+    def keys(self): 
+        return [node for node in self.nodes if node is not None]
+
+    def items(self): 
+        return [(node, self.successors(node)) for node in self.nodes if node is not None]
+
+    def copy(self): 
+        new_graph = Graph()
+        new_graph.nodes = self.nodes 
+        new_graph.index = self.index 
+        new_graph.out_edges = self.out_edges 
+        new_graph.in_edges = self.in_edges 
+        new_graph.index_shared = self.index_shared = True 
+        return new_graph
+
+    def own_index(self): 
+        if self.index_shared: 
+            self.index = dict(self.index)
+            self.index_shared = False 
+
+    def fingerprint(self): 
+        # canonical hash of the plan: node signatures and edges are sorted, so two 
+        # graphs with the same structure hash the same regardless of insertion order. 
+        signatures = sorted(repr(node.signature()) for node in self.nodes if node is not None)
+        edges = sorted("%s -> %s" % (self.nodes[src].name, self.nodes[dst].name)
+                       for src, out in enumerate(self.out_edges) for dst in out)
+        digest = hashlib.sha1()
+        for line in signatures + edges: 
+            digest.update(line.encode())
+            digest.update(b'\n')
+        return digest.hexdigest()
+
+    def topological_order(self): 
+        in_degree = [len(edges) for edges in self.in_edges]
+        order = [i for i, node in enumerate(self.nodes) if node is not None and in_degree[i] == 0]
+        for node_id in order: 
+            for child in self.out_edges[node_id]: 
+                in_degree[child] -= 1 
+                if in_degree[child] == 0: 
+                    order.append(child)
+        if len(order) != len(self.index): 
+            raise ValueError("dataflow graph has a cycle")
+        return [self.nodes[i] for i in order]
+
+    def node_id(self, node): 
+        name = node.name if isinstance(node, Node) else node 
+        return self.index.get(name)
+
+    def node(self, name): 
+        node_id = self.index.get(name)
+        if node_id is None: 
+            return None 
+        return self.nodes[node_id]
+
+    def add_node(self, node): 
+        # returns the node stored under this name, which may be an existing one. 
+        node_id = self.index.get(node.name)
+        if node_id is not None: 
+            return self.nodes[node_id]
+        self.own_index()
+        self.index[node.name] = len(self.nodes)
+        self.nodes = self.nodes.append(node)
+        self.out_edges = self.out_edges.append(())
+        self.in_edges = self.in_edges.append(())
+        tracing.count('nodes_created')
+        return node 
+
+    def remove_node(self, node): 
+        node_id = self.node_id(node)
+        if node_id is None: 
+            raise KeyError(node)
+        for child in self.out_edges[node_id]: 
+            self.in_edges = without(self.in_edges, child, node_id)
+        for parent in self.in_edges[node_id]: 
+            self.out_edges = without(self.out_edges, parent, node_id)
+        self.own_index()
+        del self.index[self.nodes[node_id].name]
+        self.nodes = self.nodes.set(node_id, None)
+        self.out_edges = self.out_edges.set(node_id, ())
+        self.in_edges = self.in_edges.set(node_id, ())
+
+    def add_edge(self, src, dst): 
+        src_id = self.index[self.add_node(src).name] if isinstance(src, Node) else self.index[src]
+        dst_id = self.index[self.add_node(dst).name] if isinstance(dst, Node) else self.index[dst]
+        out = self.out_edges[src_id]
+        if dst_id in out: 
+            return False 
+        self.out_edges = self.out_edges.set(src_id, out + (dst_id,))
+        self.in_edges = self.in_edges.set(dst_id, self.in_edges[dst_id] + (src_id,))
+        tracing.count('edges_added')
+        return True 
+
+    def remove_edge(self, src, dst): 
+        src_id = self.node_id(src)
+        dst_id = self.node_id(dst)
+        self.out_edges = without(self.out_edges, src_id, dst_id)
+        self.in_edges = without(self.in_edges, dst_id, src_id)
+
+    def successors(self, node): 
+        node_id = self.node_id(node)
+        if node_id is None: 
+            raise KeyError(node)
+        return [self.nodes[i] for i in self.out_edges[node_id]]
+
+    def predecessors(self, node): 
+        node_id = self.node_id(node)
+        if node_id is None: 
+            raise KeyError(node)
+        return [self.nodes[i] for i in self.in_edges[node_id]]
+
+    def set_successors(self, node, successors): 
+        for child in self.successors(node): 
+            self.remove_edge(node, child)
+        for child in successors: 
+            self.add_edge(node, child)
+
+    def replace_node(self, old, new): 
+        # new takes over all of old's incoming and outgoing edges. 
+        parents = self.predecessors(old)
+        children = self.successors(old)
+        self.remove_node(old)
+        self.add_node(new)
+        for parent in parents: 
+            self.add_edge(parent, new)
+        for child in children: 
+            self.add_edge(new, child)
+
+    def swap(self, a, b, keep=()): 
+        # a -> b becomes b -> a: everything that fed a now feeds b, and a takes 
+        # over b's outputs. parents of a named in keep (e.g. the view a probes) stay 
+        # with a. b's other inputs and a's other outputs are untouched. 
+        parents = [parent for parent in self.predecessors(a) if parent.name not in keep]
+        children = self.successors(b)
+        self.remove_edge(a, b)
+        for parent in parents: 
+            self.remove_edge(parent, a)
+            self.add_edge(parent, b)
+        for child in children: 
+            self.remove_edge(b, child)
+            self.add_edge(a, child)
+        self.add_edge(b, a)
+
+
+def without(adjacency, node_id, other): 
+    # adjacency with other removed from node_id's tuple 
+    edges = adjacency[node_id]
+    i = edges.index(other)
+    return adjacency.set(node_id, edges[:i] + edges[i + 1:])
 
 
 class Function: 
@@ -30,7 +240,7 @@ class Function:
 
     def to_dataflow(self, schema): 
         intermediate_views = []
-        intermediate_graph = {}
+        intermediate_graph = Graph()
         for operation in self.event_chain: 
             subgraph, output_views = operation.to_dataflow(schema, intermediate_graph, intermediate_views)
             intermediate_graph = subgraph 
@@ -39,10 +249,76 @@ class Function:
         return intermediate_graph
 
 def get_node_by_name(graph, node_name): 
-    for node in graph.keys(): 
-        if node.name == node_name: 
-            return node 
-    return None 
+    return graph.node(node_name)
+
+
+def predicate_upstream(graph, predicate, first): 
+    # tables a predicate node reads from. the first node of a chain reads every table 
+    # named in its predicate; later nodes read their predecessor and only need the 
+    # table they probe. bare view names are only inputs if they are already views. 
+    upstream = set()
+    if predicate.kind == REWRITE: 
+        operands = [predicate.left]
+    elif first: 
+        operands = predicate.operands 
+    else: 
+        operands = [op for op in predicate.operands if op.table == predicate.side_input()]
+
+    for operand in operands: 
+        if operand.column is not None or (operand.table is not None and operand.table in graph): 
+            upstream.add(operand.table)
+    return upstream 
+
+
+def ancestors(graph, node): 
+    # the views whose rows flow into node; the views probed on the way only decide 
+    # which rows pass 
+    names = set()
+    stack = [node]
+    while len(stack) > 0: 
+        for parent in filtered_inputs(graph, stack.pop()): 
+            if parent.name not in names: 
+                names.add(parent.name)
+                stack.append(parent)
+    return names 
+
+
+def probed_view(graph, node): 
+    # the parent a membership predicate checks its rows against, or None when the 
+    # predicate compares values within a row. predicates name the view they were 
+    # written against, which need not be the parent that supplies it: a query reads 
+    # the policy view exported in place of the base table it names (see 
+    # planning.attach_query), and reordering a chain moves its last node up, leaving 
+    # the named view, or the view exported in its place, an ancestor of the parent 
+    # that now ends the chain. 
+    predicate = node.parsed 
+    if predicate is None or predicate.kind == REWRITE: 
+        return None 
+    left, right = predicate.left, predicate.right 
+    if right.is_param or right.is_literal or right.table is None: 
+        return None 
+    if right.column is not None and (left.is_param or left.is_literal or left.table == right.table): 
+        return None 
+    parents = graph.predecessors(node)
+    for matches in (lambda parent: parent.name == right.table, 
+                    lambda parent: parent.exported_as == right.table, 
+                    lambda parent: any(graph.node(name).exported_as == right.table for name in ancestors(graph, parent)), 
+                    lambda parent: right.table in ancestors(graph, parent)): 
+        found = [parent.name for parent in parents if matches(parent)]
+        if len(found) > 1: 
+            # a view probing a view of its own table: the left side names the input it filters 
+            found = [name for name in found if name != left.table]
+        if len(found) == 1: 
+            return found[0]
+        if len(found) > 1: 
+            raise ValueError("%s probes %s, which several of its inputs supply" % (node.name, right.table))
+    raise ValueError("%s probes %s, which is not one of its inputs" % (node.name, right.table))
+
+
+def filtered_inputs(graph, node): 
+    # the parents whose rows a node passes on, as opposed to the view it probes 
+    probe = probed_view(graph, node)
+    return [parent for parent in graph.predecessors(node) if parent.name != probe]
 
 
 class Filter: 
@@ -50,6 +326,7 @@ class Filter:
         self.new_view_name = new_view_name
         self.tables = tables
         self.predicates = predicates  
+        self.parsed_predicates = [parse_predicate(p) for p in predicates]
         self.policy = policy 
         self.exported_as = exported_as 
         self.on = on 
@@ -61,52 +338,32 @@ class Filter:
         for tbl in self.tables: 
             tbl = tbl.replace('$', '')
 
-            intermediate_view_names = [x.name for x in intermediate_views]
-            in_intermediate = False
-            for name in intermediate_view_names: 
-                if tbl == name: 
-                    in_intermediate = True
-            if tbl in schema.keys(): # base table 
-                tbl_node = Node(tbl, None, [tbl], self.policy)  
-                if tbl_node not in graph: 
-                    graph[tbl_node] = []  
-            elif in_intermediate: 
-                tbl_node = intermediate_views[intermediate_view_names.index(tbl)]
-                if tbl_node not in graph: 
-                    graph[tbl_node] = []  
-            else: 
+            if tbl in schema: # base table 
+                graph.add_node(Node(tbl, None, False))
+            elif tbl not in graph: # intermediate views are already in the graph 
                 raise NotImplementedError
     
         if len(self.predicates) == 0: 
-            new_node = Node(self.new_view_name, "filter", self.policy, predicate=None, exported_as=self.exported_as)
-            graph[new_node] = []
+            new_node = graph.add_node(Node(self.new_view_name, "filter", self.policy, predicate=None, exported_as=self.exported_as))
             intermediate_views.append(new_node)
             left, right = self.tables
-            left_node = get_node_by_name(graph, left)
-            right_node = get_node_by_name(graph, right)
-            graph[left_node].append(new_node)
-            graph[right_node].append(new_node)
-
+            graph.add_edge(left, new_node)
+            graph.add_edge(right, new_node)
+
+        # a predicate may qualify a column by the base table the rows come from 
+        # (Tweets.user_id on rows of VisibleTweets1c); only the tables the filter lists 
+        # are its inputs. a view only a later predicate probes is read by that node. 
+        listed = {tbl.replace('$', '') for tbl in self.tables}
+        probed_later = {predicate.side_input() for predicate in self.parsed_predicates[1:]}
         prev = None
-        for i, predicate in enumerate(self.predicates): 
+        for i, predicate in enumerate(self.parsed_predicates): 
             if i == len(self.predicates) - 1:
                 i = ""
             node_name = self.new_view_name + str(i)
-            new_node = Node(node_name, "filter", self.policy, predicate=predicate, exported_as=self.exported_as)  
-            graph[new_node] = []
-            upstream = set()
-            left, right = predicate.split('IN')
-
-            print("PREDICATE: {}".format(predicate))
-            if '.' in left and prev is None: 
-                print('h1')
-                left_table, left_col = left.split('.')
-                upstream.add(left_table.replace('$', '').strip())
-
-            if '.' in right and prev is None: 
-                print('h2')
-                right_table, right_col = right.split('.')
-                upstream.add(right_table.replace('$', '').strip())
+            new_node = graph.add_node(Node(node_name, "filter", self.policy, predicate=predicate.text, exported_as=self.exported_as))
+
+            tracing.debug("filter %s: %s", node_name, predicate.text)
+            upstream = predicate_upstream(graph, predicate, prev is None) & listed 
             
             intermediate_views.append(new_node)
 
@@ -118,19 +375,14 @@ class Filter:
 
             if i == 0: 
                 for table in self.tables: 
-                    upstream.add(table) 
+                    if table not in probed_later: 
+                        upstream.add(table) 
 
             for tbl in upstream: 
-                found = False
-                for node in graph.keys(): 
-                    # print('looking: {}'.format(node.name))
-                    if node.name == tbl: 
-                        print('appending {} to node {} outgoing edges'.format(new_node, upstream))
-                        graph[node].append(new_node)
-                        found = True
-                
-                if not found: 
+                if tbl not in graph: 
                     raise NotImplementedError
+                tracing.debug("edge %s -> %s", tbl, node_name)
+                graph.add_edge(tbl, new_node)
 
         return graph, intermediate_views
 
@@ -140,6 +392,7 @@ class Transform:
         self.new_view_name = new_view_name
         self.tables = tables
         self.predicates = predicates 
+        self.parsed_predicates = [parse_predicate(p) for p in predicates]
         self.policy = policy
         self.exported_as = exported_as 
     
@@ -149,47 +402,23 @@ class Transform:
     def to_dataflow(self, schema, graph, intermediate_views): 
         for tbl in self.tables: 
             tbl = tbl.replace('$', '')
-            intermediate_view_names = [x.name.replace('$', '') for x in intermediate_views]
-            in_intermediate = False
-            for name in intermediate_view_names: 
-                if tbl == name: 
-                    in_intermediate = True
-            if tbl in schema.keys(): # base table 
-                tbl_node = Node(tbl, None, [tbl], self.policy, exported_as=self.exported_as)
-                if tbl_node not in graph: 
-                    graph[tbl_node] = []  
-            elif in_intermediate: 
-                tbl_node = intermediate_views[intermediate_view_names.index(tbl)]
-                if tbl_node not in graph: 
-                    graph[tbl_node] = []  
-            else: 
+            if tbl in schema: # base table 
+                graph.add_node(Node(tbl, None, False))
+            elif tbl not in graph: # intermediate views are already in the graph 
                 raise NotImplementedError
     
+        # as for filters, only the tables the transform lists are its inputs 
+        listed = {tbl.replace('$', '') for tbl in self.tables}
         prev = None
         prev_connected = set()
-        for i, predicate in enumerate(self.predicates): 
+        for i, predicate in enumerate(self.parsed_predicates): 
             if i == len(self.predicates) - 1:
                 i = ""
             node_name = self.new_view_name + str(i)
-            new_node = Node(node_name, "transform", self.policy, predicate=predicate, exported_as=self.exported_as)  
-            graph[new_node] = []
-            upstream = set()
+            new_node = graph.add_node(Node(node_name, "transform", self.policy, predicate=predicate.text, exported_as=self.exported_as))
             
-            print("predicate: {}".format(predicate))
-            if 'IN' in predicate: 
-                left, right = predicate.split('IN')
-                if '.' in left: 
-                    left_table, left_col = left.split('.')
-                    upstream.add(left_table.replace('$', '').strip())
-
-                if '.' in right: 
-                    right_table, right_col = right.split('.')
-                    upstream.add(right_table.replace('$', '').strip())
-            elif '=>' in predicate: 
-                left, right = predicate.split('=>')
-                table, col = left.split('.')
-                table = table.replace('$', '').strip()
-                upstream.add(table)
+            tracing.debug("transform %s: %s", node_name, predicate.text)
+            upstream = predicate_upstream(graph, predicate, True) & listed 
                 
             intermediate_views.append(new_node)
 
@@ -208,14 +437,9 @@ class Transform:
                     new_upstream.add(item)
             
             for tbl in new_upstream: 
-                found = False
-                for node in graph.keys(): 
-                    if node.name == tbl: 
-                        graph[node].append(new_node)
-                        found = True
-                
-                if not found: 
+                if tbl not in graph: 
                     raise NotImplementedError
+                graph.add_edge(tbl, new_node)
 
             for t in new_upstream: 
                 prev_connected.add(t)
@@ -230,6 +454,7 @@ class Aggregate:
         self.operation_on = operation_on 
         self.tables = tables
         self.predicates = predicates 
+        self.parsed_predicates = None if predicates is None else [parse_predicate(p) for p in predicates]
         self.groupby = groupby 
         self.policy = policy 
         self.exported_as = exported_as 
@@ -241,68 +466,35 @@ class Aggregate:
         for tbl in self.tables: 
             tbl = tbl.replace('$', '')
 
-            intermediate_view_names = [x.name for x in intermediate_views]
-            if tbl in schema.keys():# base table 
-                tbl_node = Node(tbl, None, [tbl], self.policy) 
-                found = False 
-                for node in graph.keys(): 
-                    if tbl_node.name == node.name: 
-                        found = True
-                if not found: 
-                    graph[tbl_node] = []  
-            elif tbl in intermediate_view_names: 
-                tbl_node = intermediate_views[intermediate_view_names.index(tbl)]
-                found = False 
-                for node in graph.keys(): 
-                    if tbl_node.name == node.name: 
-                        found = True
-                if not found: 
-                    graph[tbl_node] = []  
-            else: 
+            if tbl in schema: # base table 
+                graph.add_node(Node(tbl, None, False))
+            elif tbl not in graph: # intermediate views are already in the graph 
                 raise NotImplementedError
     
         if '.' in self.operation_on: 
             node_name = self.new_view_name
-            new_node = Node(node_name, self.operation_type, self.policy, operation_on=self.operation_on, groupby=self.groupby, exported_as=self.exported_as)  
-            graph[new_node] = []
+            new_node = graph.add_node(Node(node_name, self.operation_type, self.policy, operation_on=self.operation_on, groupby=self.groupby, exported_as=self.exported_as))
                     
-            tbl, col = self.operation_on.split('.') 
-            found = False 
-            for node in graph.keys(): 
-                if node.name == tbl: 
-                    graph[node].append(new_node)
-                    found = True
+            tbl = parse_operand(self.operation_on).table 
+            if tbl in graph: 
+                graph.add_edge(tbl, new_node)
             intermediate_views.append(new_node)
 
         if self.predicates is not None: 
             raise NotImplementedError
-            for i, predicate in enumerate(self.predicates): 
+            for i, predicate in enumerate(self.parsed_predicates): 
                 if i == len(self.predicates) - 1:
                     i = ""
                 node_name = self.new_view_name + str(i)
-                node = Node(node_name, self.operation_type, self.affected_base_tables, self.policy, predicate=predicate, exported_as=self.exported_as)  
-                graph[node] = []
+                node = graph.add_node(Node(node_name, self.operation_type, self.policy, predicate=predicate.text, exported_as=self.exported_as))
                     
-                upstream = set()
-                left, right = predicate.split('IN')
-                if '.' in left: 
-                    left_table, left_col = left.split('.')
-                    upstream.add(left_table.replace('$', '').strip())
-
-                if '.' in right: 
-                    right_table, right_col = right.split('.')
-                    upstream.add(right_table.replace('$', '').strip())
+                upstream = predicate_upstream(graph, predicate, True)
                 
                 intermediate_views.append(node)
                 
                 for tbl in upstream: 
-                    found = False
-                    for node in graph.keys(): 
-                        if node.name == tbl: 
-                            graph[node].append(node_name)
-                            found = True
-                    
-                    if not found: 
+                    if tbl not in graph: 
                         raise NotImplementedError
+                    graph.add_edge(tbl, node)
         
         return graph, intermediate_views
@@ -0,0 +1,344 @@
+# Deterministic data for the HotCRP, Piazza and Twitter schemas, written as
+# columnar tables that load memory-mapped:
+#
+#   python datagen.py --benchmark twitter --scale 1000000 --output-dir data
+#
+#   tables = load_dataset('data/twitter-1000000-0')    # table -> column -> array
+#   views = backfill.backfill(graph, tables)
+#
+# A dataset is a directory with a manifest.json and one .npy file per column,
+# data/<benchmark>-<scale>-<seed>/<table>/<column>.npy. Columns are loaded with
+# np.load(mmap_mode='r'), so opening a dataset reads no data: pages are read the
+# first time they are touched and shared with every process that maps the same file.
+# A dataset is written into a staging directory next to it and renamed into place
+# once its manifest is written, so a dataset directory is always complete, also
+# when --force regenerates one that is in use.
+#
+# Scale is the number of users (HotCRP contacts). The tables the policies read
+# follow the distributions of the real applications: in HotCRP the program
+# committee (a twentieth of the contacts) writes every review, about three per
+# paper, with some members taking on several times the load of others; papers
+# conflict with their authors, a few of whom write many papers. On Twitter follow
+# counts are log-normal, about twenty per user, while who is followed and who
+# tweets follow a power law. On Piazza users enroll in a few classes of very different sizes, one
+# in twenty enrollments is a TA's, and users post in the classes they are in.
+# Every other table gets scale / 10 rows (one per entity for entity tables like
+# Paper) with uniform values, and references to other entities drawn with a power law.
+#
+# Integer NULLs are -1, times are seconds since the epoch, and text is fixed width
+# bytes of at most MAX_TEXT characters drawn from a per column vocabulary, since
+# no policy or query looks inside text.
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from catalog import load_catalog
+
+# part of the manifest: bump when a change to the generator changes its output
+DATA_VERSION = 1
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks')
+MANIFEST = 'manifest.json'
+
+MAX_TEXT = 32
+VOCABULARY = 4096
+NULL_ID = -1
+EPOCH = 1500000000
+TIME_RANGE = 3 * 365 * 24 * 3600
+
+INTEGER_TYPES = {'int', 'integer', 'bigint', 'smallint', 'mediumint', 'year'}
+TIME_TYPES = {'timestamp', 'datetime', 'date', 'time'}
+FLAG_TYPES = {'tinyint', 'bit'}
+BOOLEAN_TYPES = {'bool', 'boolean'}
+FLOAT_TYPES = {'float', 'double', 'real', 'decimal', 'numeric'}
+
+
+def skewed(rng, n, size, exponent=1.0):
+    # ids in [0, n) from a Zipf distribution with the given exponent; which ids are
+    # the popular ones is itself random
+    if n < 1:
+        raise ValueError("cannot draw from an empty range")
+    weights = np.arange(1, n + 1, dtype=np.float64) ** -exponent
+    cdf = np.cumsum(weights)
+    cdf /= cdf[-1]
+    ranks = np.minimum(np.searchsorted(cdf, rng.random(size), side='right'), n - 1)
+    return rng.permutation(n)[ranks]
+
+
+def unique_rows(columns, keys):
+    # drops the rows repeating the key values of an earlier row, e.g. a second
+    # follow of the same account
+    _, first = np.unique(np.stack([columns[key] for key in keys], axis=1), axis=0, return_index=True)
+    first.sort()
+    return {name: values[first] for name, values in columns.items()}
+
+
+def column_dtype(column):
+    kind = column.type.lower()
+    if kind in INTEGER_TYPES or kind in TIME_TYPES:
+        return np.dtype(np.int64)
+    if kind in FLAG_TYPES:
+        return np.dtype(np.int8)
+    if kind in BOOLEAN_TYPES:
+        return np.dtype(np.bool_)
+    if kind in FLOAT_TYPES:
+        return np.dtype(np.float64)
+    try:
+        width = int(column.length)
+    except (TypeError, ValueError):
+        width = MAX_TEXT
+    return np.dtype('S%d' % max(1, min(width, MAX_TEXT)))
+
+
+def fill_column(rng, column, rows, dataset, sizes):
+    dtype = column_dtype(column)
+    kind = column.type.lower()
+    entity = dataset.references.get(column.name.lower())
+    if entity is not None:
+        return skewed(rng, sizes[entity], rows)
+    if kind in TIME_TYPES:
+        return EPOCH + rng.integers(0, TIME_RANGE, rows)
+    if dtype == np.int64:
+        return rng.integers(0, 100, rows)
+    if dtype == np.int8:
+        return rng.integers(0, 2, rows).astype(np.int8)
+    if dtype == np.bool_:
+        return rng.random(rows) < 0.5
+    if dtype == np.float64:
+        return rng.random(rows)
+    vocabulary = np.array(['%s %d' % (column.name, i) for i in range(VOCABULARY)], dtype=dtype)
+    return vocabulary[rng.integers(0, VOCABULARY, rows)]
+
+
+def flags(rng, rows, probability, dtype=np.int8):
+    return (rng.random(rows) < probability).astype(dtype)
+
+
+def hotcrp_tables(rng, sizes):
+    contacts, papers = sizes['contacts'], sizes['papers']
+    committee = max(1, contacts // 20)
+    per_paper = rng.poisson(3, papers)
+    paper_ids = np.repeat(np.arange(papers), per_paper)
+    load = rng.gamma(2.0, size=committee)
+    reviewers = rng.choice(committee, len(paper_ids), p=load / load.sum())
+    reviews = unique_rows({'paperId': paper_ids, 'contactId': reviewers}, ('paperId', 'contactId'))
+    reviews['reviewId'] = np.arange(len(reviews['paperId']))
+    sizes['reviews'] = max(1, len(reviews['reviewId']))
+
+    per_paper = rng.poisson(2, papers) + 1
+    paper_ids = np.repeat(np.arange(papers), per_paper)
+    conflicts = unique_rows({'paperId': paper_ids, 'contactId': skewed(rng, contacts, len(paper_ids), 1.1)},
+                            ('paperId', 'contactId'))
+    return {'PaperReview': reviews, 'PaperConflict': conflicts}
+
+
+def piazza_tables(rng, sizes):
+    users, classes = sizes['users'], sizes['classes']
+    per_user = rng.poisson(2, users) + 1
+    user_ids = np.repeat(np.arange(users), per_user)
+    roles = unique_rows({'r_uid': user_ids, 'r_cid': skewed(rng, classes, len(user_ids))}, ('r_uid', 'r_cid'))
+    roles['r_role'] = flags(rng, len(roles['r_uid']), 0.05)
+
+    posts = users * 5
+    enrollment = rng.integers(0, len(roles['r_uid']), posts)
+    post = {'p_id': np.arange(posts), 'p_cid': roles['r_cid'][enrollment], 'p_author': roles['r_uid'][enrollment],
+            'p_private': flags(rng, posts, 0.1), 'p_anonymous': flags(rng, posts, 0.2)}
+    return {'Role': roles, 'Post': post}
+
+
+def twitter_tables(rng, sizes):
+    users, tweets = sizes['users'], sizes['tweets']
+    degree = np.minimum(rng.lognormal(2.5, 1.0, users).astype(np.int64), users - 1)
+    followers = np.repeat(np.arange(users), degree)
+    follows = {'user_id': followers, 'followed_id': skewed(rng, users, len(followers))}
+    keep = follows['user_id'] != follows['followed_id']
+    follows = unique_rows({name: values[keep] for name, values in follows.items()}, ('user_id', 'followed_id'))
+
+    # tweets are numbered in time order; retweets and replies refer to earlier ones
+    ids = np.arange(tweets)
+    earlier = (rng.random(tweets) * ids).astype(np.int64)
+    tweet = {'id': ids, 'user_id': skewed(rng, users, tweets, 1.2),
+             'retweet_id': np.where(rng.random(tweets) < 0.1, earlier, NULL_ID),
+             'reply_id': np.where(rng.random(tweets) < 0.2, earlier, NULL_ID),
+             'is_sensitive': rng.random(tweets) < 0.05,
+             'timestamp': EPOCH + np.sort(rng.integers(0, TIME_RANGE, tweets))}
+
+    blocks = max(1, users // 2)
+    blocked = unique_rows({'user_id': rng.integers(0, users, blocks), 'blocked_id': skewed(rng, users, blocks)},
+                          ('user_id', 'blocked_id'))
+    user = {'id': np.arange(users), 'is_private': rng.random(users) < 0.1}
+    return {'Users': user, 'Follows': follows, 'Tweets': tweet, 'BlockedAccounts': blocked}
+
+
+class Dataset:
+    # sizes: scale -> entity counts; references: lowercased column name -> the
+    # entity it refers to; entities: table -> the entity it has one row per;
+    # generate(rng, sizes): the tables with realistic distributions
+    __slots__ = ('name', 'schema', 'sizes', 'references', 'entities', 'generate')
+
+    def __init__(self, name, schema, sizes, references, entities, generate):
+        self.name = name
+        self.schema = schema
+        self.sizes = sizes
+        self.references = references
+        self.entities = entities
+        self.generate = generate
+
+
+DATASETS = {
+    'hotcrp': Dataset(
+        'hotcrp', os.path.join(BENCHMARKS_DIR, 'hotcrp', 'schema.sql'),
+        lambda scale: {'contacts': scale, 'papers': max(1, scale // 2), 'reviews': 1, 'topics': 50},
+        {'contactid': 'contacts', 'requestedby': 'contacts', 'createdby': 'contacts', 'paperid': 'papers',
+         'reviewid': 'reviews', 'topicid': 'topics'},
+        {'ContactInfo': 'contacts', 'Paper': 'papers', 'TopicArea': 'topics'},
+        hotcrp_tables),
+    'piazza': Dataset(
+        'piazza', os.path.join(BENCHMARKS_DIR, 'piazza', 'schema.sql'),
+        lambda scale: {'users': scale, 'classes': max(1, scale // 200)},
+        {'u_id': 'users', 'p_author': 'users', 'r_uid': 'users', 'c_id': 'classes', 'p_cid': 'classes',
+         'r_cid': 'classes'},
+        {'User': 'users', 'Class': 'classes'},
+        piazza_tables),
+    'twitter': Dataset(
+        'twitter', os.path.join(BENCHMARKS_DIR, 'twitter', 'twitter-schema.sql '),
+        lambda scale: {'users': scale, 'tweets': scale * 10},
+        {'user_id': 'users', 'followed_id': 'users', 'blocked_id': 'users', 'muted_id': 'users',
+         'sender_id': 'users', 'sendee_id': 'users', 'tweet_id': 'tweets', 'retweet_id': 'tweets',
+         'reply_id': 'tweets'},
+        {'Users': 'users', 'Tweets': 'tweets'},
+        twitter_tables),
+}
+
+
+def dataset_path(root, benchmark, scale, seed=0):
+    return os.path.join(root, '%s-%d-%d' % (benchmark, scale, seed))
+
+
+def write_dataset(directory, benchmark, scale, seed=0):
+    # generates every table of the benchmark's schema into directory, replacing the
+    # dataset there if there is one; returns the manifest
+    if benchmark not in DATASETS:
+        raise ValueError("no data generator for %s" % benchmark)
+    if scale < 1:
+        raise ValueError("scale must be positive")
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.%s-' % os.path.basename(directory), dir=parent)
+    try:
+        manifest = generate_dataset(staging, benchmark, scale, seed)
+        if os.path.exists(directory):
+            # arrays still mapped from the old dataset keep their pages
+            old = tempfile.mkdtemp(prefix='.%s-' % os.path.basename(directory), dir=parent)
+            os.rename(directory, os.path.join(old, 'dataset'))
+            os.rename(staging, directory)
+            shutil.rmtree(old)
+        else:
+            os.rename(staging, directory)
+    finally:
+        if os.path.exists(staging):
+            shutil.rmtree(staging)
+    return manifest
+
+
+def generate_dataset(directory, benchmark, scale, seed):
+    # the tables and manifest of a dataset, written into an empty directory
+    dataset = DATASETS[benchmark]
+    catalog = load_catalog(dataset.schema)
+    rng = np.random.default_rng(seed)
+    sizes = dataset.sizes(scale)
+    generated = dataset.generate(rng, sizes)
+    manifest = {'version': DATA_VERSION, 'benchmark': benchmark, 'scale': scale, 'seed': seed, 'tables': {}}
+
+    for name in sorted(catalog.keys()):
+        table = catalog.table(name)
+        columns = dict(generated.get(name, {}))
+        if len(columns) > 0:
+            rows = len(next(iter(columns.values())))
+        elif name in dataset.entities:
+            rows = sizes[dataset.entities[name]]
+        else:
+            rows = max(1, scale // 10)
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            if table.primary_key == (column.name,) and column_dtype(column) == np.int64:
+                columns[column.name] = np.arange(rows)
+            else:
+                columns[column.name] = fill_column(rng, column, rows, dataset, sizes)
+        key = [column for column in table.primary_key if column in columns]
+        if len(key) > 1 and all(columns[column].dtype.kind in 'iub' for column in key):
+            columns = unique_rows(columns, key)
+            rows = len(columns[key[0]])
+
+        os.makedirs(os.path.join(directory, name), exist_ok=True)
+        types = {}
+        for column in table.columns:
+            values = np.ascontiguousarray(columns[column.name], dtype=column_dtype(column))
+            np.save(os.path.join(directory, name, column.name + '.npy'), values)
+            types[column.name] = values.dtype.str
+        manifest['tables'][name] = {'rows': rows, 'columns': types}
+
+    with open(os.path.join(directory, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_dataset(directory):
+    # table -> column -> read-only memory-mapped array
+    manifest = read_manifest(directory)
+    if manifest is None:
+        raise ValueError("%s holds no dataset" % directory)
+    return {table: {column: np.load(os.path.join(directory, table, column + '.npy'), mmap_mode='r')
+                    for column in info['columns']}
+            for table, info in manifest['tables'].items()}
+
+
+def ensure_dataset(root, benchmark, scale, seed=0):
+    # the dataset for benchmark, scale and seed under root, generated if it is not
+    # there yet or was written by another version of the generator
+    directory = dataset_path(root, benchmark, scale, seed)
+    manifest = read_manifest(directory)
+    if manifest is None or manifest['version'] != DATA_VERSION:
+        write_dataset(directory, benchmark, scale, seed)
+    return load_dataset(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate benchmark data as memory-mapped column files.')
+    parser.add_argument('--benchmark', type=str, nargs='+', default=['hotcrp'], choices=sorted(DATASETS))
+    parser.add_argument('--scale', type=int, default=10000, help='number of users')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output-dir', type=str, default='data')
+    parser.add_argument('--force', action='store_true', help='regenerate datasets that already exist')
+    args = parser.parse_args()
+
+    for benchmark in args.benchmark:
+        directory = dataset_path(args.output_dir, benchmark, args.scale, args.seed)
+        generated = None
+        if args.force or read_manifest(directory) is None:
+            start = time.perf_counter()
+            write_dataset(directory, benchmark, args.scale, args.seed)
+            generated = time.perf_counter() - start
+        start = time.perf_counter()
+        tables = load_dataset(directory)
+        loaded = time.perf_counter() - start
+        rows = sum(info['rows'] for info in read_manifest(directory)['tables'].values())
+        made = 'existing' if generated is None else 'generated in %.2fs' % generated
+        print('%s: %d rows in %d tables, %s, loaded in %.1fms (%s)' % (
+            benchmark, rows, len(tables), made, loaded * 1000, directory))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,414 @@
+# Incremental executor for planned dataflow graphs.
+# Every node keeps its output as a materialized view. Writes to base tables enter
+# the graph as deltas, lists of (row, +1/-1) pairs, and each node turns the deltas
+# it receives into output deltas using only the state it keeps, so the work per
+# write is proportional to the size of the delta rather than to the views.
+# Views can be indexed on the columns they are read by (see indexing.py), which
+# makes a keyed read a hash lookup instead of a scan of the view.
+import time
+from collections import Counter, defaultdict, deque
+from dataflow import filtered_inputs, probed_view
+from predicate import NOT_IN, REWRITE, parse_operand
+
+TRANSFORM_FLAG = '__transform'
+
+
+def row_key(row):
+    return tuple(sorted(row.items()))
+
+
+def get_column(row, column):
+    # predicates and schemas do not agree on the case of column names (paperID, paperId)
+    if column in row:
+        return row[column]
+    lowered = column.lower()
+    for name, value in row.items():
+        if name.lower() == lowered:
+            return value
+    return None
+
+
+def column_name(row, column):
+    lowered = column.lower()
+    for name in row:
+        if name.lower() == lowered:
+            return name
+    return column
+
+
+def literal_value(text):
+    text = text.replace('$', '').strip()
+    if text.upper() == 'TRUE':
+        return True
+    if text.upper() == 'FALSE':
+        return False
+    if text.upper() == 'NULL':
+        return None
+    if text[:1] in ('"', "'", '`', '“'):
+        return text.strip('"\'`“”')
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def operand_value(operand, row, uid):
+    if operand.is_param:
+        return uid
+    if operand.is_literal:
+        return literal_value(operand.text)
+    return get_column(row, operand.column)
+
+
+def source_table(graph, name):
+    # the base table a view's rows come from, following the input each operator
+    # filters rather than the views it probes
+    node = graph.node(name)
+    while node is not None and node.operation_type is not None:
+        parents = filtered_inputs(graph, node)
+        node = parents[0] if len(parents) > 0 else None
+    return None if node is None else node.name
+
+
+def probe_column(node, graph=None, catalog=None):
+    # a bare view name is a set of entities, identified by the key of the table they
+    # come from, if the catalog knows it, and by their id column otherwise
+    if node.parsed.right.column is not None:
+        return node.parsed.right.column
+    if catalog is not None and graph is not None:
+        table = source_table(graph, node.parsed.right.table)
+        key = () if table is None else catalog.lookup_key(table)
+        if len(key) == 1:
+            return key[0]
+    return 'id'
+
+
+class Operator:
+    # turns an input delta from one parent into an output delta. state_size counts
+    # the rows an operator keeps in addition to the node's materialized view.
+    def __init__(self, node, executor):
+        self.node = node
+        self.executor = executor
+
+    def process(self, source, delta):
+        raise NotImplementedError
+
+    def state_size(self):
+        return 0
+
+
+class Passthrough(Operator):
+    # base tables, and filters without a predicate, which union their inputs
+    def process(self, source, delta):
+        return delta
+
+
+class Membership(Operator):
+    # filters, and the condition nodes of a transform. a predicate either compares
+    # two values of the same row ("PaperReview.contactId IN $UID") or checks a value
+    # against the rows of another view ("Paper.paperID NOT IN MyConflicts.paperId").
+    # in the second case the input rows are indexed by their join key and the probed
+    # view by its key counts, so a change on either side only touches matching rows.
+    # condition nodes keep every row and record in TRANSFORM_FLAG whether the
+    # transform applies to it.
+    def __init__(self, node, executor, condition=False):
+        Operator.__init__(self, node, executor)
+        self.predicate = node.parsed
+        self.negated = self.predicate.kind == NOT_IN
+        self.condition = condition
+        self.probe = probed_view(executor.graph, node)
+        if self.probe is not None:
+            self.probe_column = probe_column(node, executor.graph, executor.catalog)
+            self.rows = defaultdict(Counter)
+            self.probe_counts = Counter()
+
+    def passes(self, row):
+        left = operand_value(self.predicate.left, row, self.executor.uid)
+        if self.probe is None:
+            matched = left == operand_value(self.predicate.right, row, self.executor.uid)
+        else:
+            matched = self.probe_counts[left] > 0
+        return matched != self.negated
+
+    def output(self, row, passed):
+        if not self.condition:
+            return row if passed else None
+        row = dict(row)
+        row[TRANSFORM_FLAG] = row.get(TRANSFORM_FLAG, True) and passed
+        return row
+
+    def process(self, source, delta):
+        out = []
+        if source == self.probe:
+            for probe_row, diff in delta:
+                key = get_column(probe_row, self.probe_column)
+                before = self.probe_counts[key] > 0
+                self.probe_counts[key] += diff
+                if self.probe_counts[key] == 0:
+                    del self.probe_counts[key]
+                after = self.probe_counts[key] > 0
+                if before == after:
+                    continue
+                for rkey, count in self.rows.get(key, {}).items():
+                    row = dict(rkey)
+                    old = self.output(row, before != self.negated)
+                    new = self.output(row, after != self.negated)
+                    if old is not None:
+                        out.append((old, -count))
+                    if new is not None:
+                        out.append((new, count))
+            return out
+
+        for row, diff in delta:
+            if self.probe is not None:
+                key = operand_value(self.predicate.left, row, self.executor.uid)
+                rows = self.rows[key]
+                rows[row_key(row)] += diff
+                if rows[row_key(row)] == 0:
+                    del rows[row_key(row)]
+                if len(rows) == 0:
+                    del self.rows[key]
+            result = self.output(row, self.passes(row))
+            if result is not None:
+                out.append((result, diff))
+        return out
+
+    def state_size(self):
+        if self.probe is None:
+            return 0
+        return sum(len(rows) for rows in self.rows.values()) + len(self.probe_counts)
+
+
+class Rewrite(Operator):
+    # "VisibleReviews.contactID => `anonymous`": replace the column on every row the
+    # transform's conditions (if any) flagged
+    def __init__(self, node, executor):
+        Operator.__init__(self, node, executor)
+        self.column = node.parsed.left.column
+        self.value = literal_value(node.parsed.right.text)
+
+    def process(self, source, delta):
+        out = []
+        for row, diff in delta:
+            row = dict(row)
+            if row.pop(TRANSFORM_FLAG, True):
+                row[column_name(row, self.column)] = self.value
+            out.append((row, diff))
+        return out
+
+
+class Count(Operator):
+    # count(*) grouped by one column; a change to a group retracts its old count row
+    def __init__(self, node, executor):
+        Operator.__init__(self, node, executor)
+        if node.operation_type != 'count(*)':
+            raise NotImplementedError(node.operation_type)
+        self.groupby = parse_operand(node.groupby).column if node.groupby is not None else None
+        self.counts = Counter()
+
+    def group_row(self, group, count):
+        if self.groupby is None:
+            return {'count': count}
+        return {self.groupby: group, 'count': count}
+
+    def process(self, source, delta):
+        changes = Counter()
+        for row, diff in delta:
+            group = None if self.groupby is None else get_column(row, self.groupby)
+            changes[group] += diff
+        out = []
+        for group, diff in changes.items():
+            if diff == 0:
+                continue
+            before = self.counts[group]
+            after = before + diff
+            if before > 0:
+                out.append((self.group_row(group, before), -1))
+            if after > 0:
+                out.append((self.group_row(group, after), 1))
+                self.counts[group] = after
+            else:
+                self.counts.pop(group, None)
+        return out
+
+    def state_size(self):
+        return len(self.counts)
+
+
+def make_operator(node, executor):
+    if node.operation_type is None:
+        return Passthrough(node, executor)
+    if node.operation_type == 'filter':
+        if node.parsed is None:
+            return Passthrough(node, executor)
+        return Membership(node, executor)
+    if node.operation_type == 'transform':
+        if node.parsed.kind == REWRITE:
+            return Rewrite(node, executor)
+        return Membership(node, executor, condition=True)
+    return Count(node, executor)
+
+
+class Index:
+    # hash index of a view on some of its columns: key values -> the view's rows
+    # with them and their counts
+    __slots__ = ('columns', 'rows')
+
+    def __init__(self, columns):
+        self.columns = tuple(columns)
+        self.rows = {}
+
+    def update(self, rkey, row, diff):
+        key = tuple(get_column(row, column) for column in self.columns)
+        rows = self.rows.setdefault(key, Counter())
+        rows[rkey] += diff
+        if rows[rkey] <= 0:
+            del rows[rkey]
+        if len(rows) == 0:
+            del self.rows[key]
+
+    def lookup(self, values):
+        return self.rows.get(tuple(values), {})
+
+
+class NodeStats:
+    __slots__ = ('time', 'deltas', 'rows_in', 'rows_out')
+
+    def __init__(self):
+        self.time = 0.0
+        self.deltas = 0
+        self.rows_in = 0
+        self.rows_out = 0
+
+
+class Executor:
+    # executes a graph for the universe of one user; uid is the value of $UID. the
+    # schema catalog, if given, supplies the key columns of probed views. indexes
+    # are the index specifications of the plan (see indexing.lookup_indexes); the
+    # read indexes among them are built over the views.
+    def __init__(self, graph, uid=None, catalog=None, indexes=None):
+        self.graph = graph
+        self.uid = uid
+        self.catalog = catalog
+        self.views = {}
+        self.indexes = defaultdict(dict)
+        self.node_stats = {}
+        self.operators = {}
+        for node in graph.topological_order():
+            self.views[node.name] = Counter()
+            self.node_stats[node.name] = NodeStats()
+            self.operators[node.name] = make_operator(node, self)
+        for view, specs in (indexes or {}).items():
+            for spec in specs:
+                if spec.kind == 'read':
+                    self.indexes[view][spec.columns] = Index(spec.columns)
+
+    def targets(self, name):
+        # every view an operator probes is one of its parents (see probed_view)
+        return [child.name for child in self.graph.successors(name)]
+
+    def load(self, table, rows):
+        self.insert(table, rows)
+
+    def insert(self, table, rows):
+        self.write(table, [(row, 1) for row in rows])
+
+    def delete(self, table, rows):
+        self.write(table, [(row, -1) for row in rows])
+
+    def write(self, table, delta):
+        node = self.graph.node(table)
+        if node is None or node.operation_type is not None:
+            raise ValueError("%s is not a base table" % table)
+        self.run([(table, None, delta)])
+
+    def run(self, items, members=None, exchanges=None):
+        # processes (node, source node, delta) items and every delta they cause, in
+        # arrival order. with members, only the nodes in members are processed and
+        # the items for other nodes are returned instead (see scheduler.py); so are
+        # the deltas sent over an exchange, a (source, target) pair (see sharding.py)
+        queue = deque(items)
+        passed = []
+        while len(queue) > 0:
+            name, source, delta = queue.popleft()
+            if members is not None and name not in members:
+                passed.append((name, source, delta))
+                continue
+            stats = self.node_stats[name]
+            start = time.perf_counter()
+            out = self.operators[name].process(source, delta)
+            out = self.apply(name, out)
+            stats.time += time.perf_counter() - start
+            stats.deltas += 1
+            stats.rows_in += len(delta)
+            stats.rows_out += len(out)
+            if len(out) == 0:
+                continue
+            for target in self.targets(name):
+                if exchanges is not None and (name, target) in exchanges:
+                    passed.append((target, name, out))
+                else:
+                    queue.append((target, name, out))
+        return passed
+
+    def apply(self, name, delta):
+        # updates the node's view and drops changes that cancel out
+        view = self.views[name]
+        indexes = self.indexes[name].values()
+        merged = Counter()
+        rows = {}
+        for row, diff in delta:
+            key = row_key(row)
+            merged[key] += diff
+            rows[key] = row
+        out = []
+        for key, diff in merged.items():
+            if diff == 0:
+                continue
+            view[key] += diff
+            if view[key] <= 0:
+                del view[key]
+            for index in indexes:
+                index.update(key, rows[key], diff)
+            out.append((rows[key], diff))
+        return out
+
+    def read(self, name):
+        rows = []
+        for key, count in self.views[name].items():
+            rows.extend(dict(key) for _ in range(count))
+        return rows
+
+    def lookup(self, name, values, columns=None):
+        # the rows of a view whose columns equal values, by default the columns of
+        # its first index. a hash lookup if the view is indexed on them, else a scan
+        values = tuple(values)
+        if columns is None:
+            if len(self.indexes[name]) == 0:
+                raise ValueError("%s is not indexed; give the columns to look up" % name)
+            columns = next(iter(self.indexes[name]))
+        columns = tuple(columns)
+        if len(columns) != len(values):
+            raise ValueError("%d values given for %d columns" % (len(values), len(columns)))
+        index = self.indexes[name].get(columns)
+        if index is not None:
+            matches = index.lookup(values).items()
+        else:
+            matches = [(key, count) for key, count in self.views[name].items()
+                       if tuple(get_column(dict(key), column) for column in columns) == values]
+        rows = []
+        for key, count in matches:
+            rows.extend(dict(key) for _ in range(count))
+        return rows
+
+    def stats(self):
+        result = {}
+        for name, stats in self.node_stats.items():
+            result[name] = {
+                'time': stats.time,
+                'deltas': stats.deltas,
+                'rows_in': stats.rows_in,
+                'rows_out': stats.rows_out,
+                'state': len(self.views[name]) + self.operators[name].state_size(),
+            }
+        return result
@@ -0,0 +1,150 @@
+# Lookup keys of a planned graph's views, as index specifications. Reads are keyed
+# lookups, so every view that is read gets an index on the columns it is read by:
+#
+#   - the ?-parameter columns of the query template it answers (see sql_translator),
+#     else
+#   - the columns its rows are compared to $UID on, else
+#   - the group-by column, for an aggregate, else
+#   - the lookup key of the base table its rows come from, from the schema catalog.
+#
+# Views that are read are the queries (views nothing reads from) and the views
+# policies export in place of a base table. Every IN join also gets an index on
+# each side: the probed view on the column it is probed by, and the joined input
+# on the column it probes with. Planning moves policy operators below a query's
+# view, so a query is answered by the views its rows flow into.
+#
+# The executor builds the read indexes as hash indexes over its views (see
+# Executor.lookup); the join indexes are the keyed state Membership operators keep.
+from executor import filtered_inputs, probe_column, probed_view, source_table
+from predicate import IN, parse_operand
+
+READ = 'read'
+PROBE = 'probe'
+JOIN = 'join'
+
+
+class IndexSpec:
+    __slots__ = ('view', 'columns', 'kind')
+
+    def __init__(self, view, columns, kind):
+        self.view = view
+        self.columns = tuple(columns)
+        self.kind = kind
+
+    def __repr__(self):
+        return "<IndexSpec: %s(%s), %s>" % (self.view, ', '.join(self.columns), self.kind)
+
+    def to_dict(self):
+        return {'columns': list(self.columns), 'kind': self.kind}
+
+
+def key_column(key):
+    # sql_translator reports keys as Table.column
+    return key.split('.', 1)[1] if '.' in key else key
+
+
+def read_views(graph):
+    names = []
+    for node in graph.topological_order():
+        if node.operation_type is None:
+            continue
+        children = graph.successors(node)
+        if len(children) == 0:
+            names.append(node.name)
+        elif node.exported_as is not None and all(child.exported_as != node.exported_as for child in children):
+            names.append(node.name)
+    return names
+
+
+def answering_views(graph, name, views):
+    # the views among views that the rows of name flow into, not counting the
+    # views that only probe it
+    found = []
+    stack = [name]
+    seen = {name}
+    while len(stack) > 0:
+        current = stack.pop()
+        if current in views and current not in found:
+            found.append(current)
+        for child in graph.successors(current):
+            if child.name not in seen and probed_view(graph, child) != current:
+                seen.add(child.name)
+                stack.append(child.name)
+    return found
+
+
+def parameter_columns(graph, name):
+    # the columns filters compare to $UID on the way from the view up to its base
+    # table, following the input each operator filters rather than the views it
+    # probes. an aggregate's rows only keep its group-by column, so the walk ends there.
+    columns = []
+    node = graph.node(name)
+    while node is not None and node.operation_type is not None:
+        if node.operation_type not in ('filter', 'transform'):
+            if len(columns) == 0 and node.groupby is not None:
+                columns.append(parse_operand(node.groupby).column)
+            break
+        predicate = node.parsed
+        if node.operation_type == 'filter' and predicate is not None and predicate.kind == IN:
+            for operand, other in ((predicate.left, predicate.right), (predicate.right, predicate.left)):
+                if operand.is_param and other.column is not None and other.column not in columns:
+                    columns.append(other.column)
+        parents = filtered_inputs(graph, node)
+        node = parents[0] if len(parents) > 0 else None
+    return tuple(column for column in columns if column is not None)
+
+
+def read_columns(graph, name, keys=(), catalog=None):
+    columns = []
+    for key in keys:
+        column = key_column(key)
+        if column not in columns:
+            columns.append(column)
+    if len(columns) > 0:
+        return tuple(columns)
+    columns = parameter_columns(graph, name)
+    if len(columns) > 0 or catalog is None:
+        return columns
+    table = source_table(graph, name)
+    return () if table is None else tuple(catalog.lookup_key(table))
+
+
+def lookup_indexes(graph, keys=None, catalog=None):
+    # view name -> [IndexSpec]; keys maps query view names to the keys the query
+    # translator found for them
+    specs = {}
+
+    def add(view, columns, kind):
+        # column names do not agree on case between predicates and schemas
+        entries = specs.setdefault(view, [])
+        wanted = tuple(column.lower() for column in columns)
+        if all(tuple(column.lower() for column in spec.columns) != wanted for spec in entries):
+            entries.append(IndexSpec(view, columns, kind))
+
+    views = read_views(graph)
+    template_keys = {}
+    for query, query_keys in (keys or {}).items():
+        if query in graph:
+            for name in answering_views(graph, query, views):
+                template_keys.setdefault(name, []).extend(query_keys)
+
+    for name in views:
+        columns = read_columns(graph, name, template_keys.get(name, ()), catalog)
+        if len(columns) > 0:
+            add(name, columns, READ)
+
+    for node in graph.topological_order():
+        probe = probed_view(graph, node)
+        if probe is None:
+            continue
+        add(probe, (probe_column(node, graph, catalog),), PROBE)
+        if node.parsed.left.column is not None:
+            for parent in graph.predecessors(node):
+                if parent.name != probe:
+                    add(parent.name, (node.parsed.left.column,), JOIN)
+    return specs
+
+
+def annotations(specs):
+    # the index specifications of every view, in the form plans are exported in
+    return {view: {'indexes': [spec.to_dict() for spec in entries]} for view, entries in specs.items()}
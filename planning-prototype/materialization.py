@@ -0,0 +1,231 @@
+# Materialization planner: decides, for every operator of a plan, whether its view
+# is stored in full, stored partially (only the keys that have been read, filled on
+# demand by an upquery to its parents) or not stored at all (recomputed from its
+# parents on every read). Base tables are the store and always kept in full.
+#
+# The choice trades read latency against memory and write work:
+#
+#   fetch(n)  = LOOKUP_COST                                          full
+#             = hit * LOOKUP_COST + (1 - hit) * (LOOKUP_COST + compute(n))   partial
+#             = compute(n)                                           not stored
+#   compute(n) = OPERATOR_COST + sum of fetch(parent)
+#
+# Reads arrive at the views nothing reads from (the queries), writes at base tables;
+# by default every query is read ten times for each write to a table.
+# A write is processed by every operator with a stored view at or below it, once per
+# universe for per-universe operators, and only for the resident fraction of keys if
+# everything it feeds is partial. A full view takes the state the cost model
+# estimates for it, a partial one partial_fraction of that.
+#
+# Starting from nothing stored, plan() greedily applies the upgrade (not stored to
+# partial or full, partial to full) that saves the most latency per byte and still
+# fits the budget, until no upgrade saves anything.
+import heapq
+from collections import ChainMap
+from catalog import DEFAULT_ROW_WIDTH
+from cost import CostModel
+
+FULL = 'full'
+PARTIAL = 'partial'
+NONE = 'none'
+UPGRADES = {NONE: (PARTIAL, FULL), PARTIAL: (FULL,), FULL: ()}
+
+LOOKUP_COST = 1.0
+OPERATOR_COST = 10.0
+
+
+class Materialization:
+    # modes: node -> FULL/PARTIAL/NONE; state: node -> bytes if stored in full;
+    # resident: node -> bytes in its chosen mode
+    def __init__(self, modes, state, resident, read_cost, write_cost, budget):
+        self.modes = modes
+        self.state = state
+        self.resident = resident
+        self.read_cost = read_cost
+        self.write_cost = write_cost
+        self.budget = budget
+
+    def __repr__(self):
+        return "<Materialization: %d full, %d partial, %d not stored, %d bytes, latency %.1f>" % (
+            self.count(FULL), self.count(PARTIAL), self.count(NONE), self.memory(), self.latency())
+
+    def count(self, mode):
+        return sum(1 for m in self.modes.values() if m == mode)
+
+    def memory(self):
+        return sum(self.resident.values())
+
+    def latency(self):
+        return self.read_cost + self.write_cost
+
+    def annotations(self):
+        return {name: {'materialization': mode, 'state_bytes': self.state[name],
+                       'resident_bytes': self.resident[name]}
+                for name, mode in self.modes.items()}
+
+
+class MaterializationPlanner:
+    def __init__(self, cost_function=None, read_rates=None, write_rates=None, default_read_rate=10.0,
+                 default_write_rate=1.0, partial_fraction=0.1, partial_hit_rate=0.8):
+        self.cost_function = cost_function if cost_function is not None else CostModel()
+        self.read_rates = read_rates or {}
+        self.write_rates = write_rates or {}
+        self.default_read_rate = default_read_rate
+        self.default_write_rate = default_write_rate
+        self.partial_fraction = partial_fraction
+        self.partial_hit_rate = partial_hit_rate
+
+    def plan(self, graph, budget=None):
+        # budget is in bytes; None means memory is not limited
+        model = GraphModel(graph, self)
+        modes = {node.name: (FULL if node.operation_type is None else NONE) for node in model.order}
+        memory = sum(model.resident(name, mode) for name, mode in modes.items())
+        model.reset(modes)
+        modes = model.modes
+
+        while True:
+            best = None
+            for name in model.operators:
+                for mode in UPGRADES[modes[name]]:
+                    extra = model.resident(name, mode) - model.resident(name, modes[name])
+                    if budget is not None and memory + extra > budget:
+                        continue
+                    change = model.change(name, mode)
+                    saved = -change[0]
+                    if saved <= 1e-9:
+                        continue
+                    # savings are sums of floats: ratios that differ by rounding alone
+                    # are a tie, which the first operator in order wins
+                    ratio = saved / max(extra, 1.0)
+                    if best is None or ratio > best[0] * (1 + 1e-9):
+                        best = (ratio, name, mode, extra, change)
+            if best is None:
+                break
+            _, name, mode, extra, change = best
+            model.apply(name, mode, change)
+            memory += extra
+
+        read_cost, write_cost = model.costs(modes)
+        resident = {name: model.resident(name, mode) for name, mode in modes.items()}
+        return Materialization(modes, dict(model.state), resident, read_cost, write_cost, budget)
+
+
+class GraphModel:
+    # the parts of the graph the planner evaluates over and over
+    def __init__(self, graph, planner):
+        self.planner = planner
+        self.order = graph.topological_order()
+        self.parents = {node.name: [parent.name for parent in graph.predecessors(node)] for node in self.order}
+        self.children = {node.name: [child.name for child in graph.successors(node)] for node in self.order}
+        self.operators = [node.name for node in self.order if node.operation_type is not None]
+        self.operator_set = set(self.operators)
+        self.position = {node.name: i for i, node in enumerate(self.order)}
+        estimates = planner.cost_function.estimate(graph)
+        self.universes = {name: estimates[name].universes for name in self.parents}
+        self.state = {name: estimates[name].state * DEFAULT_ROW_WIDTH for name in self.parents}
+        self.reads = {name: planner.read_rates.get(name, planner.default_read_rate)
+                      for name in self.operators if len(self.children[name]) == 0}
+
+        # writes per second reaching each node: the writes to every base table above it
+        tables = {}
+        for node in self.order:
+            if node.operation_type is None:
+                tables[node.name] = {node.name}
+            else:
+                tables[node.name] = set().union(*[tables[parent] for parent in self.parents[node.name]])
+        self.writes = {name: sum(planner.write_rates.get(table, planner.default_write_rate) for table in found)
+                       for name, found in tables.items()}
+
+    def resident(self, name, mode):
+        if mode == FULL:
+            return self.state[name]
+        if mode == PARTIAL:
+            return self.state[name] * self.planner.partial_fraction
+        return 0.0
+
+    def fetch(self, name, mode, fetch):
+        if mode == FULL:
+            return LOOKUP_COST
+        compute = OPERATOR_COST + sum(fetch[parent] for parent in self.parents[name])
+        if mode == PARTIAL:
+            hit = self.planner.partial_hit_rate
+            return hit * LOOKUP_COST + (1 - hit) * (LOOKUP_COST + compute)
+        return compute
+
+    def kept(self, name, mode, kept):
+        # an operator processes writes if a view at or below it is stored: in full
+        # for every key if any of those is full, else for the resident keys only
+        below = [kept[child] for child in self.children[name]] + [mode]
+        return FULL if FULL in below else PARTIAL if PARTIAL in below else NONE
+
+    def write_work(self, name, kept):
+        if kept == NONE or name not in self.operator_set:
+            return 0.0
+        share = 1.0 if kept == FULL else self.planner.partial_fraction
+        return self.writes[name] * self.universes[name] * OPERATOR_COST * share
+
+    def values(self, modes):
+        # fetch top-down and kept bottom-up, for every node
+        fetch = {}
+        for name in self.parents:
+            fetch[name] = self.fetch(name, modes[name], fetch)
+        kept = {}
+        for name in reversed(list(self.parents)):
+            kept[name] = self.kept(name, modes[name], kept)
+        return fetch, kept
+
+    def costs(self, modes):
+        fetch, kept = self.values(modes)
+        read_cost = sum(rate * fetch[name] for name, rate in self.reads.items())
+        write_cost = sum(self.write_work(name, kept[name]) for name in self.operators)
+        return read_cost, write_cost
+
+    def latency(self, modes):
+        read_cost, write_cost = self.costs(modes)
+        return read_cost + write_cost
+
+    # the planner tries every upgrade of the current modes; reset() computes their
+    # costs once, change() the costs of one upgrade by walking down from the node
+    # (fetch depends on the parents) and up from it (kept depends on the children)
+    # only as far as the values change, and apply() takes the upgrade.
+
+    def reset(self, modes):
+        self.modes = dict(modes)
+        self.fetches, self.keeps = self.values(modes)
+
+    def walk(self, name, mode, value, current, successors, key):
+        # the values of name and the nodes reached from it that differ once name is
+        # in mode; nodes are visited in key order, so every node after the ones it
+        # depends on
+        changed = {}
+        values = ChainMap(changed, current)
+        heap = [(key(name), name)]
+        visited = set()
+        while heap:
+            _, node = heapq.heappop(heap)
+            if node in visited:
+                continue
+            visited.add(node)
+            new = value(node, mode if node == name else self.modes[node], values)
+            if node != name and new == current[node]:
+                continue
+            changed[node] = new
+            for successor in successors[node]:
+                heapq.heappush(heap, (key(successor), successor))
+        return changed
+
+    def change(self, name, mode):
+        # (latency difference, changed fetch values, changed kept values)
+        fetches = self.walk(name, mode, self.fetch, self.fetches, self.children, self.position.__getitem__)
+        keeps = self.walk(name, mode, self.kept, self.keeps, self.parents, lambda node: -self.position[node])
+        read_delta = sum(self.reads[node] * (fetches[node] - self.fetches[node])
+                         for node in fetches if node in self.reads)
+        write_delta = sum(self.write_work(node, keeps[node]) - self.write_work(node, self.keeps[node])
+                          for node in keeps)
+        return read_delta + write_delta, fetches, keeps
+
+    def apply(self, name, mode, change):
+        _, fetches, keeps = change
+        self.modes[name] = mode
+        self.fetches.update(fetches)
+        self.keeps.update(keeps)
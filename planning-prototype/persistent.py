@@ -0,0 +1,82 @@
+# Persistent vector: an immutable sequence where set and append return a new vector
+# that shares everything but the path to the changed slot with the old one. The
+# vector is a 32-way trie of tuples, so both take O(log32 N) time and memory and a
+# snapshot of the vector is the vector itself.
+BITS = 5
+WIDTH = 1 << BITS
+MASK = WIDTH - 1
+
+
+class PersistentVector:
+    __slots__ = ('count', 'shift', 'root')
+
+    def __init__(self, count=0, shift=0, root=()):
+        self.count = count
+        self.shift = shift
+        self.root = root
+
+    @classmethod
+    def from_iterable(cls, values):
+        vector = cls()
+        for value in values:
+            vector = vector.append(value)
+        return vector
+
+    def __repr__(self):
+        return "PersistentVector(%s)" % list(self)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if i < 0 or i >= self.count:
+            raise IndexError(i)
+        node = self.root
+        shift = self.shift
+        while shift > 0:
+            node = node[(i >> shift) & MASK]
+            shift -= BITS
+        return node[i & MASK]
+
+    def __iter__(self):
+        return leaves(self.root, self.shift)
+
+    def set(self, i, value):
+        if i < 0 or i >= self.count:
+            raise IndexError(i)
+        return PersistentVector(self.count, self.shift, assoc(self.root, self.shift, i, value))
+
+    def append(self, value):
+        root = self.root
+        shift = self.shift
+        if self.count == WIDTH << shift:
+            # the trie is full: grow a level
+            root = (root,)
+            shift += BITS
+        return PersistentVector(self.count + 1, shift, push(root, shift, self.count, value))
+
+
+def leaves(node, shift):
+    if shift == 0:
+        yield from node
+        return
+    for child in node:
+        yield from leaves(child, shift - BITS)
+
+
+def assoc(node, shift, i, value):
+    pos = (i >> shift) & MASK
+    if shift == 0:
+        return node[:pos] + (value,) + node[pos + 1:]
+    return node[:pos] + (assoc(node[pos], shift - BITS, i, value),) + node[pos + 1:]
+
+
+def push(node, shift, i, value):
+    if shift == 0:
+        return node + (value,)
+    pos = (i >> shift) & MASK
+    if pos < len(node):
+        return node[:pos] + (push(node[pos], shift - BITS, i, value),) + node[pos + 1:]
+    return node + (push((), shift - BITS, i, value),)
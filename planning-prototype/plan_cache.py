@@ -0,0 +1,127 @@
+# Plan cache for ?-templated queries. A plan depends on the query's template and the
+# policies it is planned against, not on the parameters a request binds or the
+# universe it reads from, so plans are cached by the normalized template text and a
+# version of the policy set:
+#
+#   cache = PlanCache(policies, capacity=256)
+#   plan = cache.plan("select * from Post where p_cid=?", schema)
+#   plan.graph, plan.keys, plan.indexes
+#   cache.set_policies(new_policies)
+#
+# The policy set's version is computed once, when the policies are set, rather than
+# on every lookup. Plans are evicted least recently used first. Cached graphs are
+# shared between requests; they are persistent (see dataflow.Graph), so a caller
+# that wants to change one takes a copy() first, which is O(1).
+import hashlib
+from collections import OrderedDict
+import indexing
+import planning
+import sql_translator
+from catalog import Catalog
+from cost import CostModel
+
+
+class CachedPlan:
+    # graph: the optimized plan; keys: the Table.column pairs the query's view is
+    # looked up by (see sql_translator); indexes: the plan's index specifications
+    # (see indexing.py)
+    __slots__ = ('template', 'name', 'graph', 'keys', 'cost', 'indexes')
+
+    def __init__(self, template, name, graph, keys, cost, indexes=None):
+        self.template = template
+        self.name = name
+        self.graph = graph
+        self.keys = keys
+        self.cost = cost
+        self.indexes = indexes if indexes is not None else {}
+
+    def __repr__(self):
+        return "<CachedPlan: %s, %d nodes, cost: %s>" % (self.template, len(self.graph), self.cost)
+
+
+def policy_version(policies):
+    # changes whenever a policy graph does, whatever order the policies come in
+    digest = hashlib.sha1()
+    for fingerprint in sorted(policy.fingerprint() for policy in policies):
+        digest.update(fingerprint.encode())
+    return digest.hexdigest()
+
+
+def template_name(template):
+    # the name the query's final view gets in the plan
+    return 'q_' + hashlib.sha1(template.encode()).hexdigest()[:10]
+
+
+class PlanCache:
+    def __init__(self, policies, capacity=128, search='best-first', cost_function=None, max_expansions=None,
+                 time_budget=None):
+        if capacity < 1:
+            raise ValueError("plan cache capacity must be positive")
+        self.capacity = capacity
+        self.search = search
+        self.cost_function = cost_function if cost_function is not None else CostModel()
+        self.max_expansions = max_expansions
+        self.time_budget = time_budget
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.set_policies(policies)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def set_policies(self, policies):
+        # plans made for the previous policy set stay cached under its version
+        self.policies = list(policies)
+        self.version = policy_version(self.policies)
+
+    def key(self, sql):
+        return (sql_translator.normalize_sql(sql), self.version)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def plan(self, sql, schema):
+        # the cached plan for sql's template, planned now if there is none
+        key = self.key(sql)
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+        template = key[0]
+        name = template_name(template)
+        query = sql_translator.translate(sql, name, schema)
+        plans = planning.planning([query.to_dataflow(schema)], self.policies, search=self.search,
+                                  cost_function=self.cost_function, max_expansions=self.max_expansions,
+                                  time_budget=self.time_budget)
+        graph = min(plans, key=self.cost_function)
+        catalog = schema if isinstance(schema, Catalog) else None
+        indexes = indexing.lookup_indexes(graph, {name: query.keys}, catalog)
+        entry = CachedPlan(template, name, graph, query.keys, self.cost_function(graph), indexes)
+        self.put(key, entry)
+        return entry
+
+    def invalidate(self, version=None):
+        # drops every plan made for a policy set, or all plans
+        for key in [key for key in self.entries if version is None or key[1] == version]:
+            del self.entries[key]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self.entries), 'capacity': self.capacity}
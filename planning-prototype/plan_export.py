@@ -0,0 +1,126 @@
+# Machine readable plan output: a planned graph as JSON, for tools and for diffing
+# plans between runs, or as Graphviz DOT, for drawing without matplotlib.
+import json
+import os
+import indexing
+import universes
+from cost import CostModel
+
+FORMATS = ('json', 'dot')
+
+
+def node_to_dict(node, cls, annotation=None):
+    entry = {
+        'name': node.name,
+        'operation': node.operation_type,
+        'predicate': node.predicate,
+        'operation_on': node.operation_on,
+        'groupby': node.groupby,
+        'policy': bool(node.policy),
+        'exported_as': node.exported_as,
+        'universe': cls,
+    }
+    if annotation is not None:
+        entry.update(annotation)
+    return entry
+
+
+def plan_to_dict(graph, cost_function=None, materialization=None, indexes=None, sharding=None):
+    # with a materialization (see materialization.py) every node records how its view
+    # is stored and its estimated state size, with index specifications (see
+    # indexing.py) the columns it is looked up by, with a sharded plan (see
+    # sharding.py) the column it is partitioned on
+    if cost_function is None:
+        cost_function = CostModel()
+    classes = universes.classify_universes(graph)
+    order = graph.topological_order()
+    annotations = {} if materialization is None else materialization.annotations()
+    if indexes is not None:
+        for name, annotation in indexing.annotations(indexes).items():
+            annotations.setdefault(name, {}).update(annotation)
+    if sharding is not None:
+        for name, annotation in sharding.annotations().items():
+            annotations.setdefault(name, {}).update(annotation)
+    plan = {
+        'fingerprint': graph.fingerprint(),
+        'cost': cost_function(graph),
+        'nodes': [node_to_dict(node, classes[node.name], annotations.get(node.name)) for node in order],
+        'edges': [[node.name, child.name] for node in order for child in graph.successors(node)],
+    }
+    if materialization is not None:
+        plan['memory_bytes'] = materialization.memory()
+        plan['memory_budget'] = materialization.budget
+        plan['read_latency'] = materialization.read_cost
+        plan['write_latency'] = materialization.write_cost
+    if sharding is not None:
+        plan['shards'] = sharding.shards
+        plan['exchanges'] = [exchange.to_dict() for exchange in sharding.exchanges.values()]
+    return plan
+
+
+def quote(text):
+    return '"%s"' % str(text).replace('"', '\\"')
+
+
+def plan_to_dot(graph, name='plan', materialization=None, indexes=None, sharding=None):
+    # base tables are ellipses, operators boxes; policy operators are shaded and
+    # per-universe operators drawn with a bold outline. views that are not stored
+    # are dashed, and so are edges that re-partition rows between shards.
+    classes = universes.classify_universes(graph)
+    lines = ['digraph %s {' % quote(name), '  rankdir=TB;']
+    for node in graph.topological_order():
+        if node.operation_type is None:
+            lines.append('  %s [shape=ellipse];' % quote(node.name))
+            continue
+        label = node.name + '\\n' + node.operation_type
+        if node.predicate is not None:
+            label += ': ' + node.predicate
+        if materialization is not None:
+            label += '\\n%s %.0fB' % (materialization.modes[node.name], materialization.resident[node.name])
+        if indexes is not None:
+            for spec in indexes.get(node.name, []):
+                label += '\\n%s index (%s)' % (spec.kind, ', '.join(spec.columns))
+        attributes = ['shape=box', 'label=%s' % quote(label)]
+        # graphviz keeps only the last style attribute, so the styles go in one
+        styles = []
+        if node.policy:
+            styles.append('filled')
+            attributes.append('fillcolor=lightgrey')
+        if classes[node.name] == universes.UNIVERSE:
+            attributes.append('penwidth=2')
+        if materialization is not None and materialization.modes[node.name] == 'none':
+            styles.append('dashed')
+        if len(styles) > 0:
+            attributes.append('style=%s' % quote(','.join(styles)))
+        lines.append('  %s [%s];' % (quote(node.name), ' '.join(attributes)))
+    for node in graph.topological_order():
+        for child in graph.successors(node):
+            exchange = None if sharding is None else sharding.exchanges.get((node.name, child.name))
+            if exchange is None:
+                lines.append('  %s -> %s;' % (quote(node.name), quote(child.name)))
+            else:
+                lines.append('  %s -> %s [style=dashed label=%s];' % (
+                    quote(node.name), quote(child.name), quote('exchange %s' % exchange.column)))
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_plan(graph, path, formats=('json',), cost_function=None, materialization=None, indexes=None,
+               sharding=None):
+    # writes path.json and/or path.dot; returns the files written
+    directory = os.path.dirname(path)
+    if len(directory) > 0:
+        os.makedirs(directory, exist_ok=True)
+    written = []
+    for fmt in formats:
+        if fmt == 'json':
+            text = json.dumps(plan_to_dict(graph, cost_function, materialization, indexes, sharding), indent=2)
+        elif fmt == 'dot':
+            text = plan_to_dot(graph, os.path.basename(path), materialization, indexes, sharding)
+        else:
+            raise ValueError("unknown plan format %s" % fmt)
+        filename = '%s.%s' % (path, fmt)
+        with open(filename, 'w') as f:
+            f.write(text)
+        written.append(filename)
+    return written
@@ -1,212 +1,320 @@
 import dataflow
-import sys
+import heapq
+import time
+import tracing
+import universes
+from cost import CostModel
 from dataflow import * 
 
-PERSON_ID_COLS = {'contactID'}
+from predicate import is_person_id, parse_operand
 
-def check_commutativity(op1, op2): 
-    print('commutativity check: {} vs {}'.format(op1, op2))
-    if type(op1) == Filter and type(op2) == Filter: 
-        return True 
-    elif type(op1) == Aggregate and type(op2) == Filter:
-        return False
-    elif type(op1) == Transform and type(op2) == Filter: 
-        transform_preds = op1.predicates 
-        filter_preds = op2.predicate 
+# commutativity only depends on the kind and predicates of the two operations, so 
+# it is decided once per pair of operator signatures and reused for the rest of 
+# the planning session. 
+COMMUTATIVITY_CACHE = {}
 
-        if '.' in transform_preds: 
-            table_transform, col_transform = transform_preds.split(".")
-        else: 
-            col_transform = None 
 
-        if '.' in filter_preds: 
-            table_filter, col_filter = filter_preds.split(".")
-        else: 
-            col_filter = None
-        
-        if '.' in transform_preds and '.' in filter_preds and col_transform == col_filter: 
-            return False
-        elif ('UID' in transform_preds or 'UID' in filter_preds) and (col_filter in PERSON_ID_COLS or col_transform in PERSON_ID_COLS): 
-            return False 
-        else: 
-            return True 
-        
-    elif type(op1) == Filter and type(op2) == Aggregate: 
-        return False 
-    elif type(op1) == Aggregate and type(op2) == Aggregate: 
-        return False 
-        # TODO fill this in 
-    elif (type(op1) == Transform and type(op2) == Aggregate) or (type(op1) == Aggregate and type(op2) == Transform): 
-        if type(op1) == Transform: 
-            transform_preds = op1.predicates 
-        else: 
-            transform_preds = op2.predicates 
+def operation_class(op): 
+    # the planner compares graph nodes, which only record their kind as a string 
+    if not isinstance(op, Node): 
+        return type(op)
+    if op.operation_type == "filter": 
+        return Filter 
+    elif op.operation_type == "transform": 
+        return Transform 
+    elif op.operation_type is not None: 
+        return Aggregate 
+    return None 
 
-        if type(op1) == Aggregate: 
-            agg_preds = op1.predicates 
-        else: 
-            agg_preds = op2.predicates 
-        
 
-        if '.' in transform_preds: 
-            table_transform, col_transform = transform_preds.split(".")
-        else: 
-            col_transform = None 
+def operation_predicates(op): 
+    if isinstance(op, Node): 
+        return [] if op.parsed is None else [op.parsed]
+    return op.parsed_predicates or []
 
-        if '.' in agg_preds: 
-            table_agg, col_agg = agg_preds.split(".")
-        else: 
-            col_filter = None
-        
-        if '.' in transform_preds and '.' in agg_preds and col_transform == col_agg: 
-            return False
-        elif ('UID' in transform_preds or 'UID' in agg_preds) and (col_agg in PERSON_ID_COLS or col_transform in PERSON_ID_COLS): 
-            return False 
-        else: 
-            return True 
-    elif type(op1) == Filter and type(op2) == Transform: 
-        transform_preds = op2.predicates 
-        filter_preds = op1.predicate 
 
-        if '.' in transform_preds: 
-            table_transform, col_transform = transform_preds.split(".")
-        else: 
-            col_transform = None 
+def operation_signature(op): 
+    return (operation_class(op), 
+            tuple(predicate.text for predicate in operation_predicates(op)), 
+            getattr(op, 'operation_on', None), 
+            getattr(op, 'groupby', None))
 
-        if '.' in filter_preds: 
-            table_filter, col_filter = filter_preds.split(".")
-        else: 
-            col_filter = None
-        
-        if '.' in transform_preds and '.' in filter_preds and col_transform == col_filter: 
-            return False
-        elif ('UID' in transform_preds or 'UID' in filter_preds) and (col_filter in PERSON_ID_COLS or col_transform in PERSON_ID_COLS): 
-            return False 
-        else: 
-            return True 
+
+def operation_columns(op): 
+    columns = set()
+    for predicate in operation_predicates(op): 
+        columns |= predicate.columns()
+    for on in (getattr(op, 'operation_on', None), getattr(op, 'groupby', None)): 
+        if on is not None and parse_operand(on).column is not None: 
+            columns.add(parse_operand(on).column.lower())
+    return columns 
+
+
+def user_dependent(op): 
+    return any(predicate.user_dependent for predicate in operation_predicates(op))
+
+
+def transform_conflicts(transform, other): 
+    # a transform does not commute with an operation that reads a column it touches, 
+    # or with anything user dependent once person ids are involved. 
+    transform_cols = operation_columns(transform)
+    other_cols = operation_columns(other)
+    if len(transform_cols & other_cols) > 0: 
+        return True 
+    if (user_dependent(transform) or user_dependent(other)) and any(is_person_id(col) for col in transform_cols | other_cols): 
+        return True 
+    return False 
+
+
+def check_commutativity(op1, op2): 
+    key = (operation_signature(op1), operation_signature(op2))
+    tracing.count('commutativity_checks')
+    if key not in COMMUTATIVITY_CACHE: 
+        tracing.count('commutativity_decided')
+        tracing.debug("commutativity check: %s vs %s", op1, op2)
+        COMMUTATIVITY_CACHE[key] = decide_commutativity(key[0][0], op1, key[1][0], op2)
+    return COMMUTATIVITY_CACHE[key]
+
+
+def decide_commutativity(type1, op1, type2, op2): 
+    if type1 == Filter and type2 == Filter: 
+        return True 
+    elif type1 == Aggregate and type2 == Filter:
+        return False
+    elif type1 == Transform and type2 in (Filter, Aggregate): 
+        return not transform_conflicts(op1, op2)
+    elif type1 in (Filter, Aggregate) and type2 == Transform: 
+        return not transform_conflicts(op2, op1)
+    elif type1 == Filter and type2 == Aggregate: 
+        return False 
+    elif type1 == Aggregate and type2 == Aggregate: 
+        return False 
+        # TODO fill this in 
+    elif type1 == Transform and type2 == Transform: 
+        return False 
     else: 
-        print("OP1: {} OP2: {}".format(op1, op2))
-        raise NotImplementedError
+        raise NotImplementedError("commutativity of %s and %s" % (op1, op2))
+
+
+def sole_input(graph, a, b): 
+    # b passes on the rows of a and of no other view, so an operation moved from 
+    # above b to below it sees the same rows. b may still probe other views. 
+    return [parent.name for parent in filtered_inputs(graph, b)] == [a.name]
 
 
 def swap_nodes(graph, a, b): 
-    # all nodes pointing to a should point to b now 
+    # all nodes pointing to a should point to b now, except the view a probes 
     # all nodes b pointed to, a should point to 
-    for node, out in graph.items(): 
-        if a in out: 
-            out[:] = [x if x != a else b for x in out]
-    tmp = graph[b]
-    graph[a] = graph[b]
+    keep = set()
+    probe = probed_view(graph, a)
+    if probe is not None: 
+        keep.add(probe)
+    graph.swap(a, b, keep=keep)
     return graph 
 
 
 def inject_node(graph, a, b): 
-    graph[a] = b
+    graph.set_successors(a, b)
     return graph
 
 
 def make_move(graph, roots):
-    inner_frontier = [roots]
-    result_graph = None 
+    # returns every graph reachable from this one by pushing a single policy node 
+    # below its child. we walk down from the roots and only consider policy nodes 
+    # whose child is a query node that commutes with them; reordering policy nodes 
+    # among themselves only permutes the chain. 
+    moves = []
+    inner_frontier = list(roots)
+    visited = set()
 
     while len(inner_frontier) > 0: 
-        rootset = inner_frontier.pop(0)
-        found = False 
-        for root in rootset: 
-            # print('graph: {}'.format(graph))
-            connected = None 
-            rootnode = None
-            for node, conn in graph.items(): 
-                # print('node name: {} basetable: {}'.format(node, root))
-                if node is not None and node.name == root:
-                    # print('made it!')
-                    connected = conn
-                    rootnode = node 
-            
-            if rootnode is None:
-                print("COULDNT FIND {}, continuing.".format(root)) 
-                continue 
-
-            if rootnode.operation_type is None: 
-                print("NO OPTYPE {}, continuing.".format(root)) 
-                continue 
-
-            if connected is None: 
-                print("COULDNT FIND {}'s CONNECTED, continuing.".format(root)) 
-                continue 
-            else: 
-                print('why')
-
-            num_commutative = 0
-            # print('connected: {}'.format(connected))
-            for node in connected: 
-                # print('rootnode: {}'.format(rootnode))
-                commutative = check_commutativity(rootnode, node)
-                if commutative: 
-                    num_commutative += 1 
-
-            if num_commutative == len(connected): 
-                found = True 
-                result_graph = swap_nodes(graph.copy, rootnode, node)
-            else: 
-                print('ONLY {}/{} children commutative. '.format(num_commutative, len(connected)))
-        if not found: 
-            for root in rootset: 
-                if rootnode in graph: 
-                    inner_frontier.append(graph[rootnode])
+        root = inner_frontier.pop(0)
+        if root in visited: 
+            continue 
+        visited.add(root)
+
+        rootnode = graph.node(root)
+        if rootnode is None:
+            tracing.debug("make_move: no node %s, continuing", root)
+            continue 
+
+        connected = graph.successors(rootnode)
+        for node in connected: 
+            inner_frontier.append(node.name)
+
+        if rootnode.operation_type is None or not rootnode.policy: 
+            continue 
+
+        if len(connected) != 1: 
+            # TODO at a branching point pushing the node down is not necessarily better. 
+            continue 
+
+        if connected[0].policy or not sole_input(graph, rootnode, connected[0]): 
+            continue 
+
+        tracing.count('swaps_attempted')
+        num_commutative = 0
+        for node in connected: 
+            commutative = check_commutativity(rootnode, node)
+            if commutative: 
+                num_commutative += 1 
+
+        if num_commutative == len(connected): 
+            tracing.count('swaps_accepted')
+            moves.append(swap_nodes(graph.copy(), rootnode, connected[0]))
         else: 
-            break 
+            tracing.debug("make_move: %s commutes with %d/%d children", root, num_commutative, len(connected))
     
-    return result_graph 
+    return moves 
 
 
 def merge_graphs(graph1, graph2): 
-    new_graph = graph1.copy()
-    for node, connected in new_graph.items(): 
-        if node in graph2: 
-            connected2 = graph2[node]
-            for conn in connected2:
-                if conn not in graph1[node]:
-                    print("adding {} to graph".format(node))
-                    new_graph[node].append(conn)
+    # nodes are matched by name, so views shared between policies are merged 
+    # into a single node. 
+    return merge_into(graph1.copy(), graph2)
 
-    for node, connected in graph2.items(): 
-        if node not in new_graph: 
-            new_graph[node] = connected 
 
-    return new_graph 
+def merge_into(graph, other): 
+    for node in other.keys(): 
+        graph.add_node(node)
 
+    for node, connected in other.items(): 
+        for conn in connected: 
+            if graph.add_edge(node.name, conn.name): 
+                tracing.debug("merge: edge %s -> %s", node.name, conn.name)
 
-def planning(queries, policies): 
-    print('STARTING PLANNING *********************************')
+    return graph 
 
-    # insert policy nodes directly below basetables, prior to any query computation nodes.
-    # this configuration will always be correct but it is clearly not optimal.
-    query = queries[0]
-    print('QUERY: {}'.format(query))
-    print('POLICIES: {}'.format(policies[0]))
 
+def exported_views(policy): 
+    # base table name -> the policy view that replaces it for queries 
+    exports = {}
+    for node, connected in policy.items(): 
+        if len(connected) == 0 and node.exported_as is not None: 
+            exports[node.exported_as] = node
+    return exports 
+
+
+def add_exports(new_base_tables, policy): 
+    # records the views policy exports in new_base_tables and returns them. a table 
+    # stands for a single view: policies exporting the same table have to be combined 
+    # into one beforehand (see policy_compiler), as one would otherwise hide the other. 
+    exports = exported_views(policy)
+    for table, view in exports.items(): 
+        existing = new_base_tables.get(table)
+        if existing is not None and existing.name != view.name: 
+            raise ValueError("%s and %s both export %s" % (existing.name, view.name, table))
+    new_base_tables.update(exports)
+    return exports 
+
+
+def attach_query(graph, query, new_base_tables, suffix): 
+    # merges a query into graph in place, reading exported policy views instead of 
+    # the base tables they replace. a query node whose name is already taken by a 
+    # different view is renamed with suffix. returns the names the query's nodes 
+    # have in graph. 
+    new_query = query.copy()
+    for node in query.keys(): 
+        if node.name in new_base_tables: 
+            replacement = new_base_tables[node.name]
+            new_query.replace_node(node, replacement)
+
+    renames = {}
+    for node in new_query.keys(): 
+        existing = graph.node(node.name)
+        if existing is not None and existing.signature() != node.signature(): 
+            renames[node.name] = "%s%s" % (node.name, suffix)
+            new_query.replace_node(node, node.renamed(renames[node.name]))
+    # the query's predicates name its views, so they follow the renames 
+    if len(renames) > 0: 
+        for node in new_query.keys(): 
+            renamed = node.with_tables_renamed(renames)
+            if renamed.signature() != node.signature(): 
+                new_query.replace_node(node, renamed)
+
+    merge_into(graph, new_query)
+    return [node.name for node in new_query.keys()]
+
+
+def subexpression_key(graph, node, canonical): 
+    # two nodes compute the same view if they apply the same operation to the same 
+    # (already deduplicated) inputs, whatever they are called. 
+    if node.operation_type is None: 
+        return ('table', node.name)
+    predicate = None if node.parsed is None else node.parsed.normalized()
+    parents = frozenset(canonical[parent.name] for parent in graph.predecessors(node))
+    return (node.operation_type, predicate, node.operation_on, node.groupby, node.policy, node.exported_as, parents)
+
+
+def eliminate_common_subexpressions(graph, canonical=None): 
+    # merges structurally identical nodes, within and across queries and policies, 
+    # into a single shared node. returns the number of nodes removed; if given, 
+    # canonical is filled with the name each node ended up under. 
+    if canonical is None: 
+        canonical = {}
+    seen = {}
+    merged = {}
+    removed = 0 
+    for node in graph.topological_order(): 
+        # predicates name the views they read, which may have been merged away 
+        renamed = node.with_tables_renamed(merged)
+        if renamed.signature() != node.signature(): 
+            graph.replace_node(node, renamed)
+            node = renamed 
+        key = subexpression_key(graph, node, canonical)
+        shared = seen.get(key)
+        if shared is None: 
+            seen[key] = node 
+            canonical[node.name] = node.name 
+            continue 
+        for child in graph.successors(node): 
+            graph.add_edge(shared, child)
+        graph.remove_node(node)
+        canonical[node.name] = shared.name 
+        merged[node.name] = shared.name 
+        removed += 1 
+    return removed 
+
+
+def merge_inputs(queries, policies): 
+    # the policies merged into one graph with every query attached on top, and base 
+    # table name -> the policy view exported in its place 
     new_base_tables = {}
     for policy in policies: 
-        for node, connected in policy.items(): 
-            if len(connected) == 0: 
-                if node.exported_as is not None: 
-                    new_base_tables[node.exported_as] = node
-                
+        add_exports(new_base_tables, policy)
     
     merged_policy_graph = policies[0]
     for i, policy in enumerate(policies): 
         if i > 0: 
             merged_policy_graph = merge_graphs(merged_policy_graph, policy)
   
-    new_query = query.copy()
-    for node, connected in query.items(): 
-        if node.name in new_base_tables: 
-            replacement = new_base_tables[node.name]
-            new_query[replacement] = connected
-            del new_query[node]
+    # all queries are planned together on top of the same policy graph. 
+    unoptimized_graph = merged_policy_graph.copy()
+    for i, query in enumerate(queries): 
+        attach_query(unoptimized_graph, query, new_base_tables, "_q%d" % i)
+    return unoptimized_graph, new_base_tables 
+
 
-    unoptimized_graph = merge_graphs(merged_policy_graph, new_query)
+def planning(queries, policies, search='exhaustive', cost_function=None, max_expansions=None, time_budget=None): 
+    tracing.info("planning %d queries over %d policies", len(queries), len(policies))
+    COMMUTATIVITY_CACHE.clear()
+
+    # insert policy nodes directly below basetables, prior to any query computation nodes.
+    # this configuration will always be correct but it is clearly not optimal.
+    with tracing.phase('merge'): 
+        unoptimized_graph, new_base_tables = merge_inputs(queries, policies)
+
+    with tracing.phase('share'): 
+        shared = eliminate_common_subexpressions(unoptimized_graph)
+    tracing.count('shared_subexpressions', shared)
+    tracing.info("shared %d common subexpressions", shared)
+
+    # user independent work is hoisted above the $UID dependent nodes once, up front; 
+    # it is shared by every universe whichever plan the search below picks. 
+    with tracing.phase('hoist'): 
+        hoisted = universes.hoist_global_nodes(unoptimized_graph)
+    tracing.count('hoisted_nodes', hoisted)
+    tracing.info("hoisted %d user independent nodes", hoisted)
     
     # now, our goal is to push the policy nodes as far down in the graph as possible.
     # we do this by comparing every policy node and its neighbor and seeing if we can 
@@ -216,18 +324,87 @@ def planning(queries, policies):
     # necessarily better to push down the policy node. initial heuristic: if the node is
     # user dependent, continue to push it down, otherwise don't. TODO include the branching
     # factor in this cost model?
+    #
+    # the exhaustive search returns every distinct reachable plan. the best-first search 
+    # ranks plans with cost_function (CostModel by default, which accounts for the 
+    # branching factor of user dependent nodes) and returns only the cheapest one. 
+    return search_plans(unoptimized_graph, new_base_tables.keys(), search, cost_function, max_expansions, time_budget)
+
+
+def search_plans(graph, roots, search='exhaustive', cost_function=None, max_expansions=None, time_budget=None): 
+    # only policy nodes reachable from roots are moved 
+    with tracing.phase('search'): 
+        if search == 'exhaustive': 
+            plans = exhaustive_search(graph, roots)
+        elif search == 'best-first': 
+            if cost_function is None: 
+                cost_function = CostModel()
+            plans = [best_first_search(graph, roots, cost_function, 
+                                       max_expansions=max_expansions, time_budget=time_budget)]
+        else: 
+            raise NotImplementedError
+    tracing.info("%s search explored %d plans", search, tracing.COUNTERS.get('plans_explored', 0))
+    return plans 
 
-    start_graph = unoptimized_graph.copy()
+
+def exhaustive_search(unoptimized_graph, roots): 
+    # the same plan is reachable through many different orders of swaps, so every 
+    # explored graph goes into a transposition table keyed by its fingerprint and is 
+    # only expanded (and returned) the first time we see it. 
     frontier = [unoptimized_graph]
     all_graphs = [unoptimized_graph]
+    explored = {unoptimized_graph.fingerprint()}
 
     while len(frontier) > 0: 
+        tracing.peak('frontier_peak', len(frontier))
         graph = frontier.pop(0)
-        new_graph = make_move(graph.copy(), new_base_tables.keys()) 
-        if new_graph is not None: 
+        for new_graph in make_move(graph, roots): 
+            fingerprint = new_graph.fingerprint()
+            if fingerprint in explored: 
+                continue 
+            explored.add(fingerprint)
             frontier.append(new_graph) 
-            frontier.append(graph)
             all_graphs.append(new_graph)
 
-    return all_graphs 
-    
\ No newline at end of file
+    tracing.count('plans_explored', len(explored))
+    tracing.count('expansions', len(all_graphs))
+    return all_graphs
+
+
+def best_first_search(unoptimized_graph, roots, cost_function, max_expansions=None, time_budget=None): 
+    # always expand the cheapest plan seen so far and return the cheapest plan found 
+    # once the frontier is empty, max_expansions plans have been expanded, or 
+    # time_budget seconds have passed. 
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    best_cost = cost_function(unoptimized_graph)
+    best_graph = unoptimized_graph 
+    explored = {unoptimized_graph.fingerprint()}
+    frontier = [(best_cost, 0, unoptimized_graph)]
+    pushed = 1 
+    expansions = 0 
+
+    while len(frontier) > 0: 
+        if max_expansions is not None and expansions >= max_expansions: 
+            break 
+        if deadline is not None and time.perf_counter() > deadline: 
+            break 
+
+        tracing.peak('frontier_peak', len(frontier))
+        cost, _, graph = heapq.heappop(frontier)
+        expansions += 1 
+        for new_graph in make_move(graph, roots): 
+            fingerprint = new_graph.fingerprint()
+            if fingerprint in explored: 
+                continue 
+            explored.add(fingerprint)
+            new_cost = cost_function(new_graph)
+            if new_cost < best_cost: 
+                best_cost = new_cost 
+                best_graph = new_graph 
+            # the counter breaks ties so graphs themselves are never compared 
+            heapq.heappush(frontier, (new_cost, pushed, new_graph))
+            pushed += 1 
+
+    tracing.count('plans_explored', len(explored))
+    tracing.count('expansions', expansions)
+    return best_graph 
@@ -0,0 +1,338 @@
+# Compiler for the textual policy language (benchmarks/*/policies.txt):
+#
+#   $MyConflicts = filter($PaperConflict, ($UID in $PaperConflict.contactID))
+#   EXPORT $UnconflictedPapers = filter($Paper, ($Paper.paperID not in $MyConflicts.paperId))
+#   EXPORT $Anonymized = transform($Reviews, ($UID in $PC => $Reviews.contactID = 'NULL'))
+#   $Counts = count($PaperReview, $PaperReview.paperId)
+#
+# Every EXPORT statement becomes one policy: the Filter/Transform/Aggregate chain of
+# the exported view and the unexported views it reads, turned into a dataflow graph,
+# like the hand written chains in benchmarks.py. Several EXPORTs standing in for the
+# same table become a single policy instead: queries read the union of their rows,
+# through an Exported<table> view over the exported views. The same goes for a view
+# that is exported and also read by other views, so that every view keeps the same
+# exported_as in every policy it is part of. Statements that cannot be compiled
+# (placeholders written as "...", write policies, references to views that are not
+# defined) are reported in skipped rather than failing the whole file.
+#
+# Compiled graphs are cached on disk keyed by the policy text and the schema, so a
+# large policy file is only parsed and run through to_dataflow when it changes.
+import re
+import artifacts
+from dataflow import Aggregate, Filter, Function, Graph, Node, Transform
+from predicate import IN, IN_PATTERN, NOT_IN, REWRITE, parse_operand, parse_predicate
+
+FILTER = 'filter'
+TRANSFORM = 'transform'
+COUNT = 'count'
+
+STATEMENT_PATTERN = re.compile(r'^[ \t]*(EXPORT\s+)?\$(\w+)\s*=\s*', re.MULTILINE)
+CALL_PATTERN = re.compile(r'^(\w+)\s*\(', re.DOTALL)
+ASSIGNMENT_PATTERN = re.compile(r'(\$?\w+\.\w+)\s*=(?!>)\s*(\'[^\']*\'|"[^"]*"|`[^`]*`|[^,\s]+)')
+VARIABLE_PATTERN = re.compile(r'\$(\w+)')
+COMMENT_PATTERN = re.compile(r'//[^\n]*')
+EXPORT_NAME = 'Exported%s'
+QUOTES = {'“': '"', '”': '"', '‘': "'", '’': "'"}
+OPENERS = {'(': ')', '[': ']'}
+
+# part of the artifact key: bump when a change to the compiler changes its output
+COMPILER_VERSION = 2
+
+
+class Statement:
+    # one "[EXPORT] $name = op(source, predicates)" definition
+    __slots__ = ('name', 'op', 'source', 'predicates', 'exported', 'groupby')
+
+    def __init__(self, name, op, source, predicates, exported, groupby=None):
+        self.name = name
+        self.op = op
+        self.source = source
+        self.predicates = predicates
+        self.exported = exported
+        self.groupby = groupby
+
+    def __repr__(self):
+        return "<Statement: %s = %s(%s, %s)>" % (self.name, self.op, self.source, self.predicates)
+
+
+class CompiledPolicies:
+    # policies: (exported view, dataflow graph) pairs; skipped: (view, reason) pairs
+    def __init__(self, policies, skipped, key):
+        self.policies = policies
+        self.skipped = skipped
+        self.key = key
+
+    def graphs(self):
+        return [graph for _, graph in self.policies]
+
+
+def split_arguments(text):
+    # commas at the outermost bracket level. policy files are hand written and often
+    # close a bracket too many, so closers never take the depth below zero.
+    parts = []
+    depth = 0
+    start = 0
+    for i, char in enumerate(text):
+        if char in OPENERS:
+            depth += 1
+        elif char in (')', ']'):
+            depth = max(depth - 1, 0)
+        elif char == ',' and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return [part.strip() for part in parts if len(part.strip()) > 0]
+
+
+def balance(text):
+    # drops closing brackets that close nothing
+    out = []
+    depth = 0
+    for char in text:
+        if char in OPENERS:
+            depth += 1
+        elif char in (')', ']'):
+            if depth == 0:
+                continue
+            depth -= 1
+        out.append(char)
+    return ''.join(out)
+
+
+def unwrap(text):
+    # strips brackets around the whole of text
+    text = balance(text).strip()
+    while len(text) > 1 and text[0] in OPENERS:
+        depth = 0
+        for i, char in enumerate(text):
+            if char in OPENERS:
+                depth += 1
+            elif char in (')', ']'):
+                depth -= 1
+                if depth == 0:
+                    break
+        if i != len(text) - 1:
+            break
+        text = text[1:-1].strip()
+    return text
+
+
+def flatten(text):
+    # predicate groups nest freely: "(a, b)", "[(a), (b)]"
+    parts = split_arguments(unwrap(text))
+    if len(parts) == 1:
+        return [parts[0]]
+    return [leaf for part in parts for leaf in flatten(part)]
+
+
+def strip_brackets(text):
+    return re.sub(r'[()\[\]]', ' ', text).strip()
+
+
+def normalize_operand(text):
+    for quote, replacement in QUOTES.items():
+        text = text.replace(quote, replacement)
+    if text.count('`') % 2 == 1:
+        text = text.replace('`', '')
+    text = VARIABLE_PATTERN.sub(lambda m: '$UID' if m.group(1).upper() == 'UID' else m.group(1), text)
+    return ' '.join(text.split())
+
+
+def normalize_predicate(text):
+    # "$Paper.paperId` IN ($My_Conflicts)" -> "Paper.paperId IN My_Conflicts"
+    text = strip_brackets(text)
+    parts = IN_PATTERN.split(text, maxsplit=1)
+    if len(parts) == 3:
+        left, kind, right = parts
+        kind = NOT_IN if kind.upper().startswith('NOT') else IN
+    elif text.count('=') == 1:
+        # scalar equality is membership in a one element set
+        left, right = text.split('=')
+        kind = IN
+    else:
+        raise ValueError("cannot parse predicate: %s" % text)
+    predicate = "%s %s %s" % (normalize_operand(left), kind, normalize_operand(right))
+    parse_predicate(predicate)
+    return predicate
+
+
+def normalize_rewrites(text):
+    # "$Paper.title = 'NULL', $Paper.abstract = 'NULL'" -> "Paper.title => 'NULL'", ...
+    rewrites = ["%s %s %s" % (normalize_operand(column), REWRITE, normalize_operand(value))
+                for column, value in ASSIGNMENT_PATTERN.findall(strip_brackets(text))]
+    if len(rewrites) == 0:
+        raise ValueError("transform without rewrites: %s" % text)
+    return rewrites
+
+
+def parse_statement(name, exported, body):
+    call = CALL_PATTERN.match(body)
+    if call is None:
+        raise ValueError("no definition")
+    op = call.group(1).lower()
+    args = split_arguments(body[call.end():])
+    if len(args) == 0:
+        raise ValueError("%s without arguments" % op)
+    source = parse_operand(normalize_operand(strip_brackets(args[0])))
+    if source.table is None:
+        raise ValueError("cannot read from %s" % args[0])
+    rest = ', '.join(args[1:])
+
+    if op == FILTER:
+        predicates = [normalize_predicate(leaf) for leaf in flatten(rest)]
+        return Statement(name, op, source.table, predicates, exported)
+    if op == TRANSFORM:
+        if REWRITE not in rest:
+            raise ValueError("transform without %s" % REWRITE)
+        conditions, rewrites = rest.split(REWRITE, 1)
+        conditions = [normalize_predicate(leaf) for leaf in flatten(strip_brackets(conditions))
+                      if len(strip_brackets(leaf)) > 0]
+        return Statement(name, op, source.table, conditions + normalize_rewrites(rewrites), exported)
+    if op == COUNT:
+        groupby = None
+        if len(args) > 1:
+            groupby = normalize_operand(strip_brackets(args[1]))
+        return Statement(name, op, source.table, [], exported, groupby=groupby)
+    raise ValueError("unknown operation %s" % op)
+
+
+def parse_policies(text):
+    # returns the statements that parsed and (view, reason) for those that did not
+    text = COMMENT_PATTERN.sub('', text)
+    matches = list(STATEMENT_PATTERN.finditer(text))
+    statements = []
+    skipped = []
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        body = text[match.end():end].strip()
+        # anything after the definition that is not part of it, e.g. a write policy
+        lines = body.split('\n\n')
+        body = lines[0].strip()
+        try:
+            statements.append(parse_statement(match.group(2), match.group(1) is not None, body))
+        except ValueError as e:
+            skipped.append((match.group(2), str(e)))
+    return statements, skipped
+
+
+def referenced_tables(statement):
+    tables = [statement.source]
+    for text in statement.predicates:
+        for operand in parse_predicate(text).operands:
+            if operand.table is not None and operand.table not in tables and operand.table != statement.name:
+                tables.append(operand.table)
+    return tables
+
+
+def operation(statement, exported_as):
+    if statement.op == FILTER:
+        return Filter(statement.name, referenced_tables(statement), statement.predicates,
+                      policy=True, exported_as=exported_as)
+    if statement.op == TRANSFORM:
+        return Transform(statement.name, referenced_tables(statement), statement.predicates,
+                         policy=True, exported_as=exported_as)
+    operation_on = statement.groupby if statement.groupby is not None else "%s.*" % statement.source
+    return Aggregate(statement.name, "count(*)", [statement.source], operation_on, None,
+                     groupby=statement.groupby, policy=True, exported_as=exported_as)
+
+
+def event_chain(statement, definitions, schema):
+    # the operations computing statement, every view it reads before it
+    chain = []
+    visiting = set()
+
+    def visit(current):
+        if current.name in visiting:
+            raise ValueError("%s is defined in terms of itself" % current.name)
+        visiting.add(current.name)
+        for table in referenced_tables(current):
+            if table in definitions:
+                if all(op.new_view_name != table for op in chain):
+                    visit(definitions[table])
+            elif table not in schema:
+                raise ValueError("%s reads unknown view %s" % (current.name, table))
+        visiting.discard(current.name)
+        chain.append(operation(current, None))
+
+    visit(statement)
+    return chain
+
+
+def base_table(statement, definitions):
+    # the table an exported view stands in for: where its source chain starts
+    seen = set()
+    while statement.source in definitions and statement.source not in seen:
+        seen.add(statement.source)
+        statement = definitions[statement.source]
+    return statement.source
+
+
+def combined_export(graphs, names, table):
+    # the policy graphs of several views merged, with a union of them exported as table
+    combined = Graph()
+    for graph in graphs:
+        for node in graph.keys():
+            combined.add_node(node)
+    for graph in graphs:
+        for node, connected in graph.items():
+            for child in connected:
+                combined.add_edge(node.name, child.name)
+    export = Node(EXPORT_NAME % table, 'filter', True, exported_as=table)
+    for name in names:
+        combined.add_edge(name, export)
+    return combined
+
+
+def compile_policies(text, schema):
+    statements, skipped = parse_policies(text)
+    definitions = {statement.name: statement for statement in statements}
+    chains = {}
+    exports = {}
+    for statement in statements:
+        if not statement.exported:
+            continue
+        try:
+            chains[statement.name] = event_chain(statement, definitions, schema)
+            exports.setdefault(base_table(statement, definitions), []).append(statement.name)
+        except ValueError as e:
+            skipped.append((statement.name, str(e)))
+    read = {op.new_view_name for chain in chains.values() for op in chain[:-1]}
+
+    policies = []
+    for table, names in exports.items():
+        combined = len(names) > 1 or names[0] in read
+        if not combined:
+            chains[names[0]][-1] = operation(definitions[names[0]], table)
+        compiled = []
+        graphs = []
+        for name in names:
+            try:
+                graphs.append(Function(chains[name], schema).to_dataflow(schema))
+                compiled.append(name)
+            except (ValueError, NotImplementedError) as e:
+                skipped.append((name, str(e) or type(e).__name__))
+        if len(graphs) == 0:
+            continue
+        if combined:
+            policies.append((EXPORT_NAME % table, combined_export(graphs, compiled, table)))
+        else:
+            policies.append((compiled[0], graphs[0]))
+    return policies, skipped
+
+
+def schema_key(schema):
+    return repr(sorted((table, list(columns)) for table, columns in schema.items()))
+
+
+def load_policy_file(path, schema, cache_dir=None, use_cache=True):
+    with open(path, 'rb') as f:
+        source = f.read()
+    key = artifacts.content_hash(source, schema_key(schema), str(COMPILER_VERSION))
+
+    def build():
+        policies, skipped = compile_policies(source.decode('utf-8'), schema)
+        return CompiledPolicies(policies, skipped, key)
+
+    if not use_cache:
+        return build()
+    return artifacts.cached(path, 'policies', key, build, cache_dir)
@@ -0,0 +1,133 @@
+# Parsed form of the predicate strings used by Filter, Transform and Aggregate.
+# Predicates are parsed once and cached by their text, so every node and operator
+# that uses the same predicate shares the same Predicate object.
+import re
+import sys
+from functools import lru_cache
+
+PERSON_ID_COLS = {'contactID'}
+
+IN = "IN"
+NOT_IN = "NOT IN"
+REWRITE = "=>"
+
+PARAMS = {'UID'}
+LITERALS = {'TRUE', 'FALSE', 'NULL'}
+
+IN_PATTERN = re.compile(r'\s+(NOT\s+IN|IN)\s+', re.IGNORECASE)
+
+
+def is_person_id(column):
+    if column is None:
+        return False
+    return column.lower() in {col.lower() for col in PERSON_ID_COLS}
+
+
+class Operand:
+    # one side of a predicate: a table.column reference, a bare view name, a
+    # $UID style parameter, or a literal value.
+    __slots__ = ('text', 'table', 'column', 'is_param', 'is_literal')
+
+    def __init__(self, text, table=None, column=None, is_param=False, is_literal=False):
+        self.text = text
+        self.table = table
+        self.column = column
+        self.is_param = is_param
+        self.is_literal = is_literal
+
+    def __repr__(self):
+        return "<Operand: %s>" % self.text
+
+    @property
+    def is_person_id(self):
+        return is_person_id(self.column)
+
+
+class Predicate:
+    __slots__ = ('text', 'kind', 'left', 'right')
+
+    def __init__(self, text, kind, left, right):
+        self.text = text
+        self.kind = kind
+        self.left = left
+        self.right = right
+
+    def __repr__(self):
+        return "<Predicate: %s %s %s>" % (self.left.text, self.kind, self.right.text)
+
+    def normalized(self):
+        # the same predicate regardless of spacing, case of IN and $ prefixes
+        return (self.kind, self.left.text.replace('$', '').strip(), self.right.text.replace('$', '').strip())
+
+    @property
+    def user_dependent(self):
+        return self.left.is_param or self.right.is_param
+
+    @property
+    def operands(self):
+        return (self.left, self.right)
+
+    def tables(self):
+        return [op.table for op in self.operands if op.table is not None]
+
+    def columns(self):
+        return {op.column.lower() for op in self.operands if op.column is not None}
+
+    def rewritten_columns(self):
+        if self.kind == REWRITE and self.left.column is not None:
+            return {self.left.column.lower()}
+        return set()
+
+    def references_person_id(self):
+        return self.left.is_person_id or self.right.is_person_id
+
+    def renamed(self, names):
+        # the text of this predicate reading the tables in names under their new names
+        left, right = renamed_operand(self.left.text, names), renamed_operand(self.right.text, names)
+        if left == self.left.text and right == self.right.text:
+            return self.text
+        return "%s %s %s" % (left.strip(), self.kind, right.strip())
+
+    def side_input(self):
+        # the table this predicate probes rather than filters. in "Paper.paperID NOT IN
+        # MyConflicts.paperId" the rows of Paper are filtered by membership in MyConflicts;
+        # in "$UID IN PaperConflict.contactID" PaperConflict is the only input.
+        if self.kind == REWRITE or self.left.is_param or self.left.is_literal:
+            return None
+        return self.right.table
+
+
+def parse_operand(text):
+    text = text.strip()
+    name = text.replace('$', '').strip()
+    if name.upper() in PARAMS:
+        return Operand(text, is_param=True)
+    if name.upper() in LITERALS or name[:1] in ('"', "'", '`', '“') or name.replace('.', '', 1).isdigit():
+        return Operand(text, is_literal=True)
+    if '.' in name:
+        table, column = name.split('.', 1)
+        return Operand(text, table=sys.intern(table.strip()), column=sys.intern(column.strip()))
+    return Operand(text, table=sys.intern(name))
+
+
+def renamed_operand(text, names):
+    operand = parse_operand(text)
+    if operand.table is None or operand.table not in names:
+        return text
+    return text.strip().replace(operand.table, names[operand.table], 1)
+
+
+@lru_cache(maxsize=None)
+def parse_predicate(text):
+    if text is None:
+        return None
+    if REWRITE in text:
+        left, right = text.split(REWRITE, 1)
+        return Predicate(text, REWRITE, parse_operand(left), parse_operand(right))
+
+    parts = IN_PATTERN.split(text, maxsplit=1)
+    if len(parts) != 3:
+        raise ValueError("cannot parse predicate: %s" % text)
+    left, kind, right = parts
+    kind = NOT_IN if kind.upper().startswith('NOT') else IN
+    return Predicate(text, kind, parse_operand(left), parse_operand(right))
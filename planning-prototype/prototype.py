@@ -1,35 +1,41 @@
 import argparse 
-import benchmarks 
+import catalog 
 import os 
 import planning 
+import policy_compiler 
+import sql_translator 
 import sys
-import json 
-import networkx as nx
-import matplotlib.pyplot as plt
+import tracing 
+import universes 
+import indexing 
+import materialization 
+import contextlib 
+import plan_export 
+import sharding 
 from benchmarks import * 
-from networkx.drawing.nx_agraph import graphviz_layout
-from moz_sql_parser import parse
-from enum import Enum
 from planning import * 
 
+# networkx, matplotlib and graphviz are only imported by visualize(), so planning 
+# without drawing (--headless) starts without them. 
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks')
+SCHEMAS = {
+    'hotcrp': os.path.join(BENCHMARKS_DIR, 'hotcrp', 'schema.sql'), 
+    'twitter': os.path.join(BENCHMARKS_DIR, 'twitter', 'twitter-schema.sql '), 
+    'piazza': os.path.join(BENCHMARKS_DIR, 'piazza', 'schema.sql'), 
+}
+# benchmarks without hand-built chains in benchmarks.py are compiled from their files 
+POLICY_FILES = {
+    'piazza': os.path.join(BENCHMARKS_DIR, 'piazza', 'policies.txt '), 
+}
+QUERY_FILES = {
+    'piazza': os.path.join(BENCHMARKS_DIR, 'piazza', 'queries.sql'), 
+}
+
 
 def load_schema(schema_path): 
-    base_tables = {}
-    f = open(schema_path)
-    lines = f.readlines()
-    most_recent_table = None 
-    for line in lines: 
-        if 'CREATE' in line: 
-            table_name = line.split('TABLE')[1].replace('(', '').replace('`', '').replace('\n', '')
-            most_recent_table = table_name.strip()
-            base_tables[most_recent_table] = []
-        elif len(line.strip()) > 0 and line.strip()[0] == '`': 
-            line = line.split()
-            col_name = line[0].replace('`', '')
-            base_tables[most_recent_table].append(col_name)
-        else: 
-            continue 
-    return base_tables 
+    # table name -> column names, with types, keys and indexes; see catalog.py 
+    return catalog.load_catalog(schema_path)
 
 
 def load_policies(schema, benchmark): 
@@ -75,19 +81,26 @@ def load_policies(schema, benchmark):
 
 def load_queries(schema, benchmark):
     if benchmark == 'hotcrp': 
-        full_query = hotcrp_query_nodes
+        event_chains = hotcrp_queries
     elif benchmark == 'twitter': 
-        full_query = twitter_full_query  
+        event_chains = twitter_queries  
     else: 
         raise NotImplementedError
   
-    full_query = Function(full_query, schema)
-    full_query = full_query.to_dataflow(schema)    
-    print("FULL QUERY: {}".format(full_query))
-    return [full_query] 
+    queries = []
+    for event_chain in event_chains: 
+        full_query = Function(event_chain, schema)
+        full_query = full_query.to_dataflow(schema)    
+        tracing.info("query: %s", full_query)
+        queries.append(full_query)
+    return queries 
 
  
 def visualize(graph): 
+    import networkx as nx
+    import matplotlib.pyplot as plt
+    from networkx.drawing.nx_agraph import graphviz_layout
+
     G = nx.DiGraph()
 
     for node in graph.keys(): 
@@ -105,31 +118,95 @@ def visualize(graph):
     plt.show()
 
 
-def main():
-    parser = argparse.ArgumentParser(description='Select benchmark.')
-    parser.add_argument('--benchmark', type=str, default='hotcrp') 
-    args = parser.parse_args()
-
-    if args.benchmark == 'hotcrp': 
-        schema_path = '../benchmarks/hotcrp/schema.sql'
-    elif args.benchmark == 'twitter': 
-        schema_path = '../benchmarks/twitter/twitter-schema.sql'
+def plan_benchmark(benchmark, args): 
+    # returns the plans, the schema and the lookup keys of the translated queries 
+    schema = load_schema(args.schema if args.schema is not None else SCHEMAS[benchmark])
+    keys = {}
+    query_file = args.queries if args.queries is not None else QUERY_FILES.get(benchmark)
+    policy_file = args.policies if args.policies is not None else POLICY_FILES.get(benchmark)
+    if query_file is not None: 
+        compiled_queries = sql_translator.load_query_file(query_file, schema)
+        for name, reason in compiled_queries.skipped: 
+            print('SKIPPED QUERY {}: {}'.format(name, reason))
+        queries = compiled_queries.graphs()
+        keys = compiled_queries.keys 
     else: 
-        raise NotImplementedError 
-
-    schema = load_schema(schema_path)
-    queries = load_queries(schema, args.benchmark)
+        queries = load_queries(schema, benchmark)
     # visualize(queries[0]) 
-    policies = load_policies(schema, args.benchmark)
+    if policy_file is not None: 
+        compiled = policy_compiler.load_policy_file(policy_file, schema)
+        for name, reason in compiled.skipped: 
+            print('SKIPPED POLICY {}: {}'.format(name, reason))
+        policies = compiled.graphs()
+    else: 
+        policies = load_policies(schema, benchmark)
     
     for i, policy in enumerate(policies): 
-        print("POLICY {}: {}".format(i, policy))
-        visualize(policy)
-    final_graph = planning(queries, policies)
-    print('final graph: {}'.format(final_graph))
-    # visualize(final_graph)
-    for graph in final_graph: 
-        visualize(graph) 
+        tracing.info("policy %d: %s", i, policy)
+        if not args.headless: 
+            visualize(policy)
+    plans = planning(queries, policies, search=args.search, 
+                     max_expansions=args.max_expansions, time_budget=args.time_budget)
+    return plans, schema, keys
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Select benchmark.')
+    parser.add_argument('--benchmark', type=str, nargs='+', default=['hotcrp'], choices=sorted(SCHEMAS)) 
+    parser.add_argument('--search', type=str, default='exhaustive', choices=['exhaustive', 'best-first']) 
+    parser.add_argument('--max-expansions', type=int, default=None) 
+    parser.add_argument('--time-budget', type=float, default=None, help='seconds') 
+    parser.add_argument('--users', type=int, default=None, help='report projected size for this many universes') 
+    parser.add_argument('--policies', type=str, default=None, help='policy file to compile instead of the benchmark policies') 
+    parser.add_argument('--queries', type=str, default=None, help='SQL query file to translate instead of the benchmark queries') 
+    parser.add_argument('--schema', type=str, default=None, help='schema file to translate policies and queries against instead of the benchmark schema') 
+    parser.add_argument('--headless', action='store_true', help='do not draw policies and plans') 
+    parser.add_argument('--output-dir', type=str, default=None, help='write every plan to this directory') 
+    parser.add_argument('--format', type=str, nargs='+', default=['json'], choices=plan_export.FORMATS) 
+    parser.add_argument('--quiet', action='store_true', help='only print the plan files written') 
+    parser.add_argument('--memory-budget', type=float, default=None, help='bytes; choose how every view is stored within this budget') 
+    parser.add_argument('--shards', type=int, default=None, help='partition every plan over this many shards') 
+    parser.add_argument('--shard-key', type=str, nargs='+', default=[], metavar='TABLE=COLUMN', help='column a base table is partitioned on') 
+    parser.add_argument('--trace', type=str, default='off', choices=sorted(tracing.LEVELS), help='planner trace level, written to stderr') 
+    parser.add_argument('--stats', action='store_true', help='print planner counters and phase timers') 
+    args = parser.parse_args()
+    shard_keys = dict(item.split('=', 1) for item in args.shard_key)
+    tracing.set_level(args.trace)
+
+    for benchmark in args.benchmark: 
+        # counters cover the benchmark's graph construction as well as its planning 
+        tracing.reset()
+        if args.quiet: 
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull): 
+                final_graph, schema, keys = plan_benchmark(benchmark, args)
+        else: 
+            final_graph, schema, keys = plan_benchmark(benchmark, args)
+            print('final graph: {}'.format(final_graph))
+        if args.stats: 
+            print(tracing.format_stats())
+
+        # visualize(final_graph)
+        for i, graph in enumerate(final_graph): 
+            if args.users is not None: 
+                print('UNIVERSES: {}'.format(universes.project_universes(graph, args.users)))
+            views = None 
+            if args.memory_budget is not None: 
+                views = materialization.MaterializationPlanner().plan(graph, args.memory_budget)
+                print('MATERIALIZATION {}: {}'.format(i, views))
+            sharded = None 
+            if args.shards is not None: 
+                sharded = sharding.plan_shards(graph, shard_keys, schema, args.shards)
+                print('SHARDING {}: {}'.format(i, sharded))
+            # plans are written as soon as their benchmark is planned 
+            if args.output_dir is not None: 
+                path = os.path.join(args.output_dir, benchmark, 'plan-%d' % i)
+                indexes = indexing.lookup_indexes(graph, keys, catalog=schema)
+                for filename in plan_export.write_plan(graph, path, args.format, materialization=views, indexes=indexes, 
+                                                       sharding=sharded): 
+                    print(filename)
+                sys.stdout.flush()
+            if not args.headless: 
+                visualize(graph) 
 
 
 if __name__ == '__main__': 
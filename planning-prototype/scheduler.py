@@ -0,0 +1,344 @@
+# Parallel execution of a planned graph. The graph is partitioned into domains,
+# chains of operators that hand their output to exactly one next operator, cut
+# wherever a view fans out to several readers or an operator reads from several
+# views. Domains are scheduled by level: a domain's level is one more than the
+# highest level of the domains it reads from, so the domains of a level never
+# depend on each other.
+#
+# Every domain lives in one worker process, which keeps an Executor (see
+# executor.py) for the whole graph but only processes the nodes of its domains.
+# A batch of writes runs level by level: each worker processes the deltas its
+# domains received, all workers of a level at once, and returns the deltas for
+# downstream domains, which are merged per (target, source) pair and handed on as
+# one batch at the next level.
+#
+#   with DomainScheduler(plan, uid=1, workers=4) as scheduler:
+#       scheduler.write_batch([('Paper', delta), ('PaperReview', delta)])
+#       scheduler.read('VisibleReviewsAnonymized')
+#
+# With workers=0 the same schedule runs in this process.
+import argparse
+import multiprocessing
+import os
+import random
+import time
+import traceback
+import planning
+import workload
+from collections import OrderedDict
+from cost import CostModel
+from executor import Executor
+
+
+class Domain:
+    # nodes: the node names in the domain in dependency order; upstream: the
+    # domains it reads from
+    __slots__ = ('index', 'nodes', 'level', 'upstream')
+
+    def __init__(self, index, level=0):
+        self.index = index
+        self.nodes = []
+        self.level = level
+        self.upstream = set()
+
+    def __repr__(self):
+        return "<Domain %d: level %d, %s>" % (self.index, self.level, self.nodes)
+
+
+def dependents(graph):
+    # node name -> the nodes its deltas go to; an operator's probed view is one of
+    # its parents (see probed_view), so these are its children
+    return {node.name: [child.name for child in graph.successors(node)] for node in graph.topological_order()}
+
+
+def dependency_order(graph):
+    # returns (the node names in dependency order, name -> dependents, name -> the
+    # nodes it depends on)
+    targets = dependents(graph)
+    sources = {name: [] for name in targets}
+    for name, names in targets.items():
+        for target in names:
+            sources[target].append(name)
+
+    in_degree = {name: len(names) for name, names in sources.items()}
+    order = [name for name, degree in in_degree.items() if degree == 0]
+    for name in order:
+        for target in targets[name]:
+            in_degree[target] -= 1
+            if in_degree[target] == 0:
+                order.append(target)
+    if len(order) != len(targets):
+        raise ValueError("dataflow graph has a cycle")
+    return order, targets, sources
+
+
+def partition(graph):
+    # returns the domains in dependency order and node name -> domain index
+    order, targets, sources = dependency_order(graph)
+    domains = []
+    owner = {}
+    for name in order:
+        parents = sources[name]
+        if len(parents) == 1 and len(targets[parents[0]]) == 1:
+            domain = domains[owner[parents[0]]]
+        else:
+            upstream = {owner[parent] for parent in parents}
+            level = max([domains[index].level + 1 for index in upstream], default=0)
+            domain = Domain(len(domains), level)
+            domain.upstream = upstream
+            domains.append(domain)
+        domain.nodes.append(name)
+        owner[name] = domain.index
+    return domains, owner
+
+
+def level_schedule(domains):
+    # the domain indexes of every level, lowest level first
+    levels = []
+    for domain in domains:
+        while len(levels) <= domain.level:
+            levels.append([])
+        levels[domain.level].append(domain.index)
+    return levels
+
+
+def merge_items(pending, items):
+    # appends (target, source, delta) items to pending, one delta per pair
+    for target, source, delta in items:
+        pending.setdefault((target, source), []).extend(delta)
+
+
+class DomainWorker:
+    # the executor of one worker; members maps the worker's domain indexes to
+    # their node names
+    def __init__(self, graph, uid, catalog, indexes, members):
+        self.executor = Executor(graph, uid, catalog, indexes)
+        self.members = members
+
+    def handle(self, command, args):
+        if command == 'run':
+            domains, items = args
+            return self.executor.run(items, set().union(*[self.members[index] for index in domains]))
+        if command == 'read':
+            return self.executor.read(*args)
+        if command == 'lookup':
+            return self.executor.lookup(*args)
+        if command == 'stats':
+            return self.executor.stats()
+        raise ValueError("unknown command %s" % command)
+
+
+def serve(connection, handler, args):
+    # worker process main loop: handler(*args) answers every command but close
+    handler = handler(*args)
+    while True:
+        command, args = connection.recv()
+        if command == 'close':
+            break
+        try:
+            connection.send((True, handler.handle(command, args)))
+        except Exception:
+            connection.send((False, traceback.format_exc()))
+    connection.close()
+
+
+class LocalWorker:
+    # runs a worker's commands in this process
+    def __init__(self, handler, args):
+        self.handler = handler(*args)
+        self.result = None
+
+    def send(self, command, args=()):
+        self.result = self.handler.handle(command, args)
+
+    def receive(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+class ProcessWorker:
+    def __init__(self, context, handler, args):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=serve, args=(child, handler, args), daemon=True)
+        self.process.start()
+        child.close()
+
+    def send(self, command, args=()):
+        self.connection.send((command, args))
+
+    def receive(self):
+        ok, result = self.connection.recv()
+        if not ok:
+            raise RuntimeError("domain worker failed:\n%s" % result)
+        return result
+
+    def close(self):
+        if self.process.is_alive():
+            self.connection.send(('close', ()))
+            self.process.join()
+        self.connection.close()
+
+
+class DomainScheduler:
+    # workers defaults to one per core; domains of the same level are spread over
+    # the workers round robin
+    def __init__(self, graph, uid=None, catalog=None, indexes=None, workers=None):
+        self.graph = graph
+        self.domains, self.owner = partition(graph)
+        self.levels = level_schedule(self.domains)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers < 0:
+            raise ValueError("workers must not be negative")
+        count = max(workers, 1)
+        self.assignment = {}
+        for level in self.levels:
+            for i, index in enumerate(level):
+                self.assignment[index] = i % count
+        members = [{} for _ in range(count)]
+        for domain in self.domains:
+            members[self.assignment[domain.index]][domain.index] = set(domain.nodes)
+        if workers == 0:
+            self.workers = [LocalWorker(DomainWorker, (graph, uid, catalog, indexes, members[0]))]
+        else:
+            context = multiprocessing.get_context()
+            self.workers = [ProcessWorker(context, DomainWorker, (graph, uid, catalog, indexes, members[i]))
+                            for i in range(count)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+        self.workers = []
+
+    def worker(self, name):
+        if name not in self.owner:
+            raise ValueError("%s is not in the graph" % name)
+        return self.workers[self.assignment[self.owner[name]]]
+
+    def load(self, table, rows):
+        self.insert(table, rows)
+
+    def insert(self, table, rows):
+        self.write(table, [(row, 1) for row in rows])
+
+    def delete(self, table, rows):
+        self.write(table, [(row, -1) for row in rows])
+
+    def write(self, table, delta):
+        self.write_batch([(table, delta)])
+
+    def write_batch(self, writes):
+        # writes: (base table, delta) pairs, processed as one batch
+        pending = {}
+        for table, delta in writes:
+            node = self.graph.node(table)
+            if node is None or node.operation_type is not None:
+                raise ValueError("%s is not a base table" % table)
+            merge_items(pending.setdefault(self.owner[table], OrderedDict()), [(table, None, delta)])
+
+        for level in self.levels:
+            work = {}
+            for index in level:
+                items = pending.pop(index, None)
+                if items is None:
+                    continue
+                domains, batch = work.setdefault(self.assignment[index], ([], []))
+                domains.append(index)
+                batch.extend((target, source, delta) for (target, source), delta in items.items())
+            for worker, args in work.items():
+                self.workers[worker].send('run', args)
+            for worker in work:
+                for item in self.workers[worker].receive():
+                    merge_items(pending.setdefault(self.owner[item[0]], OrderedDict()), [item])
+
+    def read(self, name):
+        worker = self.worker(name)
+        worker.send('read', (name,))
+        return worker.receive()
+
+    def lookup(self, name, values, columns=None):
+        worker = self.worker(name)
+        worker.send('lookup', (name, values, columns))
+        return worker.receive()
+
+    def stats(self):
+        # per node statistics, from the worker that processes the node
+        result = {}
+        for i, worker in enumerate(self.workers):
+            worker.send('stats')
+            stats = worker.receive()
+            for name, entry in stats.items():
+                if self.assignment[self.owner[name]] == i:
+                    result[name] = entry
+        return result
+
+
+def generate_batches(schema, batches, batch_size, users, groups, seed=0):
+    # random inserts into every table of a workload schema (see workload.py)
+    rng = random.Random(seed)
+    tables = sorted(schema.keys())
+    result = []
+    next_id = 0
+    for _ in range(batches):
+        writes = []
+        for table in tables:
+            rows = []
+            for _ in range(batch_size):
+                row = {'id': next_id, 'owner_id': rng.randrange(users), 'group_id': rng.randrange(groups),
+                       'flag': rng.random() < 0.5}
+                for column in schema[table]:
+                    if column not in row:
+                        row[column] = rng.randrange(100)
+                rows.append(row)
+                next_id += 1
+            writes.append((table, [(row, 1) for row in rows]))
+        result.append(writes)
+    return result
+
+
+def main():
+    # write throughput of the best plan for a synthetic workload, in this process
+    # and on a pool of worker processes
+    parser = argparse.ArgumentParser(description='Run update batches through the domains of a plan.')
+    parser.add_argument('--policies', type=int, default=16)
+    parser.add_argument('--queries', type=int, default=8)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--max-expansions', type=int, default=200, help='plan search limit')
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, os.cpu_count() or 1])
+    parser.add_argument('--batches', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=500, help='rows per table per batch')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--groups', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    w = workload.generate_workload(args.policies, args.queries, args.depth, seed=args.seed)
+    cost_function = CostModel()
+    plan = min(planning.planning(w.queries, w.policies, search='best-first', cost_function=cost_function,
+                                 max_expansions=args.max_expansions), key=cost_function)
+    domains, _ = partition(plan)
+    levels = level_schedule(domains)
+    print('%d nodes, %d domains, %d levels, widest level %d domains' % (
+        len(plan), len(domains), len(levels), max(len(level) for level in levels)))
+    batches = generate_batches(w.schema, args.batches, args.batch_size, args.users, args.groups, args.seed)
+    rows = sum(len(delta) for writes in batches for _, delta in writes)
+
+    for workers in args.workers:
+        with DomainScheduler(plan, uid=0, catalog=w.schema, workers=workers) as scheduler:
+            start = time.perf_counter()
+            for writes in batches:
+                scheduler.write_batch(writes)
+            elapsed = time.perf_counter() - start
+        print('workers %d: %.2fs, %.0f rows/s' % (workers, elapsed, rows / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+# Planner session: keeps the merged graph and the current plan between policy and
+# query changes, and only replans the part of the plan a change touches.
+#
+# The search only ever swaps operators, never base tables, so operators that are
+# connected only through base tables are planned independently of each other. A
+# change replans the operator components it touches and leaves the rest of the
+# plan, and the commutativity decisions made for it, as they were.
+import planning
+import tracing
+import universes
+from cost import CostModel
+from dataflow import Graph, Node
+
+POLICY = 'policy'
+QUERY = 'query'
+
+
+def operator_component(graph, names):
+    # every operator connected to one of names without going through a base table
+    seen = set()
+    frontier = [name for name in names if name in graph and graph.node(name).operation_type is not None]
+    while len(frontier) > 0:
+        name = frontier.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        for node in graph.predecessors(name) + graph.successors(name):
+            if node.operation_type is not None and node.name not in seen:
+                frontier.append(node.name)
+    return seen
+
+
+class PlannerSession:
+    # policies and queries are dataflow graphs, as passed to planning.planning. each
+    # change starts fresh tracing counters, which count the graphs it builds too
+    def __init__(self, search='best-first', cost_function=None, max_expansions=None, time_budget=None):
+        self.search = search
+        self.cost_function = cost_function if cost_function is not None else CostModel()
+        self.max_expansions = max_expansions
+        self.time_budget = time_budget
+        # policies and queries merged as written; the search never rewrites this graph
+        self.unoptimized = Graph()
+        self.plan = Graph()
+        self.owners = {}
+        self.policies = {}
+        self.queries = {}
+        self.new_base_tables = {}
+        self.queries_added = 0
+
+    def own(self, names, owner):
+        for name in names:
+            self.owners.setdefault(name, set()).add(owner)
+
+    def add_policy(self, name, policy):
+        if name in self.policies:
+            raise ValueError("policy %s already exists" % name)
+        tracing.reset()
+        exports = planning.add_exports(self.new_base_tables, policy)
+        touched = [node.name for node in policy.keys()]
+        old_region = operator_component(self.plan, touched)
+
+        planning.merge_into(self.unoptimized, policy)
+        self.own(touched, (POLICY, name))
+        self.policies[name] = exports
+
+        # queries that read a base table this policy now exports read the policy's view
+        for table, view in exports.items():
+            if table not in self.unoptimized:
+                continue
+            for child in self.unoptimized.successors(table):
+                owners = self.owners.get(child.name, set())
+                if child.name != view.name and len(owners) > 0 and all(kind == QUERY for kind, _ in owners):
+                    self.unoptimized.remove_edge(table, child)
+                    self.unoptimized.add_edge(view, child)
+                    touched.append(child.name)
+
+        self.replan(old_region, touched)
+
+    def remove_policy(self, name):
+        tracing.reset()
+        exports = self.policies.pop(name)
+        for table, view in exports.items():
+            if self.new_base_tables.get(table) is view:
+                del self.new_base_tables[table]
+        self.remove((POLICY, name))
+
+    def add_query(self, name, query):
+        if name in self.queries:
+            raise ValueError("query %s already exists" % name)
+        tracing.reset()
+        self.queries_added += 1
+        old_region = operator_component(self.plan, [node.name for node in query.keys()])
+
+        names = planning.attach_query(self.unoptimized, query, self.new_base_tables, "_q%d" % self.queries_added)
+        exported = {view.name for view in self.new_base_tables.values()}
+        owned = [node_name for node_name in names if node_name not in exported]
+        self.own(owned, (QUERY, name))
+        self.queries[name] = owned
+        self.replan(old_region, names)
+
+    def remove_query(self, name):
+        tracing.reset()
+        del self.queries[name]
+        self.remove((QUERY, name))
+
+    def remove(self, owner):
+        owned = [name for name, owners in self.owners.items() if owner in owners]
+        old_region = operator_component(self.plan, owned)
+        touched = []
+        removed = []
+        for name in owned:
+            owners = self.owners[name]
+            owners.discard(owner)
+            if len(owners) == 0:
+                del self.owners[name]
+                removed.append(self.unoptimized.node(name))
+
+        for node in removed:
+            children = [child for child in self.unoptimized.successors(node) if child.name in self.owners]
+            touched.extend(child.name for child in children)
+            self.unoptimized.remove_node(node)
+            # queries that read a policy's view read the table it replaced again
+            if node.exported_as is not None:
+                for child in children:
+                    self.unoptimized.add_edge(Node(node.exported_as, None, False), child)
+                    self.owners.setdefault(node.exported_as, set()).update(self.owners[child.name])
+        self.replan(old_region, touched)
+
+    def share(self, touched):
+        canonical = {}
+        planning.eliminate_common_subexpressions(self.unoptimized, canonical)
+        # sharing replaces the nodes it renames predicates in, exported views included
+        for exports in [self.new_base_tables] + list(self.policies.values()):
+            for table, view in exports.items():
+                exports[table] = self.unoptimized.node(canonical.get(view.name, view.name))
+        for name, shared in canonical.items():
+            if name == shared:
+                continue
+            self.owners.setdefault(shared, set()).update(self.owners.pop(name, set()))
+            for names in self.queries.values():
+                names[:] = [shared if query_name == name else query_name for query_name in names]
+        return [canonical.get(name, name) for name in touched]
+
+    def replan(self, old_region, touched):
+        touched = self.share(touched)
+        seeds = [name for name in list(old_region) + touched if name in self.unoptimized]
+        region = operator_component(self.unoptimized, seeds)
+
+        for name in old_region | region:
+            if name in self.plan:
+                self.plan.remove_node(name)
+        for node in self.unoptimized.keys():
+            if node.operation_type is None:
+                self.plan.add_node(node)
+        for node in self.plan.keys():
+            if node.operation_type is None and node.name not in self.unoptimized:
+                self.plan.remove_node(node)
+        for name in region:
+            self.plan.add_node(self.unoptimized.node(name))
+        for name in region:
+            for parent in self.unoptimized.predecessors(name):
+                self.plan.add_edge(parent.name, name)
+
+        if len(region) == 0:
+            return self.plan
+        universes.hoist_global_nodes(self.plan, names=region)
+        # the search walks down from the tables policies export, as in planning()
+        roots = [table for table in self.new_base_tables
+                 if table in self.plan and any(child.name in region for child in self.plan.successors(table))]
+        plans = planning.search_plans(self.plan, roots, self.search, self.cost_function,
+                                      self.max_expansions, self.time_budget)
+        self.plan = min(plans, key=self.cost_function)
+        return self.plan
@@ -0,0 +1,317 @@
+# Key-sharded execution of a planned graph. Every base table is hash partitioned
+# on a column over a number of shards, and every operator runs on every shard over
+# the rows of its shard. An operator that needs its input partitioned some other
+# way gets an exchange on that input, which re-partitions the rows on their way:
+#
+#   - an IN join needs its input on the column it probes with and the view it
+#     probes on the column it is probed by; its output is partitioned like the input
+#   - an aggregate needs its input on the group-by column, or, without one, all of
+#     it on shard 0
+#   - filters that compare values within a row and unions keep the partitioning of
+#     their input; a rewrite of the partition column scatters it (ARBITRARY)
+#
+#   plan = plan_shards(graph, {'PaperReview': 'paperId'}, catalog, shards=4)
+#   with ShardedExecutor(plan, uid=1) as shards:
+#       shards.insert('PaperReview', rows)
+#       shards.read('VisibleReviewsAnonymized')
+#
+# Exchanges are kept on the edges they split rather than added to the graph as
+# nodes, because operators name their inputs in their predicates. Every shard is a
+# worker process with an Executor for the whole graph (see scheduler.py); a write
+# runs in rounds, each shard processing the deltas it received until the only
+# deltas left cross an exchange, which are routed to their shards for the next round.
+# Universes are not sharded: all shards execute the graph for the same uid.
+import argparse
+import multiprocessing
+import os
+import time
+import zlib
+import planning
+import workload
+from collections import OrderedDict
+from cost import CostModel
+from executor import Executor, get_column, probe_column, probed_view
+from predicate import REWRITE, parse_operand
+from scheduler import LocalWorker, ProcessWorker, dependency_order, generate_batches, merge_items
+
+# partitioning of a view whose rows are all on shard 0, and of one whose rows are
+# on no particular shard
+SINGLE = None
+ARBITRARY = '*'
+
+
+def same_key(have, want):
+    if have is ARBITRARY or want is ARBITRARY:
+        return False
+    if have is SINGLE or want is SINGLE:
+        return have is want
+    return have.lower() == want.lower()
+
+
+def shard_of(value, shards):
+    # stable across processes, unlike hash() of a string
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, int):
+        return value % shards
+    return zlib.crc32(repr(value).encode()) % shards
+
+
+class Exchange:
+    # the rows source sends target are re-partitioned on column (SINGLE: shard 0)
+    __slots__ = ('source', 'target', 'column')
+
+    def __init__(self, source, target, column):
+        self.source = source
+        self.target = target
+        self.column = column
+
+    def __repr__(self):
+        return "<Exchange: %s -> %s on %s>" % (self.source, self.target, self.column)
+
+    def to_dict(self):
+        return {'source': self.source, 'target': self.target, 'column': self.column}
+
+
+class ShardedPlan:
+    # keys: node name -> the column its rows are partitioned on; exchanges:
+    # (source, target) -> Exchange
+    def __init__(self, graph, shards, keys, exchanges):
+        self.graph = graph
+        self.shards = shards
+        self.keys = keys
+        self.exchanges = exchanges
+
+    def __repr__(self):
+        return "<ShardedPlan: %d shards, %d exchanges>" % (self.shards, len(self.exchanges))
+
+    def partition(self, column, delta):
+        # shard -> the part of delta that belongs on it when partitioned on column
+        if column is SINGLE or self.shards == 1:
+            return {0: delta}
+        result = {}
+        for row, diff in delta:
+            result.setdefault(shard_of(get_column(row, column), self.shards), []).append((row, diff))
+        return result
+
+    def route(self, items):
+        # shard -> the items sent over exchanges that belong on it
+        result = {}
+        for target, source, delta in items:
+            exchange = self.exchanges[(source, target)]
+            for shard, part in self.partition(exchange.column, delta).items():
+                result.setdefault(shard, []).append((target, source, part))
+        return result
+
+    def annotations(self):
+        return {name: {'partition': key} for name, key in self.keys.items()}
+
+
+def table_key(name, table_keys, catalog):
+    # the column a base table is partitioned on: the one given, else its lookup
+    # key if that is a single column, else none (all rows on shard 0)
+    if name in table_keys:
+        return table_keys[name]
+    key = () if catalog is None else tuple(catalog.lookup_key(name))
+    return key[0] if len(key) == 1 else SINGLE
+
+
+def plan_shards(graph, table_keys=None, catalog=None, shards=None):
+    # table_keys: base table -> the column it is partitioned on
+    table_keys = table_keys or {}
+    if shards is None:
+        shards = os.cpu_count() or 1
+    if shards < 1:
+        raise ValueError("a sharded plan needs at least one shard")
+    order, _, sources = dependency_order(graph)
+    keys = {}
+    exchanges = OrderedDict()
+
+    def require(source, target, column):
+        if not same_key(keys[source], column):
+            exchanges[(source, target)] = Exchange(source, target, column)
+
+    for name in order:
+        node = graph.node(name)
+        inputs = sources[name]
+        predicate = node.parsed
+        if node.operation_type is None:
+            keys[name] = table_key(name, table_keys, catalog)
+        elif node.operation_type not in ('filter', 'transform'):
+            column = SINGLE if node.groupby is None else parse_operand(node.groupby).column
+            for source in inputs:
+                require(source, name, column)
+            keys[name] = column
+        elif predicate is not None and predicate.kind == REWRITE:
+            key = keys[inputs[0]]
+            rewritten = key not in (SINGLE, ARBITRARY) and key.lower() in predicate.rewritten_columns()
+            keys[name] = ARBITRARY if rewritten else key
+        elif predicate is not None and probed_view(graph, node) is not None:
+            probe = probed_view(graph, node)
+            column = predicate.left.column if predicate.left.column is not None else SINGLE
+            probe_key = probe_column(node, graph, catalog) if column is not SINGLE else SINGLE
+            for source in inputs:
+                require(source, name, probe_key if source == probe else column)
+            keys[name] = column
+        else:
+            # row by row: keeps the partitioning of its input; the inputs of a union
+            # follow the first one
+            key = keys[inputs[0]]
+            if key is not ARBITRARY:
+                for source in inputs[1:]:
+                    require(source, name, key)
+            keys[name] = key
+    return ShardedPlan(graph, shards, keys, exchanges)
+
+
+class ShardWorker:
+    # the executor of one shard
+    def __init__(self, plan, uid, catalog, indexes):
+        self.plan = plan
+        self.executor = Executor(plan.graph, uid, catalog, indexes)
+        self.exchanges = set(plan.exchanges)
+
+    def handle(self, command, args):
+        if command == 'run':
+            return self.plan.route(self.executor.run(args, exchanges=self.exchanges))
+        if command == 'read':
+            return self.executor.read(*args)
+        if command == 'lookup':
+            return self.executor.lookup(*args)
+        if command == 'stats':
+            return self.executor.stats()
+        raise ValueError("unknown command %s" % command)
+
+
+class ShardedExecutor:
+    # processes=False runs every shard in this process
+    def __init__(self, plan, uid=None, catalog=None, indexes=None, processes=True):
+        self.plan = plan
+        args = (plan, uid, catalog, indexes)
+        if processes:
+            context = multiprocessing.get_context()
+            self.workers = [ProcessWorker(context, ShardWorker, args) for _ in range(plan.shards)]
+        else:
+            self.workers = [LocalWorker(ShardWorker, args) for _ in range(plan.shards)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+        self.workers = []
+
+    def load(self, table, rows):
+        self.insert(table, rows)
+
+    def insert(self, table, rows):
+        self.write(table, [(row, 1) for row in rows])
+
+    def delete(self, table, rows):
+        self.write(table, [(row, -1) for row in rows])
+
+    def write(self, table, delta):
+        self.write_batch([(table, delta)])
+
+    def write_batch(self, writes):
+        # writes: (base table, delta) pairs, processed as one batch
+        pending = {}
+        for table, delta in writes:
+            node = self.plan.graph.node(table)
+            if node is None or node.operation_type is not None:
+                raise ValueError("%s is not a base table" % table)
+            for shard, part in self.plan.partition(self.plan.keys[table], delta).items():
+                merge_items(pending.setdefault(shard, OrderedDict()), [(table, None, part)])
+
+        while len(pending) > 0:
+            work = {shard: [(target, source, delta) for (target, source), delta in items.items()]
+                    for shard, items in pending.items()}
+            pending = {}
+            for shard, items in work.items():
+                self.workers[shard].send('run', items)
+            for shard in work:
+                for target_shard, items in self.workers[shard].receive().items():
+                    merge_items(pending.setdefault(target_shard, OrderedDict()), items)
+
+    def read(self, name):
+        rows = []
+        for worker in self.workers:
+            worker.send('read', (name,))
+        for worker in self.workers:
+            rows.extend(worker.receive())
+        return rows
+
+    def lookup(self, name, values, columns=None):
+        # asks only the shard holding the rows if the view is partitioned on one of
+        # the columns looked up
+        key = self.plan.keys.get(name)
+        workers = self.workers
+        if columns is not None and key not in (SINGLE, ARBITRARY):
+            for column, value in zip(columns, values):
+                if column.lower() == key.lower():
+                    workers = [self.workers[shard_of(value, self.plan.shards)]]
+        elif key is SINGLE:
+            workers = self.workers[:1]
+        rows = []
+        for worker in workers:
+            worker.send('lookup', (name, values, columns))
+        for worker in workers:
+            rows.extend(worker.receive())
+        return rows
+
+    def stats(self):
+        # per node statistics summed over the shards, and the state of every shard
+        result = {}
+        shard_state = []
+        for worker in self.workers:
+            worker.send('stats')
+        for worker in self.workers:
+            stats = worker.receive()
+            shard_state.append(sum(entry['state'] for entry in stats.values()))
+            for name, entry in stats.items():
+                total = result.setdefault(name, dict.fromkeys(entry, 0))
+                for field, value in entry.items():
+                    total[field] += value
+        return result, shard_state
+
+
+def main():
+    # write throughput and per shard state of the best plan for a synthetic workload
+    parser = argparse.ArgumentParser(description='Run update batches through a key-sharded plan.')
+    parser.add_argument('--policies', type=int, default=16)
+    parser.add_argument('--queries', type=int, default=8)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--max-expansions', type=int, default=200, help='plan search limit')
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, os.cpu_count() or 1])
+    parser.add_argument('--batches', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=500, help='rows per table per batch')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--groups', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    w = workload.generate_workload(args.policies, args.queries, args.depth, seed=args.seed)
+    cost_function = CostModel()
+    graph = min(planning.planning(w.queries, w.policies, search='best-first', cost_function=cost_function,
+                                  max_expansions=args.max_expansions), key=cost_function)
+    batches = generate_batches(w.schema, args.batches, args.batch_size, args.users, args.groups, args.seed)
+    rows = sum(len(delta) for writes in batches for _, delta in writes)
+
+    for shards in args.shards:
+        plan = plan_shards(graph, catalog=w.schema, shards=shards)
+        with ShardedExecutor(plan, uid=0, catalog=w.schema) as executor:
+            start = time.perf_counter()
+            for writes in batches:
+                executor.write_batch(writes)
+            elapsed = time.perf_counter() - start
+            _, shard_state = executor.stats()
+        print('shards %d: %d exchanges, %.2fs, %.0f rows/s, state per shard %s' % (
+            shards, len(plan.exchanges), elapsed, rows / elapsed, shard_state))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,448 @@
+# Translator from SQL queries to Function chains, the way the queries in
+# benchmarks.py are written by hand:
+#
+#   ta_posts: SELECT * FROM Post
+#             WHERE Post.p_author IN (SELECT r_uid FROM Role WHERE Role.r_role = 1) AND p_cid = ?
+#
+#   ta_posts_sq1 = Filter(["Role"], ["1 IN Role.r_role"])
+#   ta_posts     = Filter(["Post", "ta_posts_sq1"], ["Post.p_author IN ta_posts_sq1.r_uid"])
+#   keys: Post.p_cid
+#
+# Joins become Filters with on=True, WHERE conditions one Filter with a node per
+# condition, IN (SELECT ...) subqueries and derived tables views of their own, and
+# GROUP BY an Aggregate. A join is a semi-join, as in the hand-written queries: the
+# rows of the FROM table that have a match flow on, so the conditions, keys and
+# GROUP BY after it can only name the FROM table's columns. Conditions on a ?
+# parameter are not operators: they are the columns the query's view is looked up
+# by, reported as its keys, and only the outermost SELECT can have them.
+# Projections, ORDER BY and LIMIT do not change which rows a view holds and are
+# ignored. Outer joins, aliased projections, OR and comparisons other than equality
+# and membership cannot be expressed this way, and queries using them are reported
+# in skipped.
+#
+# Statements are parsed with moz_sql_parser, which is only imported when a
+# statement is parsed. Parse trees are cached by the normalized text of the
+# statement, so a query log that repeats statements parses each one once, and
+# translated query files are cached on disk like compiled policy files.
+import re
+import artifacts
+from functools import lru_cache
+from dataflow import Aggregate, Filter, Function, Graph, Node
+from policy_compiler import schema_key
+
+# part of the artifact key: bump when a change to the translator changes its output
+TRANSLATOR_VERSION = 2
+
+# moz_sql_parser does not parse ? placeholders, so they are replaced by this name
+PARAMETER = '__param__'
+
+COMMENT_PATTERN = re.compile(r'--[^\n]*')
+NAMED_PATTERN = re.compile(r'^\s*(\w+)\s*:\s*(?=\S)', re.DOTALL)
+TOKEN_PATTERN = re.compile(r"'[^']*'|\"[^\"]*\"|`[^`]*`|\?+|\w+|<=|>=|<>|!=|\S")
+AGGREGATES = ('count', 'sum', 'min', 'max', 'avg')
+INNER_JOINS = ('join', 'inner join')
+KEYWORDS = frozenset(('select', 'distinct', 'from', 'join', 'inner', 'left', 'right', 'outer', 'on', 'where',
+                      'and', 'or', 'not', 'in', 'is', 'null', 'like', 'between', 'exists', 'group', 'by',
+                      'having', 'order', 'asc', 'desc', 'limit', 'offset', 'as', 'union', 'all') + AGGREGATES)
+
+# parse trees of this many distinct normalized statements are kept
+PARSE_CACHE_SIZE = 4096
+
+
+class TranslatedQuery:
+    # chain: the operators computing the query, its final view named name; keys:
+    # the Table.column pairs the view is looked up by; tables: the base tables read
+    __slots__ = ('name', 'sql', 'chain', 'keys', 'tables')
+
+    def __init__(self, name, sql, chain, keys, tables):
+        self.name = name
+        self.sql = sql
+        self.chain = chain
+        self.keys = keys
+        self.tables = tables
+
+    def __repr__(self):
+        return "<TranslatedQuery: %s, %d operators, keys: %s>" % (self.name, len(self.chain), self.keys)
+
+    def to_dataflow(self, schema):
+        if len(self.chain) == 0:
+            # a key lookup on a base table: the table is the query's view
+            graph = Graph()
+            for table in self.tables:
+                graph.add_node(Node(table, None, False))
+            return graph
+        return Function(self.chain, schema).to_dataflow(schema)
+
+
+class CompiledQueries:
+    # queries: (name, dataflow graph) pairs; keys: name -> lookup keys;
+    # skipped: (name, reason) pairs
+    def __init__(self, queries, keys, skipped, key):
+        self.queries = queries
+        self.keys = keys
+        self.skipped = skipped
+        self.key = key
+
+    def graphs(self):
+        return [graph for _, graph in self.queries]
+
+
+class Scope:
+    # the FROM clause of one SELECT: alias -> base table or view, and alias -> the
+    # view that currently holds its rows (a join moves every joined alias into the
+    # join's view)
+    __slots__ = ('tables', 'location', 'base')
+
+    def __init__(self):
+        self.tables = {}
+        self.location = {}
+        self.base = {}
+
+    def add(self, alias, table, base):
+        self.tables[alias] = table
+        self.location[alias] = table
+        self.base[alias] = base
+
+    def current(self):
+        return self.location[self.rows()]
+
+    def rows(self):
+        # the alias whose rows the scope's view holds: the FROM table's
+        return next(iter(self.location))
+
+
+class Translation:
+    # the state of translating one statement: the operators built so far, in
+    # dependency order, and the keys and base tables met on the way
+    def __init__(self, name, schema):
+        self.name = name
+        self.schema = schema
+        self.chain = []
+        self.keys = []
+        self.tables = []
+        self.views = 0
+        self.depth = 0
+
+    def view_name(self, suffix):
+        self.views += 1
+        return '%s_%s%d' % (self.name, suffix, self.views)
+
+    def base_table(self, name):
+        table = self.schema.table(name) if hasattr(self.schema, 'table') else None
+        if table is not None:
+            name = table.name
+        elif name not in self.schema:
+            raise ValueError("unknown table %s" % name)
+        if name not in self.tables:
+            self.tables.append(name)
+        return name
+
+    def source(self, scope, item):
+        # adds a FROM or JOIN item to scope: a table, optionally aliased, or a
+        # derived table
+        if isinstance(item, str):
+            item = {'value': item}
+        value = item['value']
+        if isinstance(value, dict) and 'select' in value:
+            alias = item.get('name', 'derived%d' % self.views)
+            view, _ = self.select(value, '%s_%s' % (self.name, alias))
+            scope.add(alias, view, view if view in self.tables else None)
+            return alias
+        table = self.base_table(value)
+        scope.add(item.get('name', value), table, table)
+        return item.get('name', value)
+
+    def resolve(self, scope, reference):
+        # "u.id" or "id" -> (alias, column)
+        if not isinstance(reference, str):
+            raise ValueError("expected a column, got %s" % reference)
+        if '.' in reference:
+            alias, column = reference.split('.', 1)
+            if alias not in scope.tables:
+                raise ValueError("unknown table %s" % alias)
+            return alias, column
+        candidates = [alias for alias, base in scope.base.items()
+                      if base is not None and hasattr(self.schema, 'column')
+                      and self.schema.column(base, reference) is not None]
+        if len(candidates) == 1:
+            return candidates[0], self.schema.column(scope.base[candidates[0]], reference).name
+        if len(scope.tables) == 1:
+            return next(iter(scope.tables)), reference
+        raise ValueError("ambiguous column %s" % reference)
+
+    def own(self, scope, reference):
+        # resolves a column of the rows the scope's view holds
+        alias, column = self.resolve(scope, reference)
+        if alias != scope.rows():
+            raise ValueError("%s is a column of a joined table, which only filters %s" % (reference, scope.rows()))
+        return alias, column
+
+    def column(self, scope, reference):
+        alias, column = self.own(scope, reference)
+        return '%s.%s' % (scope.location[alias], column)
+
+    def key(self, scope, reference):
+        if self.depth > 1:
+            raise ValueError("? parameters are only supported in the outermost SELECT")
+        alias, column = self.own(scope, reference)
+        table = scope.base[alias] if scope.base[alias] is not None else scope.tables[alias]
+        self.keys.append('%s.%s' % (table, column))
+
+    def join(self, scope, item, on):
+        # keeps the rows of the FROM table that match a row of the joined one
+        alias = self.source(scope, item)
+        joined = scope.location[alias]
+        current = scope.current()
+        predicates = []
+        for condition in conjuncts(on):
+            op, (left, right) = operation(condition)
+            if op != 'eq':
+                raise ValueError("unsupported join condition %s" % op)
+            left, right = self.resolve(scope, left), self.resolve(scope, right)
+            if left[0] == alias:
+                left, right = right, left
+            if left[0] != scope.rows() or right[0] != alias:
+                raise ValueError("a join condition has to compare %s with the joined table" % scope.rows())
+            predicates.append('%s.%s IN %s.%s' % (current, left[1], joined, right[1]))
+        name = self.view_name('join')
+        self.chain.append(Filter(name, [current, joined], predicates, on=True, policy=False))
+        for other in scope.location:
+            scope.location[other] = name
+
+    def condition(self, scope, condition, tables):
+        # the predicate text of one WHERE condition, or None if it is a key
+        op, operands = operation(condition)
+        if op not in ('eq', 'neq', 'in', 'nin'):
+            raise ValueError("unsupported condition %s" % op)
+        left, right = operands
+        negated = op in ('neq', 'nin')
+        if is_parameter(left) or is_parameter(right):
+            if negated:
+                raise ValueError("parameters can only be compared for equality")
+            self.key(scope, right if is_parameter(left) else left)
+            return None
+        kind = 'NOT IN' if negated else 'IN'
+        if isinstance(right, dict) and 'select' in right:
+            view, column = self.select(right, self.view_name('sq'))
+            if column is None:
+                raise ValueError("an IN subquery has to select a single column")
+            if view not in tables:
+                tables.append(view)
+            return '%s %s %s.%s' % (self.column(scope, left), kind, view, column)
+        if is_literal(left) or is_literal(right):
+            literal, reference = (left, right) if is_literal(left) else (right, left)
+            return '%s %s %s' % (literal_text(literal), kind, self.column(scope, reference))
+        return '%s %s %s' % (self.column(scope, right), kind, self.column(scope, left))
+
+    def select(self, tree, name):
+        # translates a SELECT into operators ending in a view named name; returns
+        # the view holding the result and the column a subquery selects
+        self.depth += 1
+        try:
+            return self.select_scoped(tree, name)
+        finally:
+            self.depth -= 1
+
+    def select_scoped(self, tree, name):
+        for unsupported in ('union', 'union_all', 'having'):
+            if unsupported in tree:
+                raise ValueError("%s is not supported" % unsupported.upper())
+        items = tree.get('select') if isinstance(tree.get('select'), list) else [tree.get('select')]
+        for item in items:
+            if isinstance(item, dict) and 'name' in item:
+                # the view has the columns of its rows, not the names a projection gives them
+                raise ValueError("aliased projections are not supported (%s)" % item['name'])
+        scope = Scope()
+        sources = tree['from'] if isinstance(tree['from'], list) else [tree['from']]
+        start = len(self.chain)
+        self.source(scope, sources[0])
+        for item in sources[1:]:
+            join = [key for key in item if isinstance(key, str) and key.endswith('join')] if isinstance(item, dict) else []
+            if len(join) == 0:
+                raise ValueError("comma joins are not supported")
+            if join[0].lower() not in INNER_JOINS:
+                raise ValueError("%s is not supported" % join[0].upper())
+            self.join(scope, item[join[0]], item.get('on'))
+
+        if 'where' in tree:
+            tables = [scope.current()]
+            predicates = [self.condition(scope, condition, tables) for condition in conjuncts(tree['where'])]
+            predicates = [predicate for predicate in predicates if predicate is not None]
+            if len(predicates) > 0:
+                view = self.view_name('where')
+                self.chain.append(Filter(view, tables, predicates, policy=False))
+                for alias in scope.location:
+                    scope.location[alias] = view
+
+        selected = selected_column(tree.get('select'))
+        if 'groupby' in tree:
+            groupby = tree['groupby'] if isinstance(tree['groupby'], list) else [tree['groupby']]
+            if len(groupby) != 1:
+                raise ValueError("GROUP BY on more than one column is not supported")
+            column = self.column(scope, value_of(groupby[0]))
+            current = scope.current()
+            view = self.view_name('agg')
+            self.chain.append(Aggregate(view, aggregate_of(tree.get('select')), [current], column, None,
+                                        groupby=column, policy=False))
+            for alias in scope.location:
+                scope.location[alias] = view
+
+        if len(self.chain) > start:
+            # nothing reads the last operator yet, so it can take the final name
+            self.chain[-1].new_view_name = name
+            for alias in scope.location:
+                scope.location[alias] = name
+        if selected is not None:
+            _, selected = self.resolve(scope, selected)
+        return scope.current(), selected
+
+
+def conjuncts(expression):
+    if expression is None:
+        return []
+    if isinstance(expression, dict) and 'and' in expression:
+        return [leaf for part in expression['and'] for leaf in conjuncts(part)]
+    if isinstance(expression, dict) and 'or' in expression:
+        raise ValueError("OR is not supported")
+    return [expression]
+
+
+def operation(condition):
+    if not isinstance(condition, dict) or len(condition) != 1:
+        raise ValueError("unsupported condition %s" % condition)
+    op, operands = next(iter(condition.items()))
+    if not isinstance(operands, list) or len(operands) != 2:
+        raise ValueError("unsupported condition %s" % condition)
+    return op, operands
+
+
+def is_parameter(value):
+    return isinstance(value, str) and value == PARAMETER
+
+
+def is_literal(value):
+    if isinstance(value, bool) or isinstance(value, (int, float)):
+        return True
+    if isinstance(value, dict) and 'literal' in value:
+        if isinstance(value['literal'], list):
+            raise ValueError("IN lists are not supported")
+        return True
+    return isinstance(value, str) and value.lower() in ('true', 'false', 'null')
+
+
+def literal_text(value):
+    if isinstance(value, dict):
+        return "'%s'" % value['literal']
+    if isinstance(value, str):
+        return value.capitalize() if value.lower() in ('true', 'false') else 'NULL'
+    return str(value)
+
+
+def value_of(item):
+    return item['value'] if isinstance(item, dict) and 'value' in item else item
+
+
+def selected_column(select):
+    # the single column a subquery selects, if it selects one
+    if isinstance(select, list) or select is None or select == '*':
+        return None
+    value = value_of(select)
+    return value if isinstance(value, str) and value != '*' else None
+
+
+def aggregate_of(select):
+    items = select if isinstance(select, list) else [select]
+    for item in items:
+        value = value_of(item)
+        if isinstance(value, dict):
+            for function in AGGREGATES:
+                if function in value:
+                    argument = value[function]
+                    argument = '*' if argument == '*' or isinstance(argument, dict) else argument
+                    return '%s(%s)' % (function, argument)
+    return 'count(*)'
+
+
+def normalize_sql(sql):
+    # the text a statement is cached under, rebuilt from its tokens: comments and the
+    # trailing semicolon removed, keywords upper case, placeholders replaced by
+    # PARAMETER and one space between tokens except around dots, inside brackets,
+    # before commas and after aggregate names, so "p_cid=?" and "p_cid = ?" agree
+    out = []
+    for token in TOKEN_PATTERN.findall(COMMENT_PATTERN.sub('', sql)):
+        if token.startswith('?'):
+            token = PARAMETER
+        elif token.lower() in KEYWORDS:
+            token = token.upper()
+        if len(out) > 0 and not (token in ('.', ',', ')') or out[-1] in ('.', '(')
+                                 or (token == '(' and out[-1].lower() in AGGREGATES)):
+            out.append(' ')
+        out.append(token)
+    text = ''.join(out)
+    return text[:-1].rstrip() if text.endswith(';') else text
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_normalized(text):
+    from moz_sql_parser import parse
+    return parse(text)
+
+
+def parse_sql(sql):
+    # parse trees are cached by normalized text, least recently used dropped first
+    return parse_normalized(normalize_sql(sql))
+
+
+def translate(sql, name, schema):
+    tree = parse_sql(sql)
+    if 'select' not in tree:
+        raise ValueError("not a SELECT")
+    translation = Translation(name, schema)
+    translation.select(tree, name)
+    return TranslatedQuery(name, sql, translation.chain, translation.keys, translation.tables)
+
+
+def split_statements(text):
+    # (name, sql) for every statement; "name: SELECT ..." names a statement, the
+    # others are numbered
+    text = COMMENT_PATTERN.sub('', text)
+    statements = []
+    for i, statement in enumerate(part for part in text.split(';') if len(part.strip()) > 0):
+        named = NAMED_PATTERN.match(statement)
+        if named is not None:
+            statements.append((named.group(1), statement[named.end():].strip()))
+        else:
+            statements.append(('query%d' % i, statement.strip()))
+    return statements
+
+
+def compile_queries(text, schema):
+    queries = []
+    keys = {}
+    skipped = []
+    for name, sql in split_statements(text):
+        try:
+            query = translate(sql, name, schema)
+            queries.append((name, query.to_dataflow(schema)))
+            keys[name] = query.keys
+        except ImportError:
+            raise
+        except Exception as e:
+            # parse errors included: one statement the parser rejects does not
+            # stop the rest of the log
+            skipped.append((name, str(e) or type(e).__name__))
+    return queries, keys, skipped
+
+
+def load_query_file(path, schema, cache_dir=None, use_cache=True):
+    with open(path, 'rb') as f:
+        source = f.read()
+    key = artifacts.content_hash(source, schema_key(schema), str(TRANSLATOR_VERSION))
+
+    def build():
+        queries, keys, skipped = compile_queries(source.decode('utf-8'), schema)
+        return CompiledQueries(queries, keys, skipped, key)
+
+    if not use_cache:
+        return build()
+    return artifacts.cached(path, 'queries', key, build, cache_dir)
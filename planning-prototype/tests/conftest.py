@@ -0,0 +1,5 @@
+# the prototype's modules import each other by name, as when run from its directory
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,92 @@
+import io
+import contextlib
+import pytest
+import backfill
+import datagen
+import planning
+import prototype
+from collections import Counter
+from executor import Executor
+
+BENCHMARKS = ['hotcrp', 'twitter']
+SCALE = 200
+UIDS = [0, 2, 5]
+
+
+def rows(table_rows):
+    # a column an input of a union lacks is missing from the executor's rows and
+    # None in the backfilled ones
+    return Counter(tuple(sorted((name, value) for name, value in row.items() if value is not None))
+                   for row in table_rows)
+
+
+@pytest.fixture(scope='module')
+def data_root(tmp_path_factory):
+    return str(tmp_path_factory.mktemp('data'))
+
+
+@pytest.fixture(scope='module', params=BENCHMARKS)
+def benchmark(request, data_root):
+    name = request.param
+    with contextlib.redirect_stdout(io.StringIO()):
+        schema = prototype.load_schema(prototype.SCHEMAS[name])
+        queries, policies = prototype.load_queries(schema, name), prototype.load_policies(schema, name)
+        plans = planning.planning(queries, policies)
+    unoptimized, _ = planning.merge_inputs(queries, policies)
+    return schema, plans, datagen.ensure_dataset(data_root, name, SCALE), unoptimized
+
+
+def test_backfill_matches_executor(benchmark):
+    schema, plans, tables, _ = benchmark
+    for graph in plans:
+        for uid in UIDS:
+            views = backfill.backfill(graph, tables, uid=uid, catalog=schema)
+            executor = Executor(graph, uid=uid, catalog=schema)
+            for node in graph.keys():
+                if node.operation_type is None:
+                    executor.load(node.name, backfill.to_rows(tables[node.name]))
+            for node in graph.keys():
+                assert rows(backfill.to_rows(views[node.name])) == rows(executor.read(node.name)), (uid, node.name)
+
+
+def test_backfill_universes_matches_backfill(benchmark):
+    schema, plans, tables, _ = benchmark
+    for graph in plans:
+        batched = backfill.backfill_universes(graph, tables, UIDS, catalog=schema)
+        for uid in UIDS:
+            views = backfill.backfill(graph, tables, uid=uid, catalog=schema)
+            for node in graph.keys():
+                expected = rows(backfill.to_rows(views[node.name]))
+                assert rows(backfill.to_rows(backfill.universe_view(batched[node.name], uid))) == expected, \
+                    (uid, node.name)
+
+
+def test_plans_answer_as_written(benchmark):
+    # every plan the search reaches reads the same rows as the policies and queries
+    # merged as written
+    schema, plans, tables, unoptimized = benchmark
+
+    def answers(graph, uid):
+        views = backfill.backfill(graph, tables, uid=uid, catalog=schema)
+        return sum((rows(backfill.to_rows(views[node.name])) for node in graph.keys()
+                    if node.operation_type is not None and len(graph.successors(node)) == 0), Counter())
+
+    for uid in UIDS:
+        expected = answers(unoptimized, uid)
+        for graph in plans:
+            assert answers(graph, uid) == expected, uid
+
+
+def test_union_keeps_every_column(data_root):
+    # the rows of both inputs pass through whole, as in the executor
+    schema = prototype.load_schema(prototype.SCHEMAS['hotcrp'])
+    tables = datagen.ensure_dataset(data_root, 'hotcrp', SCALE)
+    graph = prototype.Function([prototype.Filter('PapersAndReviews', ['Paper', 'PaperReview'], [])],
+                               schema).to_dataflow(schema)
+    views = backfill.backfill(graph, tables, catalog=schema)
+    executor = Executor(graph, catalog=schema)
+    for name in ('Paper', 'PaperReview'):
+        executor.load(name, backfill.to_rows(tables[name]))
+    union = backfill.to_rows(views['PapersAndReviews'])
+    assert len(union) == len(tables['Paper']['paperId']) + len(tables['PaperReview']['reviewId'])
+    assert rows(union) == rows(executor.read('PapersAndReviews'))
@@ -0,0 +1,52 @@
+import re
+import pytest
+import catalog
+import prototype
+
+# a column definition of the DDL: a backquoted or bare name at the start of a line
+# inside CREATE TABLE, followed by a type
+DEFINITION_PATTERN = re.compile(r'^\s*[`"]?(\w+)[`"]?\s+\w+', re.MULTILINE)
+NOT_COLUMNS = {'PRIMARY', 'PRIMARY_KEY', 'UNIQUE', 'KEY', 'INDEX', 'FULLTEXT', 'FOREIGN', 'CONSTRAINT', 'CHECK'}
+
+
+def ddl_columns(path):
+    # table -> column names, read from the DDL line by line
+    with open(path) as f:
+        text = f.read()
+    tables = {}
+    for block in re.split(r'CREATE\s+TABLE\s+', text, flags=re.IGNORECASE)[1:]:
+        name = re.match(r'[`"]?(\w+)', block).group(1)
+        body = block[block.index('(') + 1:re.search(r'^\)', block, re.MULTILINE).start()]
+        tables[name] = [column for column in DEFINITION_PATTERN.findall(body) if column.upper() not in NOT_COLUMNS]
+    return tables
+
+
+@pytest.mark.parametrize('benchmark', sorted(prototype.SCHEMAS))
+def test_catalog_has_every_column_of_the_ddl(benchmark):
+    path = prototype.SCHEMAS[benchmark]
+    schema = catalog.load_catalog(path, use_cache=False)
+    for name, columns in ddl_columns(path).items():
+        table = schema.table(name)
+        assert [column.name for column in table.columns] == columns, name
+
+
+def test_hotcrp_keys_name_catalog_columns():
+    # columns defined after a # comment used to be dropped with it
+    schema = catalog.load_catalog(prototype.SCHEMAS['hotcrp'], use_cache=False)
+    for name, column in [('Paper', 'sha1'), ('Paper', 'size'), ('PaperTag', 'tagIndex'), ('PaperTagAnno', 'annoId')]:
+        assert schema.column(name, column) is not None, (name, column)
+    for name, table in schema.tables.items():
+        for key in table.unique_keys + table.indexes:
+            assert all(table.column(column) is not None for column in key), (name, key)
+
+
+def test_comments_are_stripped_outside_strings():
+    ddl = ("CREATE TABLE t (\n"
+           "  `a` varchar(8) NOT NULL DEFAULT '# -- /*',  # a note\n"
+           "  `b` int(11) NOT NULL,  -- another\n"
+           "  /* and a block */ `c` int(11),\n"
+           "  PRIMARY KEY (`a`, `b`)\n"
+           ");")
+    table = catalog.parse_ddl(ddl).table('t')
+    assert [column.name for column in table.columns] == ['a', 'b', 'c']
+    assert table.primary_key == ('a', 'b')
@@ -0,0 +1,19 @@
+import os
+import datagen
+
+
+def test_manifest_counts_the_rows_written(tmp_path):
+    directory = str(tmp_path / 'hotcrp')
+    manifest = datagen.write_dataset(directory, 'hotcrp', 200)
+    for table, columns in datagen.load_dataset(directory).items():
+        assert {len(values) for values in columns.values()} == {manifest['tables'][table]['rows']}, table
+
+
+def test_force_replaces_the_whole_dataset(tmp_path):
+    directory = str(tmp_path / 'twitter')
+    datagen.write_dataset(directory, 'twitter', 100, seed=0)
+    manifest = datagen.write_dataset(directory, 'twitter', 100, seed=1)
+    assert datagen.read_manifest(directory) == manifest
+    assert manifest['seed'] == 1
+    # nothing is left of the staging or the replaced directory
+    assert os.listdir(str(tmp_path)) == ['twitter']
@@ -0,0 +1,118 @@
+import io
+import contextlib
+import pytest
+import backfill
+import datagen
+import planning
+import prototype
+from collections import Counter
+from dataflow import Aggregate, Filter, Function, Transform
+from executor import Executor, row_key
+
+SCHEMA = {'Paper': ['paperId', 'title'], 'Conflict': ['paperId', 'contactId'],
+          'Review': ['reviewId', 'paperId', 'contactId']}
+UID = 1
+
+
+def view(executor, name):
+    return Counter(row_key(row) for row in executor.read(name))
+
+
+def rows(*dicts):
+    return Counter(row_key(row) for row in dicts)
+
+
+def graph(*chain):
+    return Function(list(chain), SCHEMA).to_dataflow(SCHEMA)
+
+
+def my_conflicts():
+    return Filter('MyConflicts', ['Conflict'], ['Conflict.contactId IN $UID'])
+
+
+def test_membership_compares_within_a_row():
+    executor = Executor(graph(Filter('Mine', ['Review'], ['Review.contactId IN $UID'])), uid=UID)
+    mine, theirs = {'reviewId': 1, 'paperId': 1, 'contactId': UID}, {'reviewId': 2, 'paperId': 1, 'contactId': 2}
+    executor.insert('Review', [mine, theirs])
+    assert view(executor, 'Mine') == rows(mine)
+    executor.delete('Review', [mine])
+    assert view(executor, 'Mine') == Counter()
+
+
+def test_membership_follows_the_probed_view():
+    # a conflict added or removed later hides or shows the paper again, and only
+    # the matching paper changes
+    executor = Executor(graph(my_conflicts(), Filter('Unconflicted', ['Paper', 'MyConflicts'],
+                                                     ['Paper.paperId NOT IN MyConflicts.paperId'])), uid=UID)
+    papers = [{'paperId': i, 'title': 't%d' % i} for i in range(3)]
+    executor.insert('Paper', papers)
+    conflict = {'paperId': 1, 'contactId': UID}
+    executor.insert('Conflict', [conflict, {'paperId': 2, 'contactId': 2}])
+    assert view(executor, 'Unconflicted') == rows(papers[0], papers[2])
+    # a second conflict on the same paper only changes the probed counts
+    executor.insert('Conflict', [conflict])
+    executor.delete('Conflict', [conflict])
+    assert view(executor, 'Unconflicted') == rows(papers[0], papers[2])
+    executor.delete('Conflict', [conflict])
+    assert view(executor, 'Unconflicted') == rows(*papers)
+    executor.delete('Paper', [papers[0]])
+    assert view(executor, 'Unconflicted') == rows(papers[1], papers[2])
+
+
+def test_rewrite_applies_where_its_condition_holds():
+    executor = Executor(graph(my_conflicts(), Transform('Anonymized', ['Review', 'MyConflicts'],
+                                                        ['Review.paperId IN MyConflicts.paperId',
+                                                         'Review.contactId => `anonymous`'])), uid=UID)
+    reviews = [{'reviewId': i, 'paperId': i, 'contactId': 5} for i in range(2)]
+    executor.insert('Review', reviews)
+    assert view(executor, 'Anonymized') == rows(*reviews)
+    executor.insert('Conflict', [{'paperId': 1, 'contactId': UID}])
+    assert view(executor, 'Anonymized') == rows(reviews[0], dict(reviews[1], contactId='anonymous'))
+    executor.delete('Conflict', [{'paperId': 1, 'contactId': UID}])
+    assert view(executor, 'Anonymized') == rows(*reviews)
+
+
+def test_count_retracts_the_old_count():
+    executor = Executor(graph(Aggregate('Reviews', 'count(*)', ['Review'], 'Review.paperId', None,
+                                        groupby='Review.paperId')), uid=UID)
+    reviews = [{'reviewId': i, 'paperId': i % 2, 'contactId': 5} for i in range(5)]
+    executor.insert('Review', reviews)
+    assert view(executor, 'Reviews') == rows({'paperId': 0, 'count': 3}, {'paperId': 1, 'count': 2})
+    executor.delete('Review', reviews[1::2])
+    assert view(executor, 'Reviews') == rows({'paperId': 0, 'count': 3})
+    executor.insert('Review', reviews[1:2])
+    assert view(executor, 'Reviews') == rows({'paperId': 0, 'count': 3}, {'paperId': 1, 'count': 1})
+
+
+def test_count_of_a_batch_that_cancels_out_changes_nothing():
+    executor = Executor(graph(Aggregate('Reviews', 'count(*)', ['Review'], 'Review.paperId', None,
+                                        groupby='Review.paperId')), uid=UID)
+    review = {'reviewId': 1, 'paperId': 1, 'contactId': 5}
+    executor.insert('Review', [review])
+    executor.write('Review', [(review, -1), (review, 1)])
+    assert view(executor, 'Reviews') == rows({'paperId': 1, 'count': 1})
+    assert executor.stats()['Reviews']['rows_out'] == 1
+
+
+@pytest.fixture(scope='module')
+def hotcrp(tmp_path_factory):
+    with contextlib.redirect_stdout(io.StringIO()):
+        schema = prototype.load_schema(prototype.SCHEMAS['hotcrp'])
+        plans = planning.planning(prototype.load_queries(schema, 'hotcrp'), prototype.load_policies(schema, 'hotcrp'))
+    tables = datagen.ensure_dataset(str(tmp_path_factory.mktemp('data')), 'hotcrp', 200)
+    return schema, plans[0], {name: backfill.to_rows(table) for name, table in tables.items()}
+
+
+def test_deletes_leave_the_views_of_the_rows_kept(hotcrp):
+    # inserting every row and deleting some gives the views of inserting the rest
+    schema, plan, tables = hotcrp
+    bases = [node.name for node in plan.keys() if node.operation_type is None]
+    incremental = Executor(plan, uid=2, catalog=schema)
+    fresh = Executor(plan, uid=2, catalog=schema)
+    for name in bases:
+        incremental.insert(name, tables[name])
+        incremental.delete(name, tables[name][::3])
+        fresh.insert(name, [row for i, row in enumerate(tables[name]) if i % 3 != 0])
+    for node in plan.keys():
+        assert view(incremental, node.name) == view(fresh, node.name), node.name
+    assert any(len(incremental.read(node.name)) > 0 for node in plan.keys() if node.operation_type is not None)
@@ -0,0 +1,91 @@
+import io
+import contextlib
+import pytest
+import backfill
+import datagen
+import indexing
+import planning
+import prototype
+from collections import Counter
+from dataflow import Aggregate, Filter, Function
+from executor import Executor, get_column, probe_column, probed_view, row_key
+
+SCHEMA = {'Post': ['p_id', 'p_cid', 'p_author', 'p_private'], 'Review': ['reviewId', 'paperId', 'contactId']}
+
+
+def kinds(specs, view):
+    return {spec.columns: spec.kind for spec in specs.get(view, [])}
+
+
+def test_read_index_comes_from_the_query_template():
+    graph = Function([Filter('public_posts', ['Post'], ['0 IN Post.p_private'])], SCHEMA).to_dataflow(SCHEMA)
+    assert kinds(indexing.lookup_indexes(graph, keys={'public_posts': ['Post.p_cid']}), 'public_posts') == \
+        {('p_cid',): indexing.READ}
+
+
+def test_read_index_falls_back_to_uid_and_group_by_columns():
+    graph = Function([Filter('Mine', ['Review'], ['$UID IN Review.contactId']),
+                      Aggregate('Reviews', 'count(*)', ['Review'], 'Review.paperId', None, groupby='Review.paperId')],
+                     SCHEMA).to_dataflow(SCHEMA)
+    specs = indexing.lookup_indexes(graph)
+    assert kinds(specs, 'Mine') == {('contactId',): indexing.READ}
+    assert kinds(specs, 'Reviews') == {('paperId',): indexing.READ}
+
+
+@pytest.fixture(scope='module')
+def hotcrp(tmp_path_factory):
+    with contextlib.redirect_stdout(io.StringIO()):
+        schema = prototype.load_schema(prototype.SCHEMAS['hotcrp'])
+        plans = planning.planning(prototype.load_queries(schema, 'hotcrp'), prototype.load_policies(schema, 'hotcrp'))
+    tables = datagen.ensure_dataset(str(tmp_path_factory.mktemp('data')), 'hotcrp', 200)
+    return schema, plans[0], {name: backfill.to_rows(table) for name, table in tables.items()}
+
+
+def test_every_read_and_probed_view_is_indexed(hotcrp):
+    schema, plan, _ = hotcrp
+    specs = indexing.lookup_indexes(plan, catalog=schema)
+    for name in indexing.read_views(plan):
+        assert indexing.READ in kinds(specs, name).values(), name
+    for node in plan.keys():
+        probe = probed_view(plan, node)
+        if probe is not None:
+            assert (probe_column(node, plan, schema),) in kinds(specs, probe), node.name
+
+
+def test_indexed_lookups_match_a_scan(hotcrp):
+    # every row of a read view is found by its index, before and after deletes
+    schema, plan, tables = hotcrp
+    specs = indexing.lookup_indexes(plan, catalog=schema)
+    executor = Executor(plan, uid=2, catalog=schema, indexes=specs)
+    bases = [node.name for node in plan.keys() if node.operation_type is None]
+    for name in bases:
+        executor.insert(name, tables[name])
+
+    def check():
+        found = 0
+        for name in indexing.read_views(plan):
+            columns = next(iter(executor.indexes[name]))
+            rows = executor.read(name)
+            for row in rows:
+                values = tuple(get_column(row, column) for column in columns)
+                expected = Counter(row_key(other) for other in rows
+                                   if tuple(get_column(other, column) for column in columns) == values)
+                assert Counter(row_key(match) for match in executor.lookup(name, values)) == expected, name
+                found += 1
+        return found
+
+    assert check() > 0
+    for name in bases:
+        executor.delete(name, tables[name][::2])
+    check()
+
+
+def test_lookup_needs_an_index_or_columns(hotcrp):
+    schema, plan, _ = hotcrp
+    executor = Executor(plan, uid=2, catalog=schema)
+    name = indexing.read_views(plan)[0]
+    with pytest.raises(ValueError):
+        executor.lookup(name, (1,))
+    with pytest.raises(ValueError):
+        executor.lookup(name, (1, 2), ('paperId',))
+    assert executor.lookup(name, (1,), ('paperId',)) == []
@@ -0,0 +1,46 @@
+import random
+import pytest
+import materialization
+import planning
+import plan_export
+import workload
+
+
+def merged(seed):
+    w = workload.generate_workload(12, 6, 3, seed=seed)
+    graph, _ = planning.merge_inputs(w.queries, w.policies)
+    return graph
+
+
+@pytest.mark.parametrize('seed', [0, 3])
+def test_change_matches_full_costs(seed):
+    # the costs of an upgrade found from the node alone are those of the whole graph
+    graph = merged(seed)
+    model = materialization.GraphModel(graph, materialization.MaterializationPlanner())
+    rng = random.Random(seed)
+    modes = {name: (materialization.FULL if name not in model.operators else
+                    rng.choice([materialization.FULL, materialization.PARTIAL, materialization.NONE]))
+             for name in model.parents}
+    model.reset(modes)
+    for name in model.operators:
+        for mode in (materialization.FULL, materialization.PARTIAL, materialization.NONE):
+            candidate = dict(model.modes)
+            candidate[name] = mode
+            delta, _, _ = model.change(name, mode)
+            assert delta == pytest.approx(model.latency(candidate) - model.latency(model.modes)), (name, mode)
+            if rng.random() < 0.2:
+                model.apply(name, mode, model.change(name, mode))
+                assert (model.fetches, model.keeps) == model.values(model.modes)
+
+
+def test_dot_combines_styles():
+    graph = merged(0)
+    modes = {node.name: (materialization.NONE if node.operation_type is not None else materialization.FULL)
+             for node in graph.keys()}
+    zero = dict.fromkeys(modes, 0.0)
+    views = materialization.Materialization(modes, zero, zero, 0.0, 0.0, None)
+    dot = plan_export.plan_to_dot(graph, materialization=views)
+    policy = next(node for node in graph.keys() if node.policy)
+    line = next(line for line in dot.splitlines() if line.startswith('  "%s" [' % policy.name))
+    assert line.count('style=') == 1
+    assert 'style="filled,dashed"' in line
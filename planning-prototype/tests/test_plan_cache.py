@@ -0,0 +1,14 @@
+import plan_cache
+import workload
+
+
+def test_policy_version_is_computed_when_policies_change(monkeypatch):
+    w = workload.generate_workload(4, 1, 2, seed=0)
+    versions = []
+    version = plan_cache.policy_version
+    monkeypatch.setattr(plan_cache, 'policy_version', lambda policies: versions.append(1) or version(policies))
+    cache = plan_cache.PlanCache(w.policies)
+    keys = {cache.key('select * from T0 where group_id=?'), cache.key('SELECT * FROM T0 WHERE group_id = ?')}
+    assert len(keys) == 1 and len(versions) == 1
+    cache.set_policies(w.policies[1:])
+    assert cache.key('select * from T0 where group_id=?') not in keys and len(versions) == 2
@@ -0,0 +1,91 @@
+import os
+import random
+import pytest
+import catalog
+import planning
+import policy_compiler
+import tracing
+import workload
+from collections import Counter
+from dataflow import Filter, Function
+from executor import Executor, row_key
+from scheduler import generate_batches
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'benchmarks')
+
+
+def view(executor, name):
+    return Counter(row_key(row) for row in executor.read(name))
+
+
+def run(graph, schema, batches, uid=0):
+    executor = Executor(graph, uid=uid, catalog=schema)
+    for writes in batches:
+        for table, delta in writes:
+            executor.write(table, delta)
+    return executor
+
+
+def assert_sharing_keeps_views(queries, policies, schema, batches):
+    # every view of the merged graph holds the same rows once shared with others
+    unshared, _ = planning.merge_inputs(queries, policies)
+    shared = unshared.copy()
+    canonical = {}
+    removed = planning.eliminate_common_subexpressions(shared, canonical)
+    expected = run(unshared, schema, batches)
+    actual = run(shared, schema, batches)
+    for node in unshared.keys():
+        assert view(actual, canonical[node.name]) == view(expected, node.name), node.name
+    return removed
+
+
+@pytest.mark.parametrize('seed', [1, 2, 5])
+def test_shared_workload_executes(seed):
+    w = workload.generate_workload(12, 6, 3, seed=seed)
+    batches = generate_batches(w.schema, 2, 50, users=10, groups=20, seed=seed)
+    assert assert_sharing_keeps_views(w.queries, w.policies, w.schema, batches) > 0
+
+    plan = planning.planning(w.queries, w.policies, search='best-first', max_expansions=100)[0]
+    executor = run(plan, w.schema, batches)
+    for table in w.schema:
+        assert len(executor.read(table)) == 100
+
+
+@pytest.mark.parametrize('seed', [4, 13, 24])
+def test_planned_workload_resolves_probes(seed):
+    # hoisting and the search reorder policy chains under queries that probe a view of
+    # the table they read, or a table a policy helper also reads
+    w = workload.generate_workload(12, 6, 3, seed=seed)
+    plan = planning.planning(w.queries, w.policies, search='best-first', max_expansions=100)[0]
+    run(plan, w.schema, generate_batches(w.schema, 1, 30, users=10, groups=20, seed=seed))
+
+
+def test_planning_keeps_construction_counters():
+    tracing.reset()
+    w = workload.generate_workload(4, 2, 2, seed=0)
+    built = tracing.stats()['counters']['nodes_created']
+    planning.planning(w.queries, w.policies, search='best-first', max_expansions=10)
+    assert tracing.stats()['counters']['nodes_created'] > built > 0
+
+
+def test_shared_subquery_keeps_its_readers():
+    # tas and the subquery of ta_posts are the same view; ta_posts has to probe
+    # whichever of them is kept
+    schema = catalog.load_catalog(os.path.join(BENCHMARKS_DIR, 'piazza', 'schema.sql'), use_cache=False)
+    policies = policy_compiler.load_policy_file(os.path.join(BENCHMARKS_DIR, 'piazza', 'policies.txt '), schema,
+                                                use_cache=False).graphs()
+    tas = [Filter('tas', ['Role'], ['1 IN Role.r_role'])]
+    ta_posts = [Filter('ta_posts_sq1', ['Role'], ['1 IN Role.r_role']),
+                Filter('ta_posts', ['Post', 'ta_posts_sq1'], ['Post.p_author IN ta_posts_sq1.r_uid'])]
+    queries = [Function(chain, schema).to_dataflow(schema) for chain in (tas, ta_posts)]
+
+    rng = random.Random(0)
+    roles = [{'r_uid': uid, 'r_cid': cid, 'r_role': int(rng.random() < 0.2)} for uid in range(20) for cid in range(3)]
+    posts = [{'p_id': i, 'p_cid': rng.randrange(3), 'p_author': rng.randrange(20), 'p_content': 'post %d' % i,
+              'p_private': int(rng.random() < 0.3), 'p_anonymous': int(rng.random() < 0.2)} for i in range(100)]
+    batches = [[('Role', [(row, 1) for row in roles]), ('Post', [(row, 1) for row in posts])],
+               [('Role', [(row, -1) for row in roles[::7]])]]
+    assert assert_sharing_keeps_views(queries, policies, schema, batches) > 0
+
+    plan = planning.planning(queries, policies, search='best-first', max_expansions=100)[0]
+    run(plan, schema, batches, uid=1)
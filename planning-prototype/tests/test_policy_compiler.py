@@ -0,0 +1,45 @@
+import os
+import pytest
+import catalog
+import planning
+import policy_compiler
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'benchmarks')
+
+
+@pytest.fixture(scope='module')
+def piazza():
+    schema = catalog.load_catalog(os.path.join(BENCHMARKS_DIR, 'piazza', 'schema.sql'), use_cache=False)
+    policies = policy_compiler.load_policy_file(os.path.join(BENCHMARKS_DIR, 'piazza', 'policies.txt '), schema,
+                                                use_cache=False)
+    return schema, policies
+
+
+def test_exports_of_a_table_are_combined(piazza):
+    _, compiled = piazza
+    assert [name for name, _ in compiled.policies] == ['ExportedPost', 'ExportedRole']
+    exports = {}
+    for graph in compiled.graphs():
+        exports.update(planning.add_exports(exports, graph))
+    assert {table: view.name for table, view in exports.items()} == {'Post': 'ExportedPost', 'Role': 'ExportedRole'}
+    posts = compiled.graphs()[0]
+    assert sorted(parent.name for parent in posts.predecessors('ExportedPost')) == \
+        ['AnonymizedPosts', 'OwnPrivatePosts', 'PublicPosts', 'TAVisiblePrivatePosts']
+
+
+def test_views_are_exported_alike_in_every_policy(piazza):
+    # TAClasses and MyClasses are exported and read by other exports
+    _, compiled = piazza
+    exported_as = {}
+    for graph in compiled.graphs():
+        for node in graph.keys():
+            assert exported_as.setdefault(node.name, node.exported_as) == node.exported_as, node.name
+
+
+def test_planning_rejects_a_table_exported_twice(piazza):
+    schema, _ = piazza
+    text = "EXPORT $PublicPosts = filter($Post, [($Post.p_private IN 0)])\n"
+    first, _ = policy_compiler.compile_policies(text, schema)
+    second, _ = policy_compiler.compile_policies(text.replace('PublicPosts', 'OtherPosts'), schema)
+    with pytest.raises(ValueError):
+        planning.merge_inputs([], [first[0][1], second[0][1]])
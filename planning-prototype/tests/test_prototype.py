@@ -0,0 +1,10 @@
+import policy_compiler
+import prototype
+
+
+def test_piazza_translates_against_its_schema():
+    schema = prototype.load_schema(prototype.SCHEMAS['piazza'])
+    assert 'p_cid' in schema['Post']
+    compiled = policy_compiler.load_policy_file(prototype.POLICY_FILES['piazza'], schema, use_cache=False)
+    assert len(compiled.skipped) == 0
+    assert len(compiled.graphs()) > 0
@@ -0,0 +1,75 @@
+import io
+import contextlib
+import pytest
+import backfill
+import datagen
+import planning
+import prototype
+import workload
+from collections import Counter
+from executor import Executor, row_key
+from scheduler import DomainScheduler, generate_batches, partition
+
+UIDS = [0, 2]
+
+
+def with_deletes(batches):
+    # the batches, then one retracting every other row the first batch wrote
+    retract = [(table, [(row, -diff) for row, diff in delta[::2]]) for table, delta in batches[0]]
+    return batches + [retract]
+
+
+def views(executor, graph):
+    # an Executor, a DomainScheduler or a ShardedExecutor
+    return {node.name: Counter(row_key(row) for row in executor.read(node.name)) for node in graph.keys()}
+
+
+def sequential(graph, schema, batches, uid):
+    executor = Executor(graph, uid=uid, catalog=schema)
+    for writes in batches:
+        for table, delta in writes:
+            executor.write(table, delta)
+    return views(executor, graph)
+
+
+@pytest.fixture(scope='module')
+def synthetic():
+    w = workload.generate_workload(12, 6, 3, seed=1)
+    plan = planning.planning(w.queries, w.policies, search='best-first', max_expansions=100)[0]
+    return plan, w.schema, with_deletes(generate_batches(w.schema, 3, 40, users=10, groups=20, seed=1))
+
+
+@pytest.fixture(scope='module')
+def hotcrp(tmp_path_factory):
+    with contextlib.redirect_stdout(io.StringIO()):
+        schema = prototype.load_schema(prototype.SCHEMAS['hotcrp'])
+        plans = planning.planning(prototype.load_queries(schema, 'hotcrp'), prototype.load_policies(schema, 'hotcrp'))
+    tables = datagen.ensure_dataset(str(tmp_path_factory.mktemp('data')), 'hotcrp', 200)
+    rows = {name: backfill.to_rows(table) for name, table in tables.items()}
+    bases = [node.name for node in plans[0].keys() if node.operation_type is None]
+    # two batches of half of every table each
+    batches = [[(name, [(row, 1) for row in rows[name][part::2]]) for name in bases] for part in (0, 1)]
+    return plans[0], schema, with_deletes(batches)
+
+
+def test_domains_partition_the_graph_by_level(synthetic):
+    plan, _, _ = synthetic
+    domains, owner = partition(plan)
+    assert sorted(name for domain in domains for name in domain.nodes) == sorted(node.name for node in plan.keys())
+    for node in plan.keys():
+        for child in plan.successors(node):
+            a, b = domains[owner[node.name]], domains[owner[child.name]]
+            assert a is b or a.level < b.level, (node.name, child.name)
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+@pytest.mark.parametrize('data', ['synthetic', 'hotcrp'])
+def test_scheduler_matches_sequential_executor(request, data, workers):
+    plan, schema, batches = request.getfixturevalue(data)
+    for uid in UIDS:
+        expected = sequential(plan, schema, batches, uid)
+        assert any(len(rows) > 0 for name, rows in expected.items() if plan.node(name).operation_type is not None)
+        with DomainScheduler(plan, uid=uid, catalog=schema, workers=workers) as scheduler:
+            for writes in batches:
+                scheduler.write_batch(writes)
+            assert views(scheduler, plan) == expected, uid
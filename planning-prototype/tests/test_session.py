@@ -0,0 +1,37 @@
+import contextlib
+import io
+import pytest
+import planning
+import prototype
+import workload
+from session import PlannerSession
+
+
+def session_plan(queries, policies):
+    session = PlannerSession()
+    for i, policy in enumerate(policies):
+        session.add_policy('p%d' % i, policy)
+    for i, query in enumerate(queries):
+        session.add_query('q%d' % i, query)
+    return session.plan
+
+
+def benchmark_inputs(name):
+    with contextlib.redirect_stdout(io.StringIO()):
+        schema = prototype.load_schema(prototype.SCHEMAS[name])
+        return prototype.load_queries(schema, name), prototype.load_policies(schema, name)
+
+
+@pytest.mark.parametrize('name', ['hotcrp', 'twitter'])
+def test_session_plans_benchmark_as_planning(name):
+    expected = planning.planning(*benchmark_inputs(name), search='best-first')[0]
+    assert session_plan(*benchmark_inputs(name)).fingerprint() == expected.fingerprint()
+
+
+@pytest.mark.parametrize('seed', [0, 3, 7])
+def test_session_plans_workload_as_planning(seed):
+    # sharing across policies rewrites the views they export before queries read them
+    w = workload.generate_workload(6, 4, 3, seed=seed)
+    expected = planning.planning(w.queries, w.policies, search='best-first')[0]
+    w = workload.generate_workload(6, 4, 3, seed=seed)
+    assert session_plan(w.queries, w.policies).fingerprint() == expected.fingerprint()
@@ -0,0 +1,87 @@
+import io
+import contextlib
+import pytest
+import backfill
+import datagen
+import planning
+import prototype
+import workload
+from collections import Counter
+from executor import Executor, get_column, row_key
+from scheduler import generate_batches
+from sharding import ARBITRARY, SINGLE, ShardedExecutor, plan_shards, shard_of
+
+UIDS = [0, 2]
+SHARDS = 3
+
+
+def with_deletes(batches):
+    # the batches, then one retracting every other row the first batch wrote
+    retract = [(table, [(row, -diff) for row, diff in delta[::2]]) for table, delta in batches[0]]
+    return batches + [retract]
+
+
+def views(executor, graph):
+    return {node.name: Counter(row_key(row) for row in executor.read(node.name)) for node in graph.keys()}
+
+
+def sequential(graph, schema, batches, uid):
+    executor = Executor(graph, uid=uid, catalog=schema)
+    for writes in batches:
+        for table, delta in writes:
+            executor.write(table, delta)
+    return views(executor, graph)
+
+
+@pytest.fixture(scope='module')
+def synthetic():
+    w = workload.generate_workload(12, 6, 3, seed=2)
+    plan = planning.planning(w.queries, w.policies, search='best-first', max_expansions=100)[0]
+    return plan, w.schema, with_deletes(generate_batches(w.schema, 3, 40, users=10, groups=20, seed=2))
+
+
+@pytest.fixture(scope='module')
+def hotcrp(tmp_path_factory):
+    with contextlib.redirect_stdout(io.StringIO()):
+        schema = prototype.load_schema(prototype.SCHEMAS['hotcrp'])
+        plans = planning.planning(prototype.load_queries(schema, 'hotcrp'), prototype.load_policies(schema, 'hotcrp'))
+    tables = datagen.ensure_dataset(str(tmp_path_factory.mktemp('data')), 'hotcrp', 200)
+    rows = {name: backfill.to_rows(table) for name, table in tables.items()}
+    bases = [node.name for node in plans[0].keys() if node.operation_type is None]
+    batches = [[(name, [(row, 1) for row in rows[name][part::2]]) for name in bases] for part in (0, 1)]
+    return plans[0], schema, with_deletes(batches)
+
+
+@pytest.mark.parametrize('processes', [False, True])
+@pytest.mark.parametrize('data', ['synthetic', 'hotcrp'])
+def test_sharded_executor_matches_sequential_executor(request, data, processes):
+    plan, schema, batches = request.getfixturevalue(data)
+    sharded = plan_shards(plan, catalog=schema, shards=SHARDS)
+    assert len(sharded.exchanges) > 0
+    for uid in UIDS:
+        expected = sequential(plan, schema, batches, uid)
+        assert any(len(rows) > 0 for name, rows in expected.items() if plan.node(name).operation_type is not None)
+        with ShardedExecutor(sharded, uid=uid, catalog=schema, processes=processes) as executor:
+            for writes in batches:
+                executor.write_batch(writes)
+            assert views(executor, plan) == expected, uid
+
+
+def test_rows_are_on_the_shard_of_their_key(hotcrp):
+    plan, schema, batches = hotcrp
+    sharded = plan_shards(plan, catalog=schema, shards=SHARDS)
+    with ShardedExecutor(sharded, uid=2, catalog=schema, processes=False) as executor:
+        for writes in batches:
+            executor.write_batch(writes)
+        keyed = [(name, key) for name, key in sharded.keys.items() if key not in (SINGLE, ARBITRARY)]
+        assert len(keyed) > 0
+        for name, key in keyed:
+            for shard, worker in enumerate(executor.workers):
+                worker.send('read', (name,))
+                for row in worker.receive():
+                    assert shard_of(get_column(row, key), SHARDS) == shard, name
+            # a lookup on the key asks one shard and finds what a scan finds
+            rows = executor.read(name)
+            for value in {get_column(row, key) for row in rows}:
+                expected = Counter(row_key(row) for row in rows if get_column(row, key) == value)
+                assert Counter(row_key(row) for row in executor.lookup(name, (value,), (key,))) == expected, name
@@ -0,0 +1,117 @@
+import os
+import pytest
+import backfill
+import datagen
+import prototype
+import sql_translator
+from collections import Counter
+from dataflow import Filter, Function
+from executor import Executor, row_key
+
+SCALE = 200
+TWITTER_QUERIES = os.path.join(prototype.BENCHMARKS_DIR, 'twitter', 'twitter-queries.sql')
+
+
+@pytest.mark.parametrize('sql', [
+    'select * from Post where p_cid=?',
+    'SELECT *\n  FROM Post WHERE p_cid = ?;  -- by class',
+    'Select * From Post Where p_cid =?',
+])
+def test_normalize_sql_agrees_on_spacing_and_case(sql):
+    assert sql_translator.normalize_sql(sql) == 'SELECT * FROM Post WHERE p_cid = %s' % sql_translator.PARAMETER
+
+
+def test_normalize_sql_keeps_literals():
+    sql = "select count(*) from Post where p_content = 'a  =?;' group by p_cid"
+    assert sql_translator.normalize_sql(sql) == "SELECT COUNT(*) FROM Post WHERE p_content = 'a  =?;' GROUP BY p_cid"
+
+
+@pytest.fixture(scope='module')
+def parser():
+    return pytest.importorskip('moz_sql_parser')
+
+
+@pytest.fixture(scope='module')
+def data_root(tmp_path_factory):
+    return str(tmp_path_factory.mktemp('data'))
+
+
+def load(benchmark, data_root):
+    schema = prototype.load_schema(prototype.SCHEMAS[benchmark])
+    return schema, datagen.ensure_dataset(data_root, benchmark, SCALE)
+
+
+def view(graph, schema, tables):
+    # the rows of the view nothing in graph reads from
+    executor = Executor(graph, catalog=schema)
+    for node in graph.keys():
+        if node.operation_type is None:
+            executor.load(node.name, backfill.to_rows(tables[node.name]))
+    sink, = [node for node in graph.keys() if len(graph.successors(node)) == 0]
+    return Counter(row_key(row) for row in executor.read(sink.name))
+
+
+def hand_written(chain, schema):
+    return Function(chain, schema).to_dataflow(schema)
+
+
+PIAZZA = {
+    'posts': ['Post'],
+    'public_posts': [Filter('public_posts', ['Post'], ['0 IN Post.p_private'])],
+    'private_posts': [Filter('private_posts', ['Post'], ['1 IN Post.p_private'])],
+    'tas': [Filter('tas', ['Role'], ['1 IN Role.r_role'])],
+    'ta_posts': [Filter('ta_posts_sq1', ['Role'], ['1 IN Role.r_role']),
+                 Filter('ta_posts', ['Post', 'ta_posts_sq1'], ['Post.p_author IN ta_posts_sq1.r_uid'])],
+    'enrolled_in': ['Role'],
+    'enrolled_students': ['Role'],
+}
+PIAZZA_KEYS = {'posts': ['Post.p_cid'], 'public_posts': ['Post.p_cid'], 'private_posts': ['Post.p_cid'],
+               'tas': ['Role.r_cid'], 'ta_posts': ['Post.p_cid'], 'enrolled_in': ['Role.r_uid'],
+               'enrolled_students': ['Role.r_cid']}
+
+
+def test_piazza_queries_match_hand_written_graphs(parser, data_root):
+    schema, tables = load('piazza', data_root)
+    compiled = sql_translator.load_query_file(prototype.QUERY_FILES['piazza'], schema, use_cache=False)
+    assert compiled.skipped == []
+    assert compiled.keys == PIAZZA_KEYS
+    for name, graph in compiled.queries:
+        chain = PIAZZA[name]
+        if isinstance(chain[0], str):
+            assert [node.name for node in graph.keys()] == chain, name
+            continue
+        expected = view(hand_written(chain, schema), schema, tables)
+        assert sum(expected.values()) > 0, name
+        assert view(graph, schema, tables) == expected, name
+
+
+def test_twitter_queries_skip_what_cannot_be_expressed(parser):
+    schema = prototype.load_schema(prototype.SCHEMAS['twitter'])
+    compiled = sql_translator.load_query_file(TWITTER_QUERIES, schema, use_cache=False)
+    assert [name for name, _ in compiled.queries] == ['user_info']
+    assert compiled.keys == {'user_info': ['Users.id']}
+    assert sorted(name for name, _ in compiled.skipped) == ['dms', 'notifications', 'query0', 'user_timeline']
+
+
+@pytest.mark.parametrize('on', ['t.user_id = u.id', 'u.id = t.user_id'])
+def test_join_keeps_the_from_tables_rows(parser, data_root, on):
+    # as the hand-written TweetsWithUserInfo: every tweet by a known user
+    schema, tables = load('twitter', data_root)
+    query = sql_translator.translate('SELECT * FROM Tweets t JOIN Users u ON %s' % on, 'tweets_with_users', schema)
+    expected = view(hand_written([Filter('TweetsWithUserInfo', ['Tweets', 'Users'], ['Tweets.user_id IN Users.id'],
+                                         on=True)], schema), schema, tables)
+    assert sum(expected.values()) == len(tables['Tweets']['id'])
+    assert view(query.to_dataflow(schema), schema, tables) == expected
+
+
+@pytest.mark.parametrize('sql', [
+    'SELECT * FROM Tweets t LEFT JOIN Users u ON t.user_id = u.id',
+    'SELECT t.id t_id FROM Tweets t',
+    'SELECT * FROM Tweets WHERE user_id IN (SELECT followed_id FROM Follows WHERE user_id = ?)',
+    'SELECT * FROM Tweets t JOIN Users u ON t.user_id = u.id WHERE u.id = ?',
+    'SELECT * FROM Tweets t JOIN Users u ON t.user_id = u.id WHERE u.is_private = 1',
+])
+def test_unsupported_queries_are_skipped(parser, sql):
+    schema = prototype.load_schema(prototype.SCHEMAS['twitter'])
+    _, _, skipped = sql_translator.compile_queries('q: %s;' % sql, schema)
+    assert [name for name, _ in skipped] == ['q']
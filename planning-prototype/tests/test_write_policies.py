@@ -0,0 +1,110 @@
+import pytest
+import write_policies
+
+
+@pytest.fixture
+def store():
+    # user 0 chairs the conference, users 1 and 2 author papers 7 and 3. the
+    # Submissions policy compares the writer's role with a paper's authors
+    connection = write_policies.open_store()
+    with connection:
+        connection.execute("INSERT INTO ConfMeta (phase) VALUES ('submission')")
+        connection.executemany('INSERT INTO People (pid, name, role) VALUES (?, ?, ?)',
+                               [(0, 'alana', 'chair'), (1, 'bo', 'bo'), (2, 'cy', 'cy')])
+        connection.executemany('INSERT INTO Submissions (sid, primary_author, authors, title) VALUES (?, ?, ?, ?)',
+                               [(7, 'bo', 'bo', 'seven'), (3, 'cy', 'cy', 'three')])
+    return connection
+
+
+def engine(store, use_cache=True, max_cache_entries=write_policies.DEFAULT_CACHE_ENTRIES):
+    return write_policies.WritePolicyEngine(write_policies.load_write_policies(), store, use_cache=use_cache,
+                                            max_cache_entries=max_cache_entries)
+
+
+def titles(store):
+    return dict(store.execute('SELECT sid, title FROM Submissions'))
+
+
+@pytest.mark.parametrize('use_cache', [True, False])
+def test_update_checks_the_rows_it_selects(store, use_cache):
+    # the paper is the row where selects, not a column the write has to repeat
+    e = engine(store, use_cache)
+    assert e.update('Submissions', {'title': 'new'}, uid=1, where='sid = ?', parameters=(7,)) == 1
+    assert e.update('Submissions', {'title': 'nope'}, uid=1, where='sid = ?', parameters=(3,)) == 0
+    assert titles(store) == {7: 'new', 3: 'three'}
+
+
+@pytest.mark.parametrize('use_cache', [True, False])
+def test_update_cannot_claim_another_row(store, use_cache):
+    # writing the sid of a paper the user authors does not make paper 3 theirs
+    e = engine(store, use_cache)
+    assert e.update('Submissions', {'sid': 7, 'title': 'pwned'}, uid=1, where='sid = ?', parameters=(3,)) == 0
+    assert e.update('Submissions', {'sid': 3, 'title': 'pwned'}, uid=1, where='sid = ?', parameters=(7,)) == 0
+    assert titles(store) == {7: 'seven', 3: 'three'}
+
+
+def test_update_is_denied_if_any_row_is(store):
+    e = engine(store)
+    assert e.update('Submissions', {'title': 'all'}, uid=1) == 0
+    assert titles(store) == {7: 'seven', 3: 'three'}
+    assert e.update('Submissions', {'title': 'all'}, uid=1, where='sid IN (?, ?)', parameters=(7, 7)) == 1
+
+
+def test_update_outside_the_submission_phase_is_denied(store):
+    e = engine(store)
+    assert e.update('ConfMeta', {'phase': 'review'}, uid=1) == 0
+    assert e.update('ConfMeta', {'phase': 'review'}, uid=0) == 1
+    assert e.update('Submissions', {'title': 'late'}, uid=1, where='sid = ?', parameters=(7,)) == 0
+
+
+def test_reviewers_are_assigned_by_the_chair(store):
+    e = engine(store)
+    assert e.insert('Reviewers', {'pid': 2, 'sid': 7}, uid=1) == 0
+    assert e.insert('Reviewers', {'pid': 2, 'sid': 7}, uid=0) == 1
+    assert e.update('Reviewers', {'sid': 3}, uid=2, where='pid = ?', parameters=(2,)) == 0
+    assert e.update('Reviewers', {'sid': 3}, uid=0, where='pid = ?', parameters=(2,)) == 1
+    assert list(store.execute('SELECT pid, sid FROM Reviewers')) == [(2, 3)]
+
+
+def test_people_policy_compares_the_written_role(store):
+    # UPDATE.role is the role written, or the row's own if the write leaves it alone
+    e = engine(store)
+    assert e.update('People', {'role': 'chair'}, uid=1, where='pid = ?', parameters=(2,)) == 1
+    assert e.update('People', {'name': 'bob'}, uid=1, where='pid = ?', parameters=(1,)) == 0
+    assert e.update('People', {'name': 'alana b'}, uid=1, where='pid = ?', parameters=(0,)) == 1
+
+
+def role_key(uid):
+    return ('SELECT role FROM People WHERE pid = :uid', (uid,))
+
+
+def test_role_update_drops_the_cached_role(store):
+    # user 2 is denied as an author, promoted by the chair and then allowed: the
+    # role read for the first insert is not reused
+    e = engine(store)
+    assert e.insert('Reviewers', {'pid': 1, 'sid': 7}, uid=2) == 0
+    assert role_key(2) in e.cache.values
+    assert e.update('People', {'role': 'chair'}, uid=0, where='pid = ?', parameters=(2,)) == 1
+    assert role_key(2) not in e.cache.values
+    assert e.insert('Reviewers', {'pid': 1, 'sid': 7}, uid=2) == 1
+
+
+def test_cached_role_survives_unrelated_updates(store):
+    e = engine(store)
+    assert e.insert('Reviewers', {'pid': 1, 'sid': 7}, uid=0) == 1
+    assert e.update('People', {'name': 'alana b'}, uid=0, where='pid = ?', parameters=(0,)) == 1
+    assert e.update('Submissions', {'title': 'new'}, uid=1, where='sid = ?', parameters=(7,)) == 1
+    assert role_key(0) in e.cache.values
+    cached = e.cache.values[role_key(0)]
+    assert e.insert('Reviewers', {'pid': 2, 'sid': 3}, uid=0) == 1
+    assert e.cache.values[role_key(0)] is cached
+
+
+def test_cached_role_survives_eviction_while_in_use(store):
+    # the chair's role, read on every write, outlives the roles read once
+    e = engine(store, max_cache_entries=2)
+    for uid in (0, 1, 0, 2):
+        e.insert('Reviewers', {'pid': uid, 'sid': 7}, uid=uid)
+    assert len(e.cache) == 2
+    assert role_key(0) in e.cache.values
+    assert role_key(1) not in e.cache.values
@@ -0,0 +1,96 @@
+# Planner tracing: leveled trace messages, counters and per-phase timers.
+#
+# Messages are only formatted when their level is enabled, so a disabled trace
+# call in a hot loop costs a function call and a comparison. Hot paths that would
+# build an expensive argument guard on enabled() first. Messages go to stderr,
+# which keeps stdout for plans.
+#
+# Counters and timers are always collected and add up until reset() is called. The
+# entry points reset them before any graph is built, so that graph construction is
+# counted too: the prototype CLI once per benchmark, PlannerSession once per change.
+#
+#   tracing.reset()
+#   plans = planning.planning(queries, policies)
+#   tracing.stats()['counters']['swaps_accepted']
+import contextlib
+import sys
+import time
+
+OFF = 0
+INFO = 1
+DEBUG = 2
+LEVELS = {'off': OFF, 'info': INFO, 'debug': DEBUG}
+
+LEVEL = OFF
+STREAM = sys.stderr
+
+COUNTERS = {}
+TIMERS = {}
+
+
+def set_level(level):
+    global LEVEL
+    if isinstance(level, str):
+        if level.lower() not in LEVELS:
+            raise ValueError("unknown trace level %s" % level)
+        level = LEVELS[level.lower()]
+    LEVEL = level
+
+
+def enabled(level):
+    return LEVEL >= level
+
+
+def emit(level, message, args):
+    if len(args) > 0:
+        message = message % args
+    STREAM.write('[%s] %s\n' % ('info' if level == INFO else 'debug', message))
+
+
+def info(message, *args):
+    if LEVEL >= INFO:
+        emit(INFO, message, args)
+
+
+def debug(message, *args):
+    if LEVEL >= DEBUG:
+        emit(DEBUG, message, args)
+
+
+def count(name, amount=1):
+    COUNTERS[name] = COUNTERS.get(name, 0) + amount
+
+
+def peak(name, value):
+    # counters that keep the largest value seen, e.g. the size of a search frontier
+    if value > COUNTERS.get(name, 0):
+        COUNTERS[name] = value
+
+
+@contextlib.contextmanager
+def phase(name):
+    # time spent in the block is added to the phase's timer
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        TIMERS[name] = TIMERS.get(name, 0.0) + elapsed
+        debug("phase %s took %.4fs", name, elapsed)
+
+
+def reset():
+    COUNTERS.clear()
+    TIMERS.clear()
+
+
+def stats():
+    return {'counters': dict(COUNTERS), 'timers': dict(TIMERS)}
+
+
+def format_stats(snapshot=None):
+    if snapshot is None:
+        snapshot = stats()
+    lines = ['%-24s %d' % (name, value) for name, value in sorted(snapshot['counters'].items())]
+    lines += ['%-24s %.4fs' % (name, value) for name, value in sorted(snapshot['timers'].items())]
+    return '\n'.join(lines)
@@ -0,0 +1,85 @@
+# Universe sharing analysis.
+# A node is per-universe if its own predicate mentions $UID or it reads from a
+# per-universe node; every other node is global and computed once for all users.
+import planning
+from cost import CostModel, is_user_dependent
+
+GLOBAL = 'global'
+UNIVERSE = 'universe'
+
+
+def classify_universes(graph):
+    classes = {}
+    for node in graph.topological_order():
+        per_universe = is_user_dependent(node) or any(classes[parent.name] == UNIVERSE for parent in graph.predecessors(node))
+        classes[node.name] = UNIVERSE if per_universe else GLOBAL
+    return classes
+
+
+def user_boundary(graph, classes=None):
+    # edges from a global node into a per-universe node
+    if classes is None:
+        classes = classify_universes(graph)
+    boundary = []
+    for node in graph.keys():
+        if classes[node.name] != GLOBAL:
+            continue
+        for child in graph.successors(node):
+            if classes[child.name] == UNIVERSE:
+                boundary.append((node, child))
+    return boundary
+
+
+def hoist_global_nodes(graph, names=None):
+    # pushes $UID dependent nodes below user independent operations that commute with
+    # them, so that the user independent work moves above the user boundary and is
+    # shared by every universe. only the nodes in names are moved, if given. returns
+    # the number of swaps made.
+    classes = classify_universes(graph)
+    swaps = 0
+    for node in graph.topological_order():
+        if not is_user_dependent(node) or (names is not None and node.name not in names):
+            continue
+        while True:
+            children = graph.successors(node)
+            if len(children) != 1:
+                break
+            child = children[0]
+            if child.operation_type is None or is_user_dependent(child) or not planning.sole_input(graph, node, child):
+                break
+            other_parents = [parent for parent in graph.predecessors(child) if parent.name != node.name]
+            if any(classes[parent.name] == UNIVERSE for parent in other_parents):
+                break
+            if not planning.check_commutativity(node, child):
+                break
+            planning.swap_nodes(graph, node, child)
+            # child now reads node's old inputs; everything downstream of node is unchanged
+            per_universe = any(classes[parent.name] == UNIVERSE for parent in graph.predecessors(child))
+            classes[child.name] = UNIVERSE if per_universe else GLOBAL
+            swaps += 1
+    return swaps
+
+
+def project_universes(graph, users, cost_function=None):
+    # projected node count and state when the graph is instantiated for users
+    # concurrent universes: global nodes exist once, per-universe nodes once per user.
+    if cost_function is None:
+        cost_function = CostModel()
+    classes = classify_universes(graph)
+    estimates = cost_function.estimate(graph)
+
+    global_nodes = [name for name, cls in classes.items() if cls == GLOBAL]
+    universe_nodes = [name for name, cls in classes.items() if cls == UNIVERSE]
+    global_state = sum(estimates[name].rows for name in global_nodes)
+    universe_state = sum(estimates[name].rows for name in universe_nodes)
+
+    return {
+        'users': users,
+        'global_nodes': len(global_nodes),
+        'universe_nodes': len(universe_nodes),
+        'boundary_edges': len(user_boundary(graph, classes)),
+        'total_nodes': len(global_nodes) + users * len(universe_nodes),
+        'global_state': global_state,
+        'universe_state': universe_state,
+        'total_state': global_state + users * universe_state,
+    }
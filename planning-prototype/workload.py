@@ -0,0 +1,137 @@
+# Synthetic workloads for measuring how the planner scales: a schema of generated
+# tables, policy chains over them and queries reading the tables the policies
+# export. Everything is drawn from a seeded random generator, so a size point
+# always produces the same workload.
+#
+# Every table has the columns id, owner_id, group_id, flag and c0..cN. Policy
+# chains mix user dependent filters ("$UID IN V.owner_id"), global filters,
+# membership filters against per-user helper views shared between policies,
+# anonymizing transforms and, at the end of a chain, aggregates. Queries filter
+# and join exported tables and may end in an aggregate.
+import random
+from catalog import Catalog, Column, Table
+from dataflow import Aggregate, Filter, Function, Transform
+
+USER_FILTER = 'user-filter'
+GLOBAL_FILTER = 'global-filter'
+MEMBERSHIP = 'membership'
+ANONYMIZE = 'anonymize'
+AGGREGATE = 'aggregate'
+
+# relative frequency of each kind of policy operation
+POLICY_MIX = {USER_FILTER: 3, GLOBAL_FILTER: 2, MEMBERSHIP: 2, ANONYMIZE: 2, AGGREGATE: 1}
+
+
+class Workload:
+    def __init__(self, schema, policies, queries, parameters):
+        self.schema = schema
+        self.policies = policies
+        self.queries = queries
+        self.parameters = parameters
+
+    def __repr__(self):
+        return "<Workload: %s>" % self.parameters
+
+
+def generate_schema(tables, columns=4):
+    schema = Catalog()
+    for i in range(tables):
+        table = Table('T%d' % i)
+        for name in ['id', 'owner_id', 'group_id'] + ['c%d' % c for c in range(columns)]:
+            table.add_column(Column(name, 'int', nullable=False))
+        table.add_column(Column('flag', 'boolean'))
+        table.add_index(['id'], primary=True)
+        table.add_index(['owner_id'])
+        schema.add_table(table)
+    return schema
+
+
+def pick(rng, mix):
+    kinds = sorted(mix)
+    return rng.choices(kinds, weights=[mix[kind] for kind in kinds])[0]
+
+
+def policy_chain(rng, index, table, schema, depth, helpers, mix):
+    # the operations of one policy over table, each reading the previous view
+    chain = []
+    prev = table
+    tables = sorted(schema.keys())
+    for step in range(depth):
+        last = step == depth - 1
+        name = 'P%d_%d' % (index, step)
+        exported_as = table if last else None
+        kind = pick(rng, mix)
+        while kind == AGGREGATE and not last:
+            kind = pick(rng, mix)
+
+        if kind == USER_FILTER:
+            chain.append(Filter(name, [prev], ["$UID IN %s.owner_id" % prev], policy=True, exported_as=exported_as))
+        elif kind == GLOBAL_FILTER:
+            chain.append(Filter(name, [prev], ["True IN %s.flag" % prev], policy=True, exported_as=exported_as))
+        elif kind == MEMBERSHIP:
+            # helper views are named after their table, so policies that use the same
+            # helper share it once the policy graphs are merged
+            other = rng.choice(tables)
+            helper = 'MyGroups%s' % other
+            if helper not in helpers:
+                helpers[helper] = Filter(helper, [other], ["$UID IN %s.owner_id" % other], policy=True)
+            if all(op.new_view_name != helper for op in chain):
+                chain.insert(0, helpers[helper])
+            chain.append(Filter(name, [prev, helper], ["%s.group_id IN %s.group_id" % (prev, helper)],
+                                policy=True, exported_as=exported_as))
+        elif kind == ANONYMIZE:
+            column = 'c%d' % rng.randrange(len(schema[table]) - 4)
+            predicates = ["%s.%s => 'NULL'" % (prev, column)]
+            if rng.random() < 0.5:
+                predicates.insert(0, "True IN %s.flag" % prev)
+            chain.append(Transform(name, [prev], predicates, policy=True, exported_as=exported_as))
+        else:
+            chain.append(Aggregate(name, "count(*)", [prev], "%s.group_id" % prev, None,
+                                   groupby="%s.group_id" % prev, policy=True, exported_as=exported_as))
+        prev = name
+    return chain
+
+
+def query_chain(rng, index, tables, depth):
+    chain = []
+    prev = rng.choice(tables)
+    for step in range(depth):
+        name = 'Q%d_%d' % (index, step)
+        roll = rng.random()
+        if step == depth - 1 and roll < 0.3:
+            chain.append(Aggregate(name, "count(*)", [prev], "%s.group_id" % prev, None,
+                                   groupby="%s.group_id" % prev, policy=False))
+        elif roll < 0.6:
+            other = rng.choice(tables)
+            chain.append(Filter(name, [prev, other], ["%s.group_id IN %s.group_id" % (prev, other)],
+                                on=True, policy=False))
+        else:
+            chain.append(Filter(name, [prev], ["True IN %s.flag" % prev], policy=False))
+        prev = name
+    return chain
+
+
+def generate_workload(policies=4, queries=2, depth=3, tables=None, columns=4, seed=0, mix=None):
+    # tables defaults to one per policy, so every policy exports its own table
+    rng = random.Random(seed)
+    if tables is None:
+        tables = max(policies, 2)
+    if mix is None:
+        mix = POLICY_MIX
+    schema = generate_schema(tables, columns)
+    names = sorted(schema.keys())
+
+    helpers = {}
+    policy_graphs = []
+    for i in range(policies):
+        chain = policy_chain(rng, i, names[i % len(names)], schema, depth, helpers, mix)
+        policy_graphs.append(Function(chain, schema).to_dataflow(schema))
+
+    query_graphs = []
+    for i in range(queries):
+        chain = query_chain(rng, i, names, depth)
+        query_graphs.append(Function(chain, schema).to_dataflow(schema))
+
+    parameters = {'policies': policies, 'queries': queries, 'depth': depth, 'tables': tables,
+                  'columns': columns, 'seed': seed}
+    return Workload(schema, policy_graphs, query_graphs, parameters)
@@ -0,0 +1,513 @@
+# Write policy engine for the JSON write policies (write-translation/hotcrp-policies.json):
+#
+#   {"columns": "ConfMeta.phase", "type": "update",
+#    "condition_vars": [{"updater_role": "SELECT role FROM People WHERE pid = UserContext.id"}],
+#    "predicate": "WHERE updater_role = 'chair'"}
+#
+# A write is allowed if the predicate of every policy covering the table and the
+# columns it writes holds. Condition vars are SQL queries over the store, evaluated
+# in the same transaction as the write (see benchmarks/hotcrp/hotcrp-write-policies.txt);
+# UserContext.id is the writing user and UPDATE.col (or INSERT.col, WRITE.col) the
+# value the write gives col.
+#
+# An update is checked for every row its WHERE selects, with the values written
+# merged over the row's own: UPDATE.col is the row's value for a column the write
+# leaves alone. The condition vars are read both for the row as it will be and for
+# the row as it is, so a write can neither reach a row the user may not write nor
+# move one there (setting UPDATE.sid to a paper the user authors does not make
+# another paper theirs). If any row is denied, nothing is written.
+#
+# Policies are compiled once: they are indexed by table, kind of write and column,
+# predicates become Python callables and, for each shape of write (table, kind,
+# columns written), the condition vars of every applicable policy are bundled into
+# one UNION ALL query. Checking a write is a dict lookup, a single query and a call
+# per applicable policy, however many policies there are.
+#
+# Predicates are disjunctions (OR) of conjunctions (AND) of comparisons. Both sides
+# of a comparison are sets of values, since a condition var holds every row its
+# query returns: "a IN b" and "a = b" hold if the sets share a value, "NOT IN", "!="
+# and "<>" if they do not. A name that is not a condition var of the policy is an
+# empty set, so a comparison against it never grants a write; it is reported in
+# the engine's warnings.
+#
+# Condition var values are cached, keyed by their query and the parameters bound
+# into it (for an update, the values of the row checked), the least recently used
+# dropped first. A write through the engine drops exactly the cached values that
+# read the table and columns it wrote: an update drops values whose query names one
+# of the updated columns, an insert every value read from the table. Writes that
+# go around the engine have to call invalidate() themselves.
+import json
+import os
+import re
+import sqlite3
+import time
+import tracing
+
+UPDATE = 'update'
+INSERT = 'insert'
+BOTH = 'both'
+KINDS = {UPDATE: (UPDATE,), INSERT: (INSERT,), BOTH: (UPDATE, INSERT)}
+
+WRITE_TRANSLATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'write-translation')
+DEFAULT_POLICIES = os.path.join(WRITE_TRANSLATION_DIR, 'hotcrp-policies.json')
+DEFAULT_SCHEMA = os.path.join(WRITE_TRANSLATION_DIR, 'schema.sql')
+
+NAME_PATTERN = re.compile(r'^\w+$')
+INTO_PATTERN = re.compile(r'\s+INTO\s+@\w+', re.IGNORECASE)
+SELECT_PATTERN = re.compile(r'^\s*SELECT\s+(.*?)\s+FROM\s+(.*?)\s*;?\s*$', re.IGNORECASE | re.DOTALL)
+USER_PATTERN = re.compile(r'\bUserContext\.id\b', re.IGNORECASE)
+WRITE_PATTERN = re.compile(r'\b(?:UPDATE|INSERT|WRITE)\.(\w+)', re.IGNORECASE)
+OR_PATTERN = re.compile(r'\s+OR\s+', re.IGNORECASE)
+AND_PATTERN = re.compile(r'\s+AND\s+', re.IGNORECASE)
+COMPARISON_PATTERN = re.compile(r'\s*(NOT\s+IN\b|\bIN\b|!=|<>|=)\s*', re.IGNORECASE)
+NUMBER_PATTERN = re.compile(r'^-?\d+(\.\d+)?$')
+PARAMETER_PATTERN = re.compile(r':(\w+)')
+FROM_PATTERN = re.compile(r'\bFROM\s+(.*?)(?=\s+(?:WHERE|GROUP|ORDER|LIMIT|HAVING)\b|$)', re.IGNORECASE | re.DOTALL)
+JOIN_PATTERN = re.compile(r'\s+(?:(?:INNER|LEFT|RIGHT|CROSS|OUTER)\s+)*JOIN\s+', re.IGNORECASE)
+WORD_PATTERN = re.compile(r"'[^']*'|\"[^\"]*\"|[:@]?\w+(?:\.\w+)?|\*")
+SQL_WORDS = {'select', 'from', 'where', 'and', 'or', 'not', 'in', 'is', 'null', 'as', 'on', 'join', 'inner',
+             'left', 'right', 'cross', 'outer', 'group', 'order', 'by', 'limit', 'having', 'distinct', 'like',
+             'between', 'exists', 'count', 'sum', 'min', 'max', 'avg', 'asc', 'desc'}
+EMPTY = frozenset()
+DEFAULT_CACHE_ENTRIES = 100000
+
+
+class WritePolicy:
+    # table, columns (None for all of them), kinds of write, condition vars as
+    # (name, sql) pairs, the predicate text and its compiled form
+    __slots__ = ('table', 'columns', 'kinds', 'condition_vars', 'predicate', 'description', 'unknown', 'check')
+
+    def __init__(self, table, columns, kinds, condition_vars, predicate, description=None):
+        self.table = table
+        self.columns = columns
+        self.kinds = kinds
+        self.condition_vars = condition_vars
+        self.predicate = predicate
+        self.description = description
+        self.unknown = []
+        self.check = compile_predicate(predicate, [name for name, _ in condition_vars], self.unknown)
+
+    def __repr__(self):
+        columns = '*' if self.columns is None else ','.join(self.columns)
+        return "<WritePolicy: %s.%s %s %s>" % (self.table, columns, '/'.join(self.kinds), self.predicate)
+
+
+class WriteCheck:
+    # everything needed to check one shape of write: the applicable policies, the
+    # bundled condition var query and, per policy, the query slot of each of its vars
+    # (queries are normalized, see normalize_query). bundled holds the UNION ALL of
+    # every set of slots that had to be read so far.
+    __slots__ = ('policies', 'queries', 'slots', 'parameters', 'bundled')
+
+    def __init__(self, policies):
+        self.policies = policies
+        self.queries = []
+        self.slots = []
+        self.parameters = []
+        self.bundled = {}
+        seen = {}
+        for policy in policies:
+            slots = []
+            for _, sql in policy.condition_vars:
+                sql = normalize_query(sql)
+                if sql not in seen:
+                    seen[sql] = len(self.queries)
+                    self.queries.append(sql)
+                    self.parameters.append(tuple(PARAMETER_PATTERN.findall(sql)))
+                slots.append(seen[sql])
+            self.slots.append(slots)
+
+    def bundle(self, slots):
+        sql = self.bundled.get(slots)
+        if sql is None:
+            sql = self.bundled[slots] = ' UNION ALL '.join(labelled_select(self.queries[slot], slot) for slot in slots)
+        return sql
+
+    def read(self, connection, values, uid, cache):
+        # the values of every condition var, from the cache where it has them and
+        # otherwise from a single query; values are bound to the UPDATE.col in them
+        bindings = {}
+        for names in self.parameters:
+            for name in names:
+                if name not in bindings:
+                    bindings[name] = uid if name == 'uid' else lookup(values, name[len('write_'):])
+        results = [None] * len(self.queries)
+        keys = [(sql, tuple(bindings[name] for name in names)) for sql, names in zip(self.queries, self.parameters)]
+        missing = []
+        for slot, key in enumerate(keys):
+            if cache is not None:
+                results[slot] = cache.get(key)
+            if results[slot] is None:
+                missing.append(slot)
+                results[slot] = set()
+        if len(missing) > 0:
+            for slot, value in connection.execute(self.bundle(tuple(missing)), bindings):
+                results[slot].add(value)
+            if cache is not None:
+                for slot in missing:
+                    cache.put(keys[slot], frozenset(results[slot]))
+        return results
+
+    def violations(self, connection, values, uid, cache=None, bound=None):
+        # the policies a write of values by uid violates. bound, if given, is what
+        # the condition vars are read for instead of values (see WritePolicyEngine.rows)
+        results = []
+        if len(self.queries) > 0:
+            results = self.read(connection, values if bound is None else bound, uid, cache)
+        violated = []
+        for policy, slots in zip(self.policies, self.slots):
+            if not policy.check([results[slot] for slot in slots], values, uid):
+                violated.append(policy)
+        return violated
+
+
+class ConditionCache:
+    # condition var values by (normalized query, bound parameters). every value is
+    # indexed under the columns its query names, or under its table if it names
+    # every column (SELECT *); the least recently used values are dropped beyond
+    # max_entries.
+    def __init__(self, max_entries=DEFAULT_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.values = {}
+        self.by_column = {}
+        self.by_table = {}
+        self.dependencies = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def get(self, key):
+        value = self.values.get(key)
+        tracing.count('condition_cache_hits' if value is not None else 'condition_cache_misses')
+        if value is not None:
+            # values are kept in order of use, the least recently used first
+            self.values[key] = self.values.pop(key)
+        return value
+
+    def put(self, key, value):
+        if key in self.values:
+            self.drop(key)
+        while len(self.values) >= self.max_entries:
+            self.drop(next(iter(self.values)))
+        self.values[key] = value
+        tables, columns = query_dependencies(key[0])
+        self.dependencies[key] = (tables, columns)
+        for table in tables:
+            self.by_table.setdefault(table, set()).add(key)
+            if columns is not None:
+                for column in columns:
+                    self.by_column.setdefault((table, column), set()).add(key)
+
+    def drop(self, key):
+        del self.values[key]
+        tables, columns = self.dependencies.pop(key)
+        for table in tables:
+            self.by_table[table].discard(key)
+            if columns is not None:
+                for column in columns:
+                    self.by_column[(table, column)].discard(key)
+
+    def invalidate(self, table, columns=None):
+        # drops the values a write to columns of table (every column if None) can change
+        table = table.lower()
+        if columns is None:
+            stale = set(self.by_table.get(table, ()))
+        else:
+            stale = {key for key in self.by_table.get(table, ()) if self.dependencies[key][1] is None}
+            for column in columns:
+                stale.update(self.by_column.get((table, column.lower()), ()))
+        for key in stale:
+            self.drop(key)
+        tracing.count('condition_cache_invalidations', len(stale))
+        return len(stale)
+
+    def clear(self):
+        self.values.clear()
+        self.by_column.clear()
+        self.by_table.clear()
+        self.dependencies.clear()
+
+
+class WritePolicyEngine:
+    def __init__(self, policies, connection, use_cache=True, max_cache_entries=DEFAULT_CACHE_ENTRIES):
+        self.policies = policies
+        self.connection = connection
+        self.cache = ConditionCache(max_cache_entries) if use_cache else None
+        # (table, kind) -> policies on every column, and column -> policies on it
+        self.whole_table = {}
+        self.by_column = {}
+        for policy in policies:
+            for kind in policy.kinds:
+                key = (policy.table.lower(), kind)
+                if policy.columns is None:
+                    self.whole_table.setdefault(key, []).append(policy)
+                else:
+                    for column in policy.columns:
+                        self.by_column.setdefault(key, {}).setdefault(column, []).append(policy)
+        self.checks = {}
+
+    def warnings(self):
+        return ["%s: unknown name %s" % (policy, name) for policy in self.policies for name in policy.unknown]
+
+    def applicable(self, table, kind, columns):
+        key = (table.lower(), kind)
+        policies = list(self.whole_table.get(key, []))
+        by_column = self.by_column.get(key, {})
+        for column in columns:
+            for policy in by_column.get(column.lower(), []):
+                if policy not in policies:
+                    policies.append(policy)
+        return policies
+
+    def write_check(self, table, kind, columns):
+        key = (table.lower(), kind, frozenset(column.lower() for column in columns))
+        check = self.checks.get(key)
+        if check is None:
+            check = self.checks[key] = WriteCheck(self.applicable(table, kind, columns))
+        return check
+
+    def check(self, table, kind, values, uid):
+        return self.write_check(table, kind, values.keys()).violations(self.connection, values, uid, self.cache)
+
+    def invalidate(self, table, columns=None):
+        if self.cache is not None:
+            self.cache.invalidate(table, columns)
+
+    def insert(self, table, values, uid):
+        # inserts the row if no policy forbids it; returns the number of rows written
+        columns = list(values.keys())
+        sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+            identifier(table), ', '.join(identifier(c) for c in columns), ', '.join('?' * len(columns)))
+        return self.write(table, INSERT, values, uid, sql, [values[c] for c in columns])
+
+    def update(self, table, values, uid, where=None, parameters=()):
+        # sets values on the rows matching where; returns the number of rows written
+        columns = list(values.keys())
+        sql = 'UPDATE %s SET %s' % (identifier(table), ', '.join('%s = ?' % identifier(c) for c in columns))
+        if where is not None:
+            sql += ' WHERE ' + where
+        return self.write(table, UPDATE, values, uid, sql, [values[c] for c in columns] + list(parameters),
+                          where, parameters)
+
+    def rows(self, table, where, parameters):
+        # the rows an update selects, as dicts of column to value
+        sql = 'SELECT * FROM %s' % identifier(table)
+        if where is not None:
+            sql += ' WHERE ' + where
+        cursor = self.connection.execute(sql, parameters)
+        names = [column[0] for column in cursor.description]
+        return [dict(zip(names, row)) for row in cursor]
+
+    def denied(self, check, table, kind, values, uid, where, parameters):
+        if kind != UPDATE:
+            return len(check.violations(self.connection, values, uid, self.cache)) > 0
+        for old in self.rows(table, where, parameters):
+            new = dict(old)
+            for column, value in values.items():
+                new.pop(lookup_name(new, column), None)
+                new[column] = value
+            if len(check.violations(self.connection, new, uid, self.cache)) > 0:
+                return True
+            if new != old and len(check.violations(self.connection, new, uid, self.cache, bound=old)) > 0:
+                return True
+        return False
+
+    def write(self, table, kind, values, uid, sql, arguments, where=None, parameters=()):
+        # the condition vars and the rows an update selects are read in the
+        # transaction that writes, so they cannot change between the check and the write
+        check = self.write_check(table, kind, values.keys())
+        with self.connection:
+            if not self.connection.in_transaction:
+                self.connection.execute('BEGIN IMMEDIATE')
+            if self.denied(check, table, kind, values, uid, where, parameters):
+                return 0
+            rows = self.connection.execute(sql, arguments).rowcount
+            if rows > 0:
+                self.invalidate(table, values.keys() if kind == UPDATE else None)
+            return rows
+
+
+def identifier(name):
+    if NAME_PATTERN.match(name) is None:
+        raise ValueError("invalid identifier %s" % name)
+    return '"%s"' % name
+
+
+def lookup_name(values, column):
+    # the key of values that names column, compared without case
+    if column in values:
+        return column
+    lowered = column.lower()
+    for name in values:
+        if name.lower() == lowered:
+            return name
+    return None
+
+
+def lookup(values, column):
+    name = lookup_name(values, column)
+    return None if name is None else values[name]
+
+
+def normalize_query(sql):
+    # "SELECT role INTO @r FROM People WHERE pid = UserContext.id"
+    #   -> "SELECT role FROM People WHERE pid = :uid"
+    sql = INTO_PATTERN.sub('', sql)
+    sql = USER_PATTERN.sub(':uid', sql)
+    sql = WRITE_PATTERN.sub(lambda m: ':write_' + m.group(1), sql)
+    return ' '.join(sql.strip().rstrip(';').split())
+
+
+def labelled_select(sql, slot):
+    # "SELECT role FROM People ..." -> "SELECT 0, role FROM People ..."
+    match = SELECT_PATTERN.match(sql)
+    if match is None:
+        raise ValueError("condition var is not a SELECT ... FROM query: %s" % sql)
+    return 'SELECT %d, %s FROM %s' % (slot, match.group(1), match.group(2))
+
+
+def query_dependencies(sql):
+    # the tables a normalized query reads and the column names it mentions, None
+    # if it reads every column. names the query mentions are a superset of the
+    # columns its result depends on, which is all invalidation needs.
+    tables = []
+    for clause in FROM_PATTERN.findall(sql):
+        for source in clause.split(','):
+            for part in JOIN_PATTERN.split(source):
+                words = part.split()
+                if len(words) > 0:
+                    tables.append(words[0].strip('`"').lower())
+    columns = set()
+    for word in WORD_PATTERN.findall(sql):
+        if word == '*':
+            return tables, None
+        if word[0] in ('\'', '"', ':', '@') or word.isdigit():
+            continue
+        word = word.rsplit('.', 1)[-1].lower()
+        if word not in SQL_WORDS and word not in tables:
+            columns.add(word)
+    return tables, columns
+
+
+def parse_columns(spec):
+    # "Submissions.*" or "ConfMeta.phase, ConfMeta.deadline" -> table, columns
+    table = None
+    columns = []
+    for part in spec.split(','):
+        name, _, column = part.strip().partition('.')
+        if table is not None and name != table:
+            raise ValueError("policy covers more than one table: %s" % spec)
+        table = name
+        if column in ('*', ''):
+            return table, None
+        columns.append(column.lower())
+    return table, tuple(columns)
+
+
+def compile_operand(text, variables, unknown):
+    # a function of (condition var values, written values, uid) returning a set
+    text = text.strip()
+    if text[:1] in ('"', "'") and text[-1:] == text[:1]:
+        constant = frozenset([text[1:-1]])
+        return lambda results, values, uid: constant
+    if NUMBER_PATTERN.match(text) is not None:
+        constant = frozenset([float(text) if '.' in text else int(text)])
+        return lambda results, values, uid: constant
+    if USER_PATTERN.fullmatch(text) is not None:
+        return lambda results, values, uid: {uid}
+    written = WRITE_PATTERN.fullmatch(text)
+    if written is not None:
+        column = written.group(1)
+        return lambda results, values, uid: {lookup(values, column)}
+    if text in variables:
+        i = variables.index(text)
+        return lambda results, values, uid: results[i]
+    unknown.append(text)
+    return lambda results, values, uid: EMPTY
+
+
+def compile_comparison(text, variables, unknown):
+    parts = COMPARISON_PATTERN.split(text.strip(), maxsplit=1)
+    if len(parts) != 3:
+        raise ValueError("cannot parse comparison: %s" % text)
+    left, op, right = parts
+    left = compile_operand(left, variables, unknown)
+    right = compile_operand(right, variables, unknown)
+    if op.upper() in ('IN', '='):
+        return lambda results, values, uid: not left(results, values, uid).isdisjoint(right(results, values, uid))
+    return lambda results, values, uid: left(results, values, uid).isdisjoint(right(results, values, uid))
+
+
+def compile_predicate(text, variables, unknown):
+    # results holds the values of the condition vars, in the order of variables
+    text = re.sub(r'^\s*WHERE\s+', '', text, flags=re.IGNORECASE)
+    disjuncts = [[compile_comparison(comparison, variables, unknown) for comparison in AND_PATTERN.split(clause)]
+                 for clause in OR_PATTERN.split(text) if len(clause.strip()) > 0]
+    if len(disjuncts) == 0:
+        return lambda results, values, uid: True
+    return lambda results, values, uid: any(all(comparison(results, values, uid) for comparison in conjuncts)
+                                            for conjuncts in disjuncts)
+
+
+def parse_policy(entry):
+    table, columns = parse_columns(entry['columns'])
+    kind = entry.get('type', BOTH).lower()
+    if kind not in KINDS:
+        raise ValueError("unknown write policy type %s" % kind)
+    condition_vars = [(name, sql) for var in entry.get('condition_vars', []) for name, sql in var.items()]
+    return WritePolicy(table, columns, KINDS[kind], condition_vars, entry.get('predicate', ''),
+                       entry.get('description'))
+
+
+def load_write_policies(path=DEFAULT_POLICIES):
+    with open(path) as f:
+        return [parse_policy(entry) for entry in json.load(f)['policies']]
+
+
+def open_store(path=':memory:', schema_path=DEFAULT_SCHEMA):
+    connection = sqlite3.connect(path)
+    if schema_path is not None:
+        with open(schema_path) as f:
+            connection.executescript(f.read())
+    return connection
+
+
+def main():
+    # mirrors the rust prototype: the cost of a policy checked write against a plain one
+    import argparse
+    parser = argparse.ArgumentParser(description='Enforce write policies against a SQLite store.')
+    parser.add_argument('--policies', type=str, default=DEFAULT_POLICIES)
+    parser.add_argument('--schema', type=str, default=DEFAULT_SCHEMA)
+    parser.add_argument('--writes', type=int, default=10000)
+    parser.add_argument('--no-cache', action='store_true', help='read every condition var on every write')
+    args = parser.parse_args()
+
+    connection = open_store(schema_path=args.schema)
+    engine = WritePolicyEngine(load_write_policies(args.policies), connection, use_cache=not args.no_cache)
+    for warning in engine.warnings():
+        print('WARNING {}'.format(warning))
+    with connection:
+        connection.execute("INSERT INTO ConfMeta (phase) VALUES ('submission')")
+        connection.execute("INSERT INTO People (pid, name, role) VALUES (0, 'alana', 'chair')")
+
+    start = time.perf_counter()
+    with connection:
+        for i in range(args.writes):
+            connection.execute('INSERT INTO Reviewers (pid, sid) VALUES (?, ?)', (i, i))
+    plain = time.perf_counter() - start
+
+    start = time.perf_counter()
+    written = 0
+    for i in range(args.writes):
+        written += engine.insert('Reviewers', {'pid': i, 'sid': i}, uid=i % 2)
+    checked = time.perf_counter() - start
+    print('no policy: {:.2f}us/write'.format(plain / args.writes * 1e6))
+    print('policy: {:.2f}us/write, {}/{} writes allowed'.format(checked / args.writes * 1e6, written, args.writes))
+    counters = tracing.stats()['counters']
+    print('condition cache: {} hits, {} misses, {} invalidations'.format(
+        counters.get('condition_cache_hits', 0), counters.get('condition_cache_misses', 0),
+        counters.get('condition_cache_invalidations', 0)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+CREATE TABLE People (
+    pid int not null,
+    name text not null,
+    role text not null
+);
+
+CREATE TABLE Comments (
+    cid int not null,
+    pid int not null,
+    sid int not null,
+    comment text not null
+);
+
+CREATE TABLE Reviewers (
+    pid int not null,
+    sid int not null
+);
+
+CREATE TABLE ConfMeta (
+    phase text not null
+);
+
+CREATE TABLE Submissions (
+    sid int not null,
+    primary_author text not null,
+    authors text not null,
+    title text not null
+);